@@ -1,4 +1,5 @@
 from django.contrib import admin, messages
+from django.db import transaction
 from django.http import HttpResponseRedirect
 from django.shortcuts import render
 from .forms import ChangeCampaignForm, CopyToCampaignForm
@@ -33,7 +34,10 @@ class ThingAdmin(admin.ModelAdmin):
         if 'apply' in request.POST:
             form = ChangeCampaignForm(request.POST)
             if form.is_valid():
-                queryset.update(campaign=form.cleaned_data['campaign'])
+                with transaction.atomic():
+                    for thing in queryset:
+                        thing.campaign = form.cleaned_data['campaign']
+                        thing.save()
             messages.success(request, 'Changed the campaign.')
             return
         else:
@@ -0,0 +1,96 @@
+from collections import deque
+
+
+class Automaton(object):
+    __slots__ = ['transitions', 'depths', 'values', 'fail', 'outputs', 'is_built']
+
+    def __init__(self, patterns=()):
+        self.transitions = [{}]
+        self.depths = [0]
+        self.values = [None]
+        self.fail = [0]
+        self.outputs = [0]
+        self.is_built = False
+        for pattern, value in patterns:
+            self.add(pattern, value)
+
+    def find_node(self, pattern):
+        node = 0
+        for character in pattern:
+            node = self.transitions[node].get(character)
+            if node is None:
+                return None
+        return node
+
+    def add(self, pattern, value):
+        if not pattern:
+            return
+        node = 0
+        for character in pattern:
+            next_node = self.transitions[node].get(character)
+            if next_node is None:
+                next_node = len(self.transitions)
+                self.transitions.append({})
+                self.depths.append(self.depths[node] + 1)
+                self.values.append(None)
+                self.fail.append(0)
+                self.outputs.append(0)
+                self.transitions[node][character] = next_node
+                self.is_built = False
+            node = next_node
+        if self.values[node] is None:
+            self.values[node] = set()
+            self.is_built = False
+        self.values[node].add(value)
+
+    def remove(self, pattern, value):
+        node = self.find_node(pattern) if pattern else None
+        if node is not None and self.values[node]:
+            self.values[node].discard(value)
+
+    def build(self):
+        queue = deque()
+        for node in self.transitions[0].values():
+            self.fail[node] = 0
+            self.outputs[node] = 0
+            queue.append(node)
+        while queue:
+            node = queue.popleft()
+            for character, child in self.transitions[node].items():
+                fallback = self.fail[node]
+                while fallback and character not in self.transitions[fallback]:
+                    fallback = self.fail[fallback]
+                fail = self.transitions[fallback].get(character, 0)
+                self.fail[child] = fail
+                self.outputs[child] = fail if self.values[fail] is not None else self.outputs[fail]
+                queue.append(child)
+        self.is_built = True
+
+    def iter_matches(self, text):
+        if not self.is_built:
+            self.build()
+        transitions, fail, values, outputs, depths = self.transitions, self.fail, self.values, self.outputs, self.depths
+        node = 0
+        for end, character in enumerate(text, 1):
+            while node and character not in transitions[node]:
+                node = fail[node]
+            node = transitions[node].get(character, 0)
+            match = node if values[node] is not None else outputs[node]
+            while match:
+                if values[match]:
+                    yield end - depths[match], end, values[match]
+                match = outputs[match]
+
+    def find_longest(self, text):
+        longest = {}
+        for start, end, value in self.iter_matches(text):
+            if end > longest.get(start, (start, None))[0]:
+                longest[start] = (end, value)
+        matches = []
+        position = 0
+        for start in sorted(longest):
+            if start >= position:
+                end, value = longest[start]
+                matches.append((start, end, value))
+                position = end
+        return matches
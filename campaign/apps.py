@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class CampaignConfig(AppConfig):
     name = 'campaign'
+
+    def ready(self):
+        from . import signals
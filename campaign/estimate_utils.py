@@ -0,0 +1,155 @@
+import logging
+import math
+import threading
+from collections import OrderedDict, deque, namedtuple
+
+import numpy as np
+from django.db import connection
+
+from .generator_utils import MAX_NAMES_PER_QUERY, get_generator_plan
+from .models import AttributeValue, RandomAttribute, Thing
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_SAMPLES = 2000
+ROUTING_SAMPLES = 100
+MAX_DEPTH = 20
+MAX_EXACT_DRAWS = 2000000
+ESTIMATED_SECONDS_PER_THING = 0.0004
+MAX_SAVE_TIMINGS = 20
+
+CountEstimate = namedtuple('CountEstimate', ['thing_type', 'expected', 'p95', 'max'])
+GeneratorEstimate = namedtuple('GeneratorEstimate', ['generator_name', 'samples', 'counts', 'total', 'expected_queries', 'expected_seconds',
+                                                     'measured', 'truncated'])
+
+_save_timings = deque(maxlen=MAX_SAVE_TIMINGS)
+_save_timings_lock = threading.Lock()
+
+
+def record_save_time(things, seconds):
+    with _save_timings_lock:
+        _save_timings.append((things, seconds))
+
+
+def clear_save_timings():
+    with _save_timings_lock:
+        _save_timings.clear()
+
+
+def has_save_timings():
+    with _save_timings_lock:
+        return any(things for things, seconds in _save_timings)
+
+
+def get_seconds_per_thing():
+    with _save_timings_lock:
+        timings = list(_save_timings)
+    things = sum(things for things, seconds in timings)
+    if not things:
+        return ESTIMATED_SECONDS_PER_THING
+    return sum(seconds for things, seconds in timings) / things
+
+
+def sample_children(rng, container, instances):
+    if container.percent_chance_for_one:
+        return rng.binomial(instances, container.percent_chance_for_one / 100)
+    low, high = container.min_objects, container.max_objects
+    if low == high:
+        return instances * low
+    total_draws = int(instances.sum())
+    if total_draws <= MAX_EXACT_DRAWS:
+        draws = rng.integers(low, high + 1, size=total_draws)
+        owners = np.repeat(np.arange(len(instances)), instances)
+        return np.bincount(owners, weights=draws, minlength=len(instances)).astype(np.int64)
+    mean = instances * (low + high) / 2
+    std = np.sqrt(instances * ((high - low + 1) ** 2 - 1) / 12)
+    return np.clip(np.rint(rng.normal(mean, std)), instances * low, instances * high).astype(np.int64)
+
+
+def get_rows_per_thing(plan):
+    attribute_values = 1
+    random_attributes = 0
+    for field_mapping in plan.field_mappings:
+        if field_mapping.target_attribute:
+            attribute_values += 1
+        if field_mapping.parameter_attribute:
+            attribute_values += 1
+        if field_mapping.randomizer_attribute and field_mapping.randomizer_attribute.can_randomize_later and not field_mapping.field_name:
+            random_attributes += (1 + field_mapping.randomizer_attribute.max_options_to_use) / 2
+    attribute_values += len([c for c in plan.containers if c.attribute_for_container])
+    return attribute_values, random_attributes
+
+
+def count_insert_queries(model, rows):
+    rows = int(math.ceil(rows))
+    if not rows:
+        return 0
+    fields = [f for f in model._meta.concrete_fields if not f.primary_key]
+    batch_size = max(1, connection.ops.bulk_batch_size(fields, range(rows)))
+    return int(math.ceil(rows / batch_size))
+
+
+def estimate_queries(things, attribute_values, random_attributes):
+    return count_insert_queries(Thing, things) \
+        + int(math.ceil(things / MAX_NAMES_PER_QUERY)) \
+        + count_insert_queries(AttributeValue, attribute_values) \
+        + count_insert_queries(RandomAttribute, random_attributes) \
+        + count_insert_queries(Thing.children.through, things)
+
+
+def estimate_generator(generator_object, samples=DEFAULT_SAMPLES, seed=None):
+    rng = np.random.default_rng(seed)
+    root = get_generator_plan(generator_object.pk)
+
+    totals = {}
+    frontier = {root.id: np.ones(samples, dtype=np.int64)}
+    truncated = False
+    for depth in range(MAX_DEPTH):
+        next_frontier = {}
+        for generator_id, instances in frontier.items():
+            plan = get_generator_plan(generator_id)
+            totals[generator_id] = totals.get(generator_id, 0) + instances
+            for container in plan.containers:
+                children = sample_children(rng, container, instances)
+                if children.any():
+                    next_frontier[container.contained_object_id] = next_frontier.get(container.contained_object_id, 0) + children
+        frontier = next_frontier
+        if not frontier:
+            break
+    else:
+        truncated = True
+        logger.warning('Stopped estimating {0} after {1} levels: its containers form a cycle'.format(root.name, MAX_DEPTH))
+
+    by_thing_type = OrderedDict()
+    total = np.zeros(samples, dtype=np.int64)
+    expected_attribute_values = 0
+    expected_random_attributes = 0
+    for generator_id, instances in totals.items():
+        plan = get_generator_plan(generator_id)
+        thing_type = plan.thing_type.name
+        by_thing_type[thing_type] = by_thing_type.get(thing_type, 0) + instances
+        total += instances
+        attribute_values, random_attributes = get_rows_per_thing(plan)
+        expected_attribute_values += instances.mean() * attribute_values
+        expected_random_attributes += instances.mean() * random_attributes
+
+    counts = [CountEstimate(thing_type=thing_type,
+                            expected=float(instances.mean()),
+                            p95=float(np.percentile(instances, 95)),
+                            max=int(instances.max()))
+              for thing_type, instances in sorted(by_thing_type.items())]
+    expected_things = float(total.mean())
+    return GeneratorEstimate(generator_name=root.name,
+                             samples=samples,
+                             counts=counts,
+                             total=CountEstimate(thing_type='Total', expected=expected_things, p95=float(np.percentile(total, 95)), max=int(total.max())),
+                             expected_queries=estimate_queries(expected_things, expected_attribute_values, expected_random_attributes),
+                             expected_seconds=expected_things * get_seconds_per_thing(),
+                             measured=has_save_timings(),
+                             truncated=truncated)
+
+
+def estimate_thing_count(generator_object):
+    return estimate_generator(generator_object, samples=ROUTING_SAMPLES, seed=0).total.expected
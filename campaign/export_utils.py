@@ -1,48 +1,80 @@
 import json
+import logging
+from collections import defaultdict
+from itertools import islice
+
+from django.db import transaction
 
 from .models import Thing, AttributeValue, UsefulLink, DndBeyondRef, DndBeyondType, RandomEncounter, RandomAttribute, Weight, WeightPreset, ThingType, Attribute, RandomEncounterType, RandomizerAttribute, RandomizerAttributeCategory, RandomizerAttributeOption, RandomizerAttributeCategoryOption, GeneratorObject, GeneratorObjectContains, GeneratorObjectFieldToRandomizerAttribute
+from .generator_utils import clear_generator_plans
+from .hierarchy_utils import add_new_things_to_closure
+from .markup_utils import clear_reference_automata, index_new_things
+from .name_utils import clear_thing_names
+from .randomizer_registry import rebuild_randomizer_registry
+from .reference_utils import queue_references
+from .search_utils import queue_search_index
+from .thing_utils import delete_things
+from .weighted_sampling import clear_alias_tables
+
+
+logger = logging.getLogger(__name__)
+
+
+EXPORT_CHUNK_SIZE = 200
+IMPORT_BATCH_SIZE = 500
+EXPORT_THING_FIELDS = ['name', 'description', 'background', 'current_state', 'markup_description', 'markup_background', 'markup_current_state',
+                       'image', 'thing_type__name', 'is_bookmarked']
+
+
+def get_rows_by_thing(queryset, thing_ids, *fields):
+    rows = defaultdict(list)
+    for row in queryset.filter(thing_id__in=thing_ids).order_by('pk').values_list('thing_id', *fields):
+        rows[row[0]].append(row[1:])
+    return rows
+
+
+def things_to_json(things):
+    thing_ids = [thing['pk'] for thing in things]
+    children = defaultdict(list)
+    for parent_id, child_name in Thing.children.through.objects.filter(from_thing_id__in=thing_ids).order_by('to_thing_id').values_list('from_thing_id', 'to_thing__name'):
+        children[parent_id].append(child_name)
+    attribute_values = get_rows_by_thing(AttributeValue.objects, thing_ids, 'attribute__name', 'value')
+    links = get_rows_by_thing(UsefulLink.objects, thing_ids, 'name', 'value')
+    random_encounters = get_rows_by_thing(RandomEncounter.objects, thing_ids, 'random_encounter_type__name', 'name')
+    random_attributes = get_rows_by_thing(RandomAttribute.objects, thing_ids, 'text')
+
+    for thing in things:
+        pk = thing['pk']
+        yield {
+            'name': thing['name'],
+            'description': thing['description'],
+            'background': thing['background'],
+            'current_state': thing['current_state'],
+            'markup_description': thing['markup_description'],
+            'markup_background': thing['markup_background'],
+            'markup_current_state': thing['markup_current_state'],
+            'image': thing['image'],
+            'thing_type': thing['thing_type__name'],
+            'children': children[pk],
+            'attribute_values': [{'attribute': attribute, 'value': value} for attribute, value in attribute_values[pk]],
+            'links': [{'name': name, 'value': value} for name, value in links[pk]],
+            'random_encounters': [{'random_encounter_type': random_encounter_type, 'name': name} for random_encounter_type, name in random_encounters[pk]],
+            'random_attributes': [text for text, in random_attributes[pk]],
+            'is_bookmarked': thing['is_bookmarked']
+        }
+
+
+def iter_campaign_things(campaign):
+    things = Thing.objects.filter(campaign=campaign).order_by('pk').values('pk', *EXPORT_THING_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    while True:
+        chunk = list(islice(things, EXPORT_CHUNK_SIZE))
+        if not chunk:
+            break
+        yield from things_to_json(chunk)
 
 
 def campaign_to_json(campaign):
-    thing_data = []
-    for thing in Thing.objects.filter(campaign=campaign):
-        attributes = []
-        attribute_values = AttributeValue.objects.filter(thing=thing)
-        for attribute_value in attribute_values:
-            attributes.append({
-                'attribute': attribute_value.attribute.name,
-                'value': attribute_value.value
-            })
-        links = []
-        for link in UsefulLink.objects.filter(thing=thing):
-            links.append({
-                'name': link.name,
-                'value': link.value
-            })
-        random_encounters = []
-        for random_encounter in RandomEncounter.objects.filter(thing=thing):
-            random_encounters.append({
-                'random_encounter_type': random_encounter.random_encounter_type.name,
-                'name': random_encounter.name
-            })
-        thing_data.append({
-            'name': thing.name,
-            'description': thing.description,
-            'background': thing.background,
-            'current_state': thing.current_state,
-            'markup_description': thing.markup_description,
-            'markup_background': thing.markup_background,
-            'markup_current_state': thing.markup_current_state,
-            'image': thing.image,
-            'thing_type': thing.thing_type.name,
-            'children': [child.name for child in thing.children.all()],
-            'attribute_values': attributes,
-            'links': links,
-            'random_encounters': random_encounters,
-            'random_attributes': [a.text for a in RandomAttribute.objects.filter(thing=thing)],
-            'is_bookmarked': thing.is_bookmarked
-        })
-    return thing_data
+    return list(iter_campaign_things(campaign))
 
 
 def weight_presets_to_json(campaign):
@@ -65,54 +97,98 @@ def get_campaign_json(campaign):
     }
 
 
+def iter_campaign_json(campaign):
+    yield '{"things": ['
+    separator = ''
+    for thing in iter_campaign_things(campaign):
+        yield separator + json.dumps(thing)
+        separator = ', '
+    yield '], "weight_presets": {0}}}'.format(json.dumps(weight_presets_to_json(campaign)))
+    logger.info('Exported {0}'.format(campaign.name))
+
+
+def clear_campaign_caches(campaign_id):
+    clear_thing_names(campaign_id)
+    clear_reference_automata(campaign_id)
+    clear_alias_tables()
+
+
 def save_campaign(campaign, json_file):
-    Thing.objects.filter(campaign=campaign).delete()
     data = json.loads(json_file)
-    for thing in data['things']:
-        thing_object = Thing(campaign=campaign,
-                             name=thing['name'],
-                             description=thing['description'],
-                             background=thing['background'],
-                             current_state=thing['current_state'],
-                             markup_description=thing['markup_description'],
-                             markup_background=thing['markup_background'],
-                             markup_current_state=thing['markup_current_state'],
-                             image=thing['image'],
-                             thing_type=ThingType.objects.get(name=thing['thing_type']),
-                             is_bookmarked=thing['is_bookmarked'])
-        thing_object.save()
-
-        for attribute in thing['attribute_values']:
-            attr_value_object = AttributeValue(thing=thing_object, attribute=Attribute.objects.get(name=attribute['attribute'], thing_type=thing_object.thing_type), value=attribute['value'])
-            attr_value_object.save()
-
-        for link in thing['links']:
-            link_object = UsefulLink(thing=thing_object, name=link['name'], value=link['value'])
-            link_object.save()
-
-        for random_encounter in thing['random_encounters']:
-            random_encounter_object = RandomEncounter(thing=thing_object, random_encounter_type=RandomEncounterType.objects.get(name=random_encounter['random_encounter_type']), name=random_encounter['name'])
-            random_encounter_object.save()
-
-        for random_attribute in thing['random_attributes']:
-            random_attribute_object = RandomAttribute(thing=thing_object, text=random_attribute)
-            random_attribute_object.save()
+    thing_types = dict(ThingType.objects.values_list('name', 'pk'))
+    attributes = {(thing_type_id, name): pk for pk, thing_type_id, name in Attribute.objects.values_list('pk', 'thing_type_id', 'name')}
+    random_encounter_types = dict(RandomEncounterType.objects.values_list('name', 'pk'))
 
+    things = []
     for thing in data['things']:
-        thing_object = Thing.objects.get(campaign=campaign, name=thing['name'])
-        for child in thing['children']:
-            thing_object.children.add(Thing.objects.get(campaign=campaign, name=child))
-        thing_object.save()
-
-    WeightPreset.objects.filter(campaign=campaign).delete()
-    for weight_preset in data['weight_presets']:
-        preset = WeightPreset(name=weight_preset['name'], attribute_name=weight_preset['attribute_name'],
-                              is_active=weight_preset['is_active'], campaign=campaign)
-        preset.save()
-        for weight in weight_preset['weights']:
-            weight_object = Weight(weight_preset=preset, name_to_weight=weight['name_to_weight'],
-                                   weight=weight['weight'])
-            weight_object.save()
+        if thing['thing_type'] is not None and thing['thing_type'] not in thing_types:
+            raise ValueError('Unknown thing type for {0}: {1}'.format(thing['name'], thing['thing_type']))
+        things.append(Thing(campaign=campaign,
+                            name=thing['name'],
+                            description=thing['description'],
+                            background=thing['background'],
+                            current_state=thing['current_state'],
+                            markup_description=thing['markup_description'],
+                            markup_background=thing['markup_background'],
+                            markup_current_state=thing['markup_current_state'],
+                            image=thing['image'],
+                            thing_type_id=thing_types.get(thing['thing_type']),
+                            is_bookmarked=thing['is_bookmarked']))
+
+    with transaction.atomic():
+        old_thing_ids = list(Thing.objects.filter(campaign=campaign).values_list('pk', flat=True))
+        delete_things(old_thing_ids)
+        transaction.on_commit(lambda: clear_campaign_caches(campaign.pk))
+
+        Thing.objects.bulk_create(things, batch_size=IMPORT_BATCH_SIZE)
+        thing_ids = dict(Thing.objects.filter(campaign=campaign).values_list('name', 'pk'))
+        for thing in things:
+            thing.pk = thing_ids[thing.name]
+
+        attribute_values = []
+        links = []
+        random_encounters = []
+        random_attributes = []
+        children = []
+        for thing, thing_data in zip(things, data['things']):
+            for attribute in thing_data['attribute_values']:
+                attribute_id = attributes.get((thing.thing_type_id, attribute['attribute']))
+                if attribute_id is None:
+                    raise ValueError('Unknown attribute for {0}: {1}'.format(thing.name, attribute['attribute']))
+                attribute_values.append(AttributeValue(thing_id=thing.pk, attribute_id=attribute_id, value=attribute['value']))
+            for link in thing_data['links']:
+                links.append(UsefulLink(thing_id=thing.pk, name=link['name'], value=link['value']))
+            for random_encounter in thing_data['random_encounters']:
+                random_encounter_type_id = random_encounter_types.get(random_encounter['random_encounter_type'])
+                if random_encounter_type_id is None and random_encounter['random_encounter_type'] is not None:
+                    raise ValueError('Unknown random encounter type for {0}: {1}'.format(thing.name, random_encounter['random_encounter_type']))
+                random_encounters.append(RandomEncounter(thing_id=thing.pk, random_encounter_type_id=random_encounter_type_id, name=random_encounter['name']))
+            for random_attribute in thing_data['random_attributes']:
+                random_attributes.append(RandomAttribute(thing_id=thing.pk, text=random_attribute))
+            for child in thing_data['children']:
+                if child not in thing_ids:
+                    raise ValueError('Unknown child of {0}: {1}'.format(thing.name, child))
+                children.append(Thing.children.through(from_thing_id=thing.pk, to_thing_id=thing_ids[child]))
+
+        for model, rows in [(AttributeValue, attribute_values), (UsefulLink, links), (RandomEncounter, random_encounters),
+                            (RandomAttribute, random_attributes), (Thing.children.through, children)]:
+            model.objects.bulk_create(rows, batch_size=IMPORT_BATCH_SIZE)
+        add_new_things_to_closure([(child.from_thing_id, child.to_thing_id) for child in children])
+        index_new_things(things)
+        queue_search_index(old_thing_ids + list(thing_ids.values()))
+        queue_references(thing_ids.values())
+
+        WeightPreset.objects.filter(campaign=campaign).delete()
+        WeightPreset.objects.bulk_create([WeightPreset(name=weight_preset['name'], attribute_name=weight_preset['attribute_name'],
+                                                       is_active=weight_preset['is_active'], campaign=campaign)
+                                          for weight_preset in data['weight_presets']])
+        preset_ids = {(name, attribute_name): pk for pk, name, attribute_name in WeightPreset.objects.filter(campaign=campaign).values_list('pk', 'name', 'attribute_name')}
+        Weight.objects.bulk_create([Weight(weight_preset_id=preset_ids[(weight_preset['name'], weight_preset['attribute_name'])],
+                                           name_to_weight=weight['name_to_weight'], weight=weight['weight'])
+                                    for weight_preset in data['weight_presets'] for weight in weight_preset['weights']], batch_size=IMPORT_BATCH_SIZE)
+
+    logger.info('Imported {0} things, {1} attribute values and {2} links into {3}'.format(len(things), len(attribute_values), len(links), campaign.name))
+    return len(things)
 
 
 def thing_settings_to_json():
@@ -257,6 +333,8 @@ def save_settings(json_file):
                         randomizer_attribute_category.use_values_from.add(value_attribute)
                         randomizer_attribute_category.save()
 
+    rebuild_randomizer_registry()
+
     GeneratorObject.objects.all().delete()
     for generator_data in data['generators']:
         thing_type = ThingType.objects.get(name=generator_data['thing_type'])
@@ -296,3 +374,5 @@ def save_settings(json_file):
                                                      min_objects=contains['min_objects'],
                                                      max_objects=contains['max_objects'])
             contains_entry.save()
+
+    clear_generator_plans()
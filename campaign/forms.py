@@ -1,5 +1,7 @@
 from django import forms
 from django.shortcuts import get_object_or_404
+from django.urls import reverse, reverse_lazy
+from django.utils.http import urlencode
 
 from .models import Thing, Attribute, Campaign, RandomizerAttribute, RandomizerAttributeCategory, GeneratorObject, WeightPreset
 
@@ -26,12 +28,45 @@ POPULATION_CHOICES = [
 ]
 
 
+class ThingTypeaheadMixin(object):
+    thing_types = ()
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['attrs']['data-typeahead-url'] = '{0}?{1}'.format(reverse('campaign:typeahead'), urlencode([('type', thing_type) for thing_type in self.thing_types]))
+        return context
+
+    def optgroups(self, name, value, attrs=None):
+        selected_ids = [thing_id for thing_id in value if str(thing_id).isdigit()]
+        choices = [] if self.allow_multiple_selected else [('', '---------')]
+        if selected_ids:
+            choices.extend(Thing.objects.filter(pk__in=selected_ids).order_by('name').values_list('pk', 'name'))
+        self.choices = choices
+        return super().optgroups(name, value, attrs)
+
+
+class ThingTypeaheadSelect(ThingTypeaheadMixin, forms.Select):
+    pass
+
+
+class ThingTypeaheadSelectMultiple(ThingTypeaheadMixin, forms.SelectMultiple):
+    pass
+
+
+def set_thing_choices(field, thing_types):
+    field.queryset = Thing.objects.filter(campaign=Campaign.objects.get(is_active=True), thing_type__name__in=thing_types).order_by('name')
+    field.widget.thing_types = thing_types
+
+
 class SearchForm(forms.Form):
     search_text = forms.CharField(label='Search', max_length=50, widget=forms.TextInput(attrs={
         'class': 'form-control mr-sm-2',
         'type': 'search',
         'placeholder': 'Search',
-        'aria-label': 'Search'
+        'aria-label': 'Search',
+        'autocomplete': 'off',
+        'list': 'search-typeahead',
+        'data-typeahead-url': reverse_lazy('campaign:typeahead')
     }))
 
 
@@ -44,18 +79,18 @@ class NewLocationForm(forms.Form):
     description = forms.CharField(label='Summary', widget=forms.Textarea)
     background = forms.CharField(label='Background', widget=forms.Textarea, required=False)
     current_state = forms.CharField(label='Current state', widget=forms.Textarea, required=False)
-    location = forms.ModelChoiceField(label='Located in', queryset=Thing.objects.all(), required=False)
-    factions = forms.ModelMultipleChoiceField(label='Factions', queryset=Thing.objects.all(), required=False)
-    npcs = forms.ModelMultipleChoiceField(label='NPCs', queryset=Thing.objects.all(), required=False)
-    ruler = forms.ModelChoiceField(label='Ruler', queryset=Thing.objects.all(), required=False)
+    location = forms.ModelChoiceField(label='Located in', queryset=Thing.objects.all(), widget=ThingTypeaheadSelect, required=False)
+    factions = forms.ModelMultipleChoiceField(label='Factions', queryset=Thing.objects.all(), widget=ThingTypeaheadSelectMultiple, required=False)
+    npcs = forms.ModelMultipleChoiceField(label='NPCs', queryset=Thing.objects.all(), widget=ThingTypeaheadSelectMultiple, required=False)
+    ruler = forms.ModelChoiceField(label='Ruler', queryset=Thing.objects.all(), widget=ThingTypeaheadSelect, required=False)
     population = forms.ChoiceField(label='Population', choices=POPULATION_CHOICES, required=False)
     generate_rumours = forms.BooleanField(label='Generate rumours', required=False)
 
     def refresh_fields(self):
-        self.fields['location'].queryset = Thing.objects.filter(campaign=Campaign.objects.get(is_active=True), thing_type__name='Location').order_by('name')
-        self.fields['factions'].queryset = Thing.objects.filter(campaign=Campaign.objects.get(is_active=True), thing_type__name='Faction').order_by('name')
-        self.fields['npcs'].queryset = Thing.objects.filter(campaign=Campaign.objects.get(is_active=True), thing_type__name='NPC').order_by('name')
-        self.fields['ruler'].queryset = Thing.objects.filter(campaign=Campaign.objects.get(is_active=True), thing_type__name__in=['NPC', 'Faction']).order_by('name')
+        set_thing_choices(self.fields['location'], ['Location'])
+        set_thing_choices(self.fields['factions'], ['Faction'])
+        set_thing_choices(self.fields['npcs'], ['NPC'])
+        set_thing_choices(self.fields['ruler'], ['NPC', 'Faction'])
 
 
 class NewFactionForm(forms.Form):
@@ -64,18 +99,18 @@ class NewFactionForm(forms.Form):
     description = forms.CharField(label='Summary', widget=forms.Textarea)
     background = forms.CharField(label='Background', widget=forms.Textarea, required=False)
     current_state = forms.CharField(label='Current state', widget=forms.Textarea, required=False)
-    location = forms.ModelChoiceField(label='Located in', queryset=Thing.objects.all(), required=False)
-    npcs = forms.ModelMultipleChoiceField(label='NPCs', queryset=Thing.objects.all(), required=False)
+    location = forms.ModelChoiceField(label='Located in', queryset=Thing.objects.all(), widget=ThingTypeaheadSelect, required=False)
+    npcs = forms.ModelMultipleChoiceField(label='NPCs', queryset=Thing.objects.all(), widget=ThingTypeaheadSelectMultiple, required=False)
 
-    leader = forms.ModelChoiceField(label='Leader', queryset=Thing.objects.all(), required=False)
+    leader = forms.ModelChoiceField(label='Leader', queryset=Thing.objects.all(), widget=ThingTypeaheadSelect, required=False)
     attitude = forms.ChoiceField(label='Attitude', choices=ATTITUDE_CHOICES)
     power = forms.ChoiceField(label='Power', choices=MAGNITUDE_CHOICES)
     reach = forms.ChoiceField(label='Reach', choices=MAGNITUDE_CHOICES)
 
     def refresh_fields(self):
-        self.fields['location'].queryset = Thing.objects.filter(campaign=Campaign.objects.get(is_active=True), thing_type__name='Location').order_by('name')
-        self.fields['npcs'].queryset = Thing.objects.filter(campaign=Campaign.objects.get(is_active=True), thing_type__name='NPC').order_by('name')
-        self.fields['leader'].queryset = Thing.objects.filter(campaign=Campaign.objects.get(is_active=True), thing_type__name='NPC').order_by('name')
+        set_thing_choices(self.fields['location'], ['Location'])
+        set_thing_choices(self.fields['npcs'], ['NPC'])
+        set_thing_choices(self.fields['leader'], ['NPC'])
 
 
 class NewNpcForm(forms.Form):
@@ -85,15 +120,15 @@ class NewNpcForm(forms.Form):
     description = forms.CharField(label='Summary', widget=forms.Textarea)
     background = forms.CharField(label='Background', widget=forms.Textarea, required=False)
     current_state = forms.CharField(label='Current state', widget=forms.Textarea, required=False)
-    location = forms.ModelChoiceField(label='Located in', queryset=Thing.objects.all(), required=False)
-    factions = forms.ModelMultipleChoiceField(label='Member of', queryset=Thing.objects.all(), required=False)
+    location = forms.ModelChoiceField(label='Located in', queryset=Thing.objects.all(), widget=ThingTypeaheadSelect, required=False)
+    factions = forms.ModelMultipleChoiceField(label='Member of', queryset=Thing.objects.all(), widget=ThingTypeaheadSelectMultiple, required=False)
     attitude = forms.ChoiceField(label='Attitude', choices=ATTITUDE_CHOICES)
     link = forms.CharField(label='D&D Beyond URL', required=False)
     generate_hooks = forms.BooleanField(label='Generate hooks', required=False)
 
     def refresh_fields(self):
-        self.fields['location'].queryset = Thing.objects.filter(campaign=Campaign.objects.get(is_active=True), thing_type__name='Location').order_by('name')
-        self.fields['factions'].queryset = Thing.objects.filter(campaign=Campaign.objects.get(is_active=True), thing_type__name='Faction').order_by('name')
+        set_thing_choices(self.fields['location'], ['Location'])
+        set_thing_choices(self.fields['factions'], ['Faction'])
 
 
 class NewItemForm(forms.Form):
@@ -155,12 +190,11 @@ class ChangeOptionAttributeForm(forms.Form):
 
 
 class ChangeParentForm(forms.Form):
-    parent = forms.ModelChoiceField(label='Add to', queryset=Thing.objects.all(), required=False)
+    parent = forms.ModelChoiceField(label='Add to', queryset=Thing.objects.all(), widget=ThingTypeaheadSelect, required=False)
     clear_parent = forms.BooleanField(label='Clear location', required=False)
 
     def refresh_fields(self, thing_type):
-        self.fields['parent'].queryset = Thing.objects.filter(campaign=Campaign.objects.get(is_active=True),
-                                                                  thing_type=thing_type).order_by('name')
+        set_thing_choices(self.fields['parent'], [thing_type.name])
 
 
 class ChangeCampaignForm(forms.Form):
@@ -190,11 +224,13 @@ class SelectGeneratorObject(forms.Form):
 
 class SelectGeneratorObjectWithLocation(forms.Form):
     generator_object = forms.ModelChoiceField(label='Object', queryset=GeneratorObject.objects.all())
-    parent = forms.ModelChoiceField(label='Located in', queryset=Thing.objects.all(), required=False)
+    parent = forms.ModelChoiceField(label='Located in', queryset=Thing.objects.all(), widget=ThingTypeaheadSelect, required=False)
+    preview = forms.BooleanField(label='Preview first', required=False)
+    background = forms.BooleanField(label='Run in background', required=False)
 
     def refresh_fields(self, thing_type):
         self.fields['generator_object'].queryset = GeneratorObject.objects.filter(thing_type=thing_type).order_by('name')
-        self.fields['parent'].queryset = Thing.objects.filter(campaign=Campaign.objects.get(is_active=True), thing_type__name='Location').order_by('name')
+        set_thing_choices(self.fields['parent'], ['Location'])
 
 
 class NewPreset(forms.Form):
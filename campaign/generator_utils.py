@@ -1,11 +1,20 @@
 import logging
 import random
 import re
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
 
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 
-from .models import Attribute, AttributeValue, GeneratorObjectContains, Thing, RandomizerAttribute, GeneratorObjectFieldToRandomizerAttribute, GeneratorObject, RandomizerAttributeCategory
-from .randomizers import get_random_attribute_raw, get_random_attribute_in_category_raw, generate_random_attributes_for_thing_raw
+from .hierarchy_utils import add_new_things_to_closure
+from .markup_utils import add_thing_reference, get_thing_text, index_new_things, queue_mentions
+from .models import Attribute, AttributeValue, GeneratorObjectContains, Thing, RandomAttribute, RandomizerAttribute, GeneratorObjectFieldToRandomizerAttribute, GeneratorObject, RandomizerAttributeCategory
+from .name_utils import add_thing_name, is_name_in_use, roll_name_in_category, roll_unique_name
+from .randomizer_registry import get_randomizer_registry
+from .randomizers import get_random_attribute_raw, roll_random_attributes
+from .reference_utils import queue_references
+from .search_utils import queue_search_index
+from .template_utils import compile_template, make_resolver, render
 
 
 logger = logging.getLogger(__name__)
@@ -13,157 +22,277 @@ logger = logging.getLogger(__name__)
 
 CONTAINS_REGEX = r'^((\d+)((-(\d+))|%)? )?(([\w]+)\.(.+))$'
 MAPPING_REGEX = r'^((\w+): )?([\w ]+)(\.(.+))?$'
-VARIABLE_REGEX = r'\$\{([^\}]+)\}'
 
+MAX_NAMES_PER_QUERY = 500
 
-def generate_thing(generator_object, campaign, parent_object=None):
-    logger.info('Generating {0}...'.format(generator_object.name))
-    thing = Thing(thing_type=generator_object.thing_type, campaign=campaign)
 
-    fields_to_save = {
-        'thing': [],
-        'attribute_values': [],
-        'random_attributes': []
-    }
+GeneratorPlan = namedtuple('GeneratorPlan', ['id', 'name', 'thing_type', 'field_mappings', 'containers', 'attribute_for_container',
+                                             'name_randomizer_attribute'])
+FieldMappingPlan = namedtuple('FieldMappingPlan', ['field_name', 'randomizer_attribute', 'randomizer_attribute_category', 'target_attribute',
+                                                   'parameter_attribute'])
+ContainerPlan = namedtuple('ContainerPlan', ['contained_object_id', 'percent_chance_for_one', 'min_objects', 'max_objects', 'attribute_for_container',
+                                             'container_attribute'])
+
+
+def get_inherited_attribute_for_container(generator_object):
+    attribute_for_container = generator_object.attribute_for_container
+    inherit_settings_from = generator_object.inherit_settings_from
+    while not attribute_for_container and inherit_settings_from:
+        attribute_for_container = inherit_settings_from.attribute_for_container
+        inherit_settings_from = inherit_settings_from.inherit_settings_from
+    return attribute_for_container
+
+
+def get_plan_attribute(generator_object, name, lookup='name'):
+    try:
+        return Attribute.objects.get(**{'thing_type': generator_object.thing_type, lookup: name})
+    except Attribute.DoesNotExist:
+        raise ValueError('{0} needs a {1} attribute on {2}'.format(generator_object.name, name, generator_object.thing_type.name))
 
+
+def compile_field_mappings(generator_object):
     field_mappings = []
+    used_field_names = set()
+    used_attribute_ids = set()
+    used_category_attribute_ids = set()
+    visited = set()
     inherit_settings_from = generator_object
-    while inherit_settings_from is not None:
-        inherited_settings = GeneratorObjectFieldToRandomizerAttribute.objects.filter(generator_object=inherit_settings_from)
+    while inherit_settings_from is not None and inherit_settings_from.pk not in visited:
+        visited.add(inherit_settings_from.pk)
+        inherited_settings = GeneratorObjectFieldToRandomizerAttribute.objects.filter(generator_object=inherit_settings_from) \
+            .select_related('randomizer_attribute__category_parameter', 'randomizer_attribute_category__attribute').order_by('pk')
         for inherited_setting in inherited_settings:
-            is_overridden = False
-            for field_mapping in field_mappings:
-                if field_mapping.field_name and field_mapping.field_name == inherited_setting.field_name \
-                        or field_mapping.randomizer_attribute \
-                                and field_mapping.randomizer_attribute == inherited_setting.randomizer_attribute \
-                        or field_mapping.randomizer_attribute_category and inherited_setting.randomizer_attribute_category \
-                                and field_mapping.randomizer_attribute_category.attribute == inherited_setting.randomizer_attribute_category.attribute:
-                    is_overridden = True
-                    break
-            if not is_overridden:
-                logger.debug('Using randomizer mapping from {0}: {1}'.format(inherit_settings_from.name, inherited_setting))
-                field_mappings.append(inherited_setting)
-            else:
+            if inherited_setting.field_name and inherited_setting.field_name in used_field_names \
+                    or inherited_setting.randomizer_attribute_id in used_attribute_ids \
+                    or inherited_setting.randomizer_attribute_category \
+                            and inherited_setting.randomizer_attribute_category.attribute_id in used_category_attribute_ids:
                 logger.debug('Not using randomizer mapping from {0}: {1} (overridden by child)'.format(inherit_settings_from.name, inherited_setting))
+                continue
+            logger.debug('Using randomizer mapping from {0}: {1}'.format(inherit_settings_from.name, inherited_setting))
+            field_mappings.append(inherited_setting)
+            if inherited_setting.field_name:
+                used_field_names.add(inherited_setting.field_name)
+            if inherited_setting.randomizer_attribute_id:
+                used_attribute_ids.add(inherited_setting.randomizer_attribute_id)
+            if inherited_setting.randomizer_attribute_category:
+                used_category_attribute_ids.add(inherited_setting.randomizer_attribute_category.attribute_id)
         inherit_settings_from = inherit_settings_from.inherit_settings_from
+
+    compiled_mappings = []
     for field_mapping in field_mappings:
+        target_attribute = None
+        parameter_attribute = None
         if field_mapping.randomizer_attribute:
             if field_mapping.randomizer_attribute.category_parameter:
-                parameter = get_random_attribute_raw(campaign, generator_object.thing_type, field_mapping.randomizer_attribute.category_parameter.name)
-                attribute = Attribute.objects.get(thing_type=generator_object.thing_type, name=field_mapping.randomizer_attribute.category_parameter.name)
+                parameter_attribute = get_plan_attribute(generator_object, field_mapping.randomizer_attribute.category_parameter.name)
+            if not field_mapping.field_name and not field_mapping.randomizer_attribute.can_randomize_later:
+                target_attribute = get_plan_attribute(generator_object, field_mapping.randomizer_attribute.name)
+        elif field_mapping.randomizer_attribute_category and not field_mapping.field_name:
+            target_attribute = get_plan_attribute(generator_object, field_mapping.randomizer_attribute_category.attribute.name)
+        compiled_mappings.append(FieldMappingPlan(field_name=field_mapping.field_name,
+                                                  randomizer_attribute=field_mapping.randomizer_attribute,
+                                                  randomizer_attribute_category=field_mapping.randomizer_attribute_category,
+                                                  target_attribute=target_attribute,
+                                                  parameter_attribute=parameter_attribute))
+    return tuple(compiled_mappings)
+
+
+def compile_containers(generator_object):
+    containers = []
+    for child in GeneratorObjectContains.objects.filter(generator_object=generator_object).select_related('contained_object').order_by('pk'):
+        attribute_for_container = get_inherited_attribute_for_container(child.contained_object)
+        container_attribute = None
+        if attribute_for_container:
+            container_attribute = get_plan_attribute(generator_object, attribute_for_container, 'name__iexact')
+        containers.append(ContainerPlan(contained_object_id=child.contained_object_id,
+                                        percent_chance_for_one=child.percent_chance_for_one,
+                                        min_objects=child.min_objects,
+                                        max_objects=child.max_objects,
+                                        attribute_for_container=attribute_for_container,
+                                        container_attribute=container_attribute))
+    return tuple(containers)
+
+
+def compile_generator_plan(generator_object):
+    logger.debug('Compiling generator plan for {0}'.format(generator_object.name))
+    return GeneratorPlan(id=generator_object.pk,
+                         name=generator_object.name,
+                         thing_type=generator_object.thing_type,
+                         field_mappings=compile_field_mappings(generator_object),
+                         containers=compile_containers(generator_object),
+                         attribute_for_container=get_inherited_attribute_for_container(generator_object),
+                         name_randomizer_attribute=get_plan_attribute(generator_object, 'Name Randomizer'))
+
+
+@lru_cache(maxsize=256)
+def get_generator_plan(generator_object_id):
+    return compile_generator_plan(GeneratorObject.objects.select_related('thing_type').get(pk=generator_object_id))
+
+
+def clear_generator_plans():
+    get_generator_plan.cache_clear()
+
+
+class GeneratedThing(object):
+    def __init__(self, thing, parent=None):
+        self.thing = thing
+        self.parent = parent
+        self.attribute_values = OrderedDict()
+        self.random_attributes = []
+        self.children = []
+
+    def __str__(self):
+        return str(self.thing)
+
+    def set_attribute_value(self, attribute, value):
+        self.attribute_values[attribute.pk] = AttributeValue(attribute=attribute, value=value)
+
+    def get_attribute_value(self, name):
+        for attribute_value in self.attribute_values.values():
+            if attribute_value.attribute.name.lower() == name.lower():
+                return attribute_value.value
+        raise AttributeValue.DoesNotExist('{0} has no {1}'.format(self.thing.name, name))
+
+    def add_child(self, child):
+        if child not in self.children:
+            self.children.append(child)
+
+    def walk(self):
+        seen = set()
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            yield node
+            stack.extend(reversed(node.children))
+
+
+def get_parent_value(parent_object, name):
+    if isinstance(parent_object, GeneratedThing):
+        try:
+            return getattr(parent_object.thing, name)
+        except AttributeError:
+            return parent_object.get_attribute_value(name)
+    try:
+        return getattr(parent_object, name)
+    except AttributeError:
+        return AttributeValue.objects.get(attribute__name__iexact=name, thing=parent_object).value
+
+
+def resolve_parent_value(parent_object, name):
+    if not parent_object:
+        return None
+    try:
+        return get_parent_value(parent_object, name)
+    except AttributeValue.DoesNotExist:
+        logger.warning('Could not resolve parent.{0}: {1} has no such attribute'.format(name, parent_object))
+        return None
+
+
+def generate_thing(generator_object, campaign, parent_object=None):
+    tree = build_thing_tree(get_generator_plan(generator_object.pk), campaign, parent_object)
+    if not tree:
+        return None
+    try:
+        save_thing_tree(tree, campaign, parent_object)
+    except IntegrityError:
+        logger.error('Failed to save {0}: a generated name already exists.'.format(tree.thing.name))
+        return None
+    return tree.thing
+
+
+def build_thing_tree(plan, campaign, parent_object=None, reserved_names=None, progress=None):
+    if reserved_names is None:
+        reserved_names = set()
+    is_in_use = lambda name: name in reserved_names or is_name_in_use(campaign, name)
+
+    logger.info('Generating {0}...'.format(plan.name))
+    node = GeneratedThing(Thing(thing_type=plan.thing_type, campaign=campaign), parent_object)
+    thing = node.thing
+
+    fields_to_save = {
+        'thing': [],
+        'attribute_values': [],
+        'random_attributes': []
+    }
+
+    for field_mapping in plan.field_mappings:
+        if field_mapping.randomizer_attribute:
+            if field_mapping.randomizer_attribute.category_parameter:
+                parameter = get_random_attribute_raw(campaign, plan.thing_type, field_mapping.randomizer_attribute.category_parameter.name)
                 fields_to_save['attribute_values'].append({
-                    'attribute': attribute,
+                    'attribute': field_mapping.parameter_attribute,
                     'value': parameter
                 })
-                value = get_random_attribute_in_category_raw(thing_type=generator_object.thing_type, attribute=field_mapping.randomizer_attribute.name, category=parameter)
-                while field_mapping.randomizer_attribute.must_be_unique and len(Thing.objects.filter(campaign=campaign, name=value)) > 0:
-                    logger.debug('Tried to use {0} but was in use'.format(value))
-                    value = get_random_attribute_in_category_raw(thing_type=generator_object.thing_type, attribute=field_mapping.randomizer_attribute.name, category=parameter)
+                value = roll_name_in_category(campaign, plan.thing_type, field_mapping.randomizer_attribute.name, parameter,
+                                              field_mapping.randomizer_attribute.must_be_unique, is_in_use)
             else:
-                value = get_random_attribute_raw(campaign=campaign, thing_type=thing.thing_type, attribute=field_mapping.randomizer_attribute.name)
-                while field_mapping.randomizer_attribute.must_be_unique and len(Thing.objects.filter(campaign=campaign, name=value)) > 0:
-                    logger.debug('Tried to use {0} but was in use'.format(value))
-                    value = get_random_attribute_raw(campaign=campaign, thing_type=thing.thing_type, attribute=field_mapping.randomizer_attribute.name)
+                value = roll_unique_name(campaign,
+                                         lambda: get_random_attribute_raw(campaign=campaign, thing_type=plan.thing_type, attribute=field_mapping.randomizer_attribute.name),
+                                         field_mapping.randomizer_attribute.must_be_unique,
+                                         field_mapping.randomizer_attribute.name,
+                                         is_in_use)
         else:
-            value = get_random_attribute_in_category_raw(thing_type=thing.thing_type, attribute=field_mapping.randomizer_attribute_category.attribute.name, category=field_mapping.randomizer_attribute_category.name)
-            while field_mapping.randomizer_attribute_category.must_be_unique and len(Thing.objects.filter(campaign=campaign, name=value)) > 0:
-                logger.debug('Tried to use {0} but was in use'.format(value))
-                value = get_random_attribute_in_category_raw(thing_type=thing.thing_type, attribute=field_mapping.randomizer_attribute_category.attribute.name, category=field_mapping.randomizer_attribute_category.name)
+            value = roll_name_in_category(campaign, plan.thing_type, field_mapping.randomizer_attribute_category.attribute.name, field_mapping.randomizer_attribute_category.name,
+                                          field_mapping.randomizer_attribute_category.must_be_unique, is_in_use)
 
         if field_mapping.field_name:
             fields_to_save['thing'].append({
                 'name': field_mapping.field_name,
                 'value': value
             })
-        elif field_mapping.randomizer_attribute:
-            if field_mapping.randomizer_attribute.can_randomize_later:
-                fields_to_save['random_attributes'].append(field_mapping.randomizer_attribute)
-            else:
-                attribute = Attribute.objects.get(thing_type=generator_object.thing_type, name=field_mapping.randomizer_attribute.name)
-                if value:
-                    fields_to_save['attribute_values'].append({
-                        'attribute': attribute,
-                        'value': value
-                    })
-        elif field_mapping.randomizer_attribute_category:
-            attribute = Attribute.objects.get(thing_type=generator_object.thing_type, name=field_mapping.randomizer_attribute_category.attribute.name)
-            if value:
-                fields_to_save['attribute_values'].append({
-                    'attribute': attribute,
-                    'value': value
-                })
+        elif field_mapping.randomizer_attribute and field_mapping.randomizer_attribute.can_randomize_later:
+            fields_to_save['random_attributes'].append(field_mapping.randomizer_attribute)
+        elif value:
+            fields_to_save['attribute_values'].append({
+                'attribute': field_mapping.target_attribute,
+                'value': value
+            })
+
+    known_values = {}
+    for attribute_value_data in fields_to_save['attribute_values']:
+        if attribute_value_data['value']:
+            known_values.setdefault(attribute_value_data['attribute'].name.lower(), attribute_value_data['value'])
+    for field in fields_to_save['thing']:
+        if field['value']:
+            known_values[field['name'].lower()] = field['value']
+    resolve = make_resolver(known_values, lambda name: resolve_parent_value(parent_object, name))
 
     for field in fields_to_save['thing']:
         if field['value']:
-            var_search = re.findall(VARIABLE_REGEX, field['value'])
-            if var_search:
-                for variable in var_search:
-                    if '.' in variable:
-                        parts = variable.split('.')
-                        logger.debug('Using {0} from {1}...'.format(parts[1], parts[0]))
-                        if parts[0].lower() == 'parent' and parent_object:
-                            try:
-                                parent_value = getattr(parent_object, parts[1])
-                            except AttributeError:
-                                parent_value = AttributeValue.objects.get(attribute__name__iexact=parts[1], thing=parent_object).value
-                            field['value'] = re.sub(r'\$\{' + variable + '\}', parent_value, field['value'])
-                    else:
-                        logger.debug('Using {0}...'.format(variable))
-                        for thing_field in fields_to_save['thing']:
-                            logger.debug('Checking {0}'.format(thing_field['name']))
-                            if thing_field['name'].lower() == variable.lower():
-                                logger.debug('Updating "{0}" using "{1}"'.format(field['value'], thing_field['value']))
-                                field['value'] = re.sub(r'\$\{' + variable + '\}', thing_field['value'], field['value'])
-                                break
-                        for thing_field in fields_to_save['attribute_values']:
-                            logger.debug('Checking {0}'.format(thing_field['attribute'].name))
-                            if thing_field['attribute'].name.lower() == variable.lower():
-                                logger.debug('Updating "{0}" using "{1}"'.format(field['value'], thing_field['value']))
-                                field['value'] = re.sub(r'\$\{' + variable + '\}', thing_field['value'], field['value'])
-                                break
+            field['value'] = render(field['value'], resolve)
+            known_values[field['name'].lower()] = field['value']
             logger.debug('Setting thing.{0} to "{1}"'.format(field['name'].lower(), field['value']))
             setattr(thing, field['name'].lower(), field['value'])
 
-    logger.debug('Trying to save thing: {0}'.format(thing))
-    try:
-        if thing.name:
-            thing.save()
-        else:
-            logger.error('Could not save {0}: likely a configuration error. Are all variables populated?'.format(fields_to_save))
-            return None
-    except IntegrityError:
+    logger.debug('Trying to add thing: {0}'.format(thing))
+    if not thing.name:
+        logger.error('Could not save {0}: likely a configuration error. Are all variables populated?'.format(fields_to_save))
+        return None
+    if is_in_use(thing.name):
         logger.error('Failed to save {0}: already exists.'.format(thing.name))
         return None
+    reserved_names.add(thing.name)
+    if progress:
+        progress(node)
 
     for attribute_value_data in fields_to_save['attribute_values']:
-        var_search = re.search(VARIABLE_REGEX, attribute_value_data['value'])
-        if var_search:
-            variable = var_search.group(1)
-            if '.' in variable:
-                parts = variable.split('.')
-                if parts[0] == 'parent' and parent_object:
-                    try:
-                        parent_value = getattr(parent_object, parts[1])
-                    except AttributeError:
-                        parent_value = AttributeValue.objects.get(attribute__name__iexact=parts[1], thing=parent_object).value
-                    attribute_value_data['value'] = re.sub(r'\$\{.+\}', parent_value, attribute_value_data['value'])
-        attribute_value = AttributeValue(thing=thing, attribute=attribute_value_data['attribute'], value=attribute_value_data['value'])
-        attribute_value.save()
-
-    name_randomizer_attribute = Attribute.objects.get(thing_type=thing.thing_type, name='Name Randomizer')
-    name_randomizer = AttributeValue(thing=thing, attribute=name_randomizer_attribute)
+        node.set_attribute_value(attribute_value_data['attribute'], render(attribute_value_data['value'], resolve))
+
     if thing.thing_type.name == 'NPC':
-        name_randomizer.value = AttributeValue.objects.get(thing=thing, attribute__name='Race').value
+        node.set_attribute_value(plan.name_randomizer_attribute, node.get_attribute_value('Race'))
     elif thing.thing_type.name == 'Faction' or thing.thing_type.name == 'Location' or thing.thing_type.name == 'Item':
-        name_randomizer.value = generator_object.name
-    name_randomizer.save()
+        node.set_attribute_value(plan.name_randomizer_attribute, plan.name)
+    else:
+        node.set_attribute_value(plan.name_randomizer_attribute, '')
 
-    for attribute in fields_to_save['random_attributes']:
-        randomizer_attribute = RandomizerAttribute.objects.get(thing_type=thing.thing_type, name__iexact=attribute.name)
-        generate_random_attributes_for_thing_raw(campaign=campaign, thing=thing, attribute=randomizer_attribute)
+    for randomizer_attribute in fields_to_save['random_attributes']:
+        for option in roll_random_attributes(campaign, plan.thing_type, randomizer_attribute):
+            node.random_attributes.append(RandomAttribute(text=option))
 
-    children = GeneratorObjectContains.objects.filter(generator_object=generator_object)
-    for child in children:
+    for child in plan.containers:
         if child.percent_chance_for_one:
             if random.randint(1, 100) <= child.percent_chance_for_one:
                 num_to_generate = 1
@@ -172,38 +301,77 @@ def generate_thing(generator_object, campaign, parent_object=None):
         else:
             num_to_generate = random.randint(child.min_objects, child.max_objects)
         for i in range(0, num_to_generate):
-            child_object = generate_thing(child.contained_object, campaign, thing)
-            if not child_object:
+            child_node = build_thing_tree(get_generator_plan(child.contained_object_id), campaign, node, reserved_names, progress)
+            if not child_node:
                 continue
-            logger.info('Adding {0} to {1}...'.format(child_object.name, thing.name))
-            thing.children.add(child_object)
-            thing.save()
-            if thing.thing_type.name == 'Location':
-                for child_faction in thing.children.filter(thing_type__name='Faction'):
-                    for faction_npc in child_faction.children.filter(thing_type__name='NPC'):
-                        thing.children.add(faction_npc)
-                        thing.save()
-            attribute_for_container = child.contained_object.attribute_for_container
-            inherit_settings_from = child.contained_object.inherit_settings_from
-            while not attribute_for_container and inherit_settings_from:
-                attribute_for_container = inherit_settings_from.attribute_for_container
-                inherit_settings_from = inherit_settings_from.inherit_settings_from
-            if attribute_for_container:
-                logger.info('Setting {0} for {1} to {2}...'.format(attribute_for_container, thing.name, child_object.name))
-                attribute = Attribute.objects.get(thing_type=thing.thing_type, name__iexact=attribute_for_container)
-                attribute_value = AttributeValue(thing=thing, attribute=attribute, value=child_object.name)
-                attribute_value.save()
-
-                var_search = re.search(VARIABLE_REGEX, thing.name)
-                if var_search:
-                    variable = var_search.group(1)
-                    if variable == attribute_for_container:
-                        new_name = re.sub(r'\$\{.+\}', child_object.name, thing.name)
-                        logger.info('Changing {0} to {1}'.format(thing.name, new_name))
-                        thing.name = new_name
-                        thing.save()
-
-    return thing
+            logger.info('Adding {0} to {1}...'.format(child_node.thing.name, thing.name))
+            node.add_child(child_node)
+            if child.attribute_for_container:
+                logger.info('Setting {0} for {1} to {2}...'.format(child.attribute_for_container, thing.name, child_node.thing.name))
+                node.set_attribute_value(child.container_attribute, child_node.thing.name)
+
+                new_name = render(thing.name, make_resolver({child.attribute_for_container.lower(): child_node.thing.name}))
+                if new_name != thing.name:
+                    logger.info('Changing {0} to {1}'.format(thing.name, new_name))
+                    reserved_names.discard(thing.name)
+                    reserved_names.add(new_name)
+                    thing.name = new_name
+
+    if thing.thing_type.name == 'Location':
+        for child_faction in [c for c in node.children if c.thing.thing_type.name == 'Faction']:
+            for faction_npc in child_faction.children:
+                if faction_npc.thing.thing_type.name == 'NPC':
+                    node.add_child(faction_npc)
+
+    return node
+
+
+def save_thing_tree(tree, campaign, parent=None):
+    nodes = list(tree.walk())
+    things = [node.thing for node in nodes]
+    with transaction.atomic():
+        Thing.objects.bulk_create(things)
+        if any(thing.pk is None for thing in things):
+            thing_ids = {}
+            names = [thing.name for thing in things]
+            for i in range(0, len(names), MAX_NAMES_PER_QUERY):
+                thing_ids.update(Thing.objects.filter(campaign=campaign, name__in=names[i:i + MAX_NAMES_PER_QUERY]).values_list('name', 'pk'))
+            for thing in things:
+                thing.pk = thing_ids[thing.name]
+
+        attribute_values = []
+        random_attributes = []
+        children = []
+        for node in nodes:
+            for attribute_value in node.attribute_values.values():
+                attribute_value.thing = node.thing
+                attribute_values.append(attribute_value)
+            for random_attribute in node.random_attributes:
+                random_attribute.thing = node.thing
+                random_attributes.append(random_attribute)
+            for child in node.children:
+                children.append(Thing.children.through(from_thing_id=node.thing.pk, to_thing_id=child.thing.pk))
+        AttributeValue.objects.bulk_create(attribute_values)
+        RandomAttribute.objects.bulk_create(random_attributes)
+        Thing.children.through.objects.bulk_create(children)
+        add_new_things_to_closure([(child.from_thing_id, child.to_thing_id) for child in children])
+        index_new_things(things)
+        queue_search_index([thing.pk for thing in things])
+        if parent:
+            parent.children.add(tree.thing)
+
+    for thing in things:
+        add_thing_name(campaign.pk, thing.name, thing.thing_type_id)
+        add_thing_reference(campaign.pk, thing.name)
+        thing._original_name = thing.name
+        thing._original_campaign_id = thing.campaign_id
+        thing._original_thing_type_id = thing.thing_type_id
+        thing._original_text = get_thing_text(thing)
+    queue_mentions(campaign.pk, [thing.name for thing in things])
+    queue_references([thing.pk for thing in things], campaign.pk, [thing.name for thing in things])
+    logger.info('Saved {0} things, {1} attribute values and {2} random attributes for {3}'.format(len(things), len(attribute_values),
+                                                                                                   len(random_attributes), tree.thing.name))
+    return things
 
 
 def save_containers(generator_object, container_text):
@@ -282,18 +450,84 @@ def save_mappings(generator_object, mapping_text):
             logger.warn('{0}: Failed to parse {1}'.format(generator_object.name, mapping))
                 
                 
+def get_mapping_templates(registry, plan, field_mapping):
+    texts = []
+    if field_mapping.randomizer_attribute:
+        compiled_attribute = registry.get_attribute(plan.thing_type, field_mapping.randomizer_attribute.name)
+        texts.extend(compiled_attribute.options)
+        categories = compiled_attribute.categories.values()
+    else:
+        compiled_attribute = registry.get_attribute(plan.thing_type, field_mapping.randomizer_attribute_category.attribute.name)
+        categories = [registry.get_category(compiled_attribute, field_mapping.randomizer_attribute_category.name)]
+    for category in categories:
+        relations = registry.relations[category.id]
+        for source in relations.sources:
+            texts.extend(source.options)
+            if source.second:
+                texts.extend(source.second.options)
+        for synonym in (relations.synonym_first, relations.synonym_last):
+            if synonym:
+                texts.extend(synonym.options)
+    return [compile_template(text) for text in OrderedDict.fromkeys(texts) if '${' in text]
+
+
+def get_template_problems(generator_object):
+    plan = compile_generator_plan(generator_object)
+    registry = get_randomizer_registry()
+
+    known_fields = set()
+    for field_mapping in plan.field_mappings:
+        if field_mapping.field_name:
+            known_fields.add(field_mapping.field_name.lower())
+        for attribute in (field_mapping.target_attribute, field_mapping.parameter_attribute):
+            if attribute:
+                known_fields.add(attribute.name.lower())
+    for child in plan.containers:
+        if child.attribute_for_container:
+            known_fields.add(child.attribute_for_container.lower())
+    parent_fields = set(f.name for f in Thing._meta.concrete_fields)
+    parent_attributes = set(name.lower() for name in Attribute.objects.values_list('name', flat=True))
+
+    problems = []
+    for field_mapping in plan.field_mappings:
+        for template in get_mapping_templates(registry, plan, field_mapping):
+            for variable in template.variables:
+                if variable.scope == 'parent':
+                    resolved = variable.name in parent_fields or variable.name.lower() in parent_attributes
+                elif variable.scope is None:
+                    resolved = variable.name.lower() in known_fields
+                else:
+                    resolved = False
+                if not resolved:
+                    problem = '{0} is not known to {1} (used in "{2}")'.format(variable.text, plan.name, template.text)
+                    if problem not in problems:
+                        problems.append(problem)
+    return problems
+
+
+def check_generator_templates(generator_object):
+    problems = get_template_problems(generator_object)
+    if problems:
+        raise ValueError('Unresolved variables: {0}'.format('; '.join(problems)))
+
+
 def save_new_generator(thing_type, form_data):
     generator_object = GeneratorObject(name=form_data['name'], thing_type=thing_type,
                                             inherit_settings_from=form_data['inherit_settings_from'],
                                             attribute_for_container=form_data['attribute_for_container'])
-    generator_object.save()
-    logger.info('Saved new generator {0}: inherit_settings_from={1}, attribute_for_container={2}'.format(generator_object.name,
-                                                                                                                   generator_object.inherit_settings_from,
-                                                                                                                   generator_object.attribute_for_container))
-
-    save_containers(generator_object, form_data['contains'])
-    save_mappings(generator_object, form_data['mappings'])
-    
+    try:
+        with transaction.atomic():
+            generator_object.save()
+            logger.info('Saved new generator {0}: inherit_settings_from={1}, attribute_for_container={2}'.format(generator_object.name,
+                                                                                                                           generator_object.inherit_settings_from,
+                                                                                                                           generator_object.attribute_for_container))
+
+            save_containers(generator_object, form_data['contains'])
+            save_mappings(generator_object, form_data['mappings'])
+            check_generator_templates(generator_object)
+    finally:
+        clear_generator_plans()
+
     return generator_object
 
 
@@ -301,14 +535,19 @@ def edit_generator(generator_object, form_data):
     generator_object.name = form_data['name']
     generator_object.inherit_settings_from = form_data['inherit_settings_from']
     generator_object.attribute_for_container = form_data['attribute_for_container']
-    generator_object.save()
-    logger.info('Updated generator {0}: inherit_settings_from={1}, attribute_for_container={2}'.format(generator_object.name,
-                                                                                                       generator_object.inherit_settings_from,
-                                                                                                       generator_object.attribute_for_container))
-
-    GeneratorObjectContains.objects.filter(generator_object=generator_object).delete()
-    GeneratorObjectFieldToRandomizerAttribute.objects.filter(generator_object=generator_object).delete()
-    logger.debug('Cleared containers and mappings for {0}'.format(generator_object.name))
-    save_containers(generator_object, form_data['contains'])
-    save_mappings(generator_object, form_data['mappings'])
+    try:
+        with transaction.atomic():
+            generator_object.save()
+            logger.info('Updated generator {0}: inherit_settings_from={1}, attribute_for_container={2}'.format(generator_object.name,
+                                                                                                               generator_object.inherit_settings_from,
+                                                                                                               generator_object.attribute_for_container))
+
+            GeneratorObjectContains.objects.filter(generator_object=generator_object).delete()
+            GeneratorObjectFieldToRandomizerAttribute.objects.filter(generator_object=generator_object).delete()
+            logger.debug('Cleared containers and mappings for {0}'.format(generator_object.name))
+            save_containers(generator_object, form_data['contains'])
+            save_mappings(generator_object, form_data['mappings'])
+            check_generator_templates(generator_object)
+    finally:
+        clear_generator_plans()
     return generator_object
@@ -0,0 +1,161 @@
+import logging
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import Thing, ThingClosure
+
+
+logger = logging.getLogger(__name__)
+
+
+MAX_IDS_PER_QUERY = 500
+
+
+def ancestors(thing, thing_type=None):
+    things = Thing.objects.filter(closure_descendants__descendant=thing)
+    if thing_type:
+        things = things.filter(thing_type__name=thing_type)
+    return things.distinct().order_by('name')
+
+
+def descendants(thing, thing_type=None):
+    things = Thing.objects.filter(closure_ancestors__ancestor=thing)
+    if thing_type:
+        things = things.filter(thing_type__name=thing_type)
+    return things.distinct().order_by('name')
+
+
+def nearest_ancestor(thing, thing_type, max_depth=None):
+    links = ThingClosure.objects.filter(descendant=thing, ancestor__thing_type__name=thing_type)
+    if max_depth:
+        links = links.filter(depth__lte=max_depth)
+    link = links.select_related('ancestor').order_by('depth', 'ancestor__name').first()
+    return link.ancestor if link else None
+
+
+def is_ancestor(ancestor_id, descendant_id):
+    return ThingClosure.objects.filter(ancestor_id=ancestor_id, descendant_id=descendant_id).exists()
+
+
+def check_for_cycle(parent_id, child_id):
+    if parent_id == child_id or is_ancestor(child_id, parent_id):
+        parent, child = Thing.objects.get(pk=parent_id), Thing.objects.get(pk=child_id)
+        raise ValueError('Cannot add {0} to {1}: {1} is already inside {0}'.format(child.name, parent.name))
+
+
+def count_paths(edges):
+    children = defaultdict(list)
+    for parent_id, child_id in edges:
+        children[parent_id].append(child_id)
+
+    below = {}
+
+    def collect(node, visiting):
+        if node in below:
+            return below[node]
+        visiting.add(node)
+        paths = defaultdict(int)
+        for child in children.get(node, []):
+            if child in visiting:
+                logger.warning('Ignoring the link from {0} to {1}: it closes a cycle'.format(node, child))
+                continue
+            paths[(child, 1)] += 1
+            for (descendant, depth), count in collect(child, visiting).items():
+                paths[(descendant, depth + 1)] += count
+        visiting.discard(node)
+        below[node] = paths
+        return paths
+
+    counts = {}
+    for node in list(children):
+        for (descendant, depth), count in collect(node, set()).items():
+            counts[(node, descendant, depth)] = count
+    return counts
+
+
+def count_paths_through_edge(parent_id, child_id):
+    above = [(parent_id, 0, 1)] + list(ThingClosure.objects.filter(descendant_id=parent_id).values_list('ancestor_id', 'depth', 'paths'))
+    below = [(child_id, 0, 1)] + list(ThingClosure.objects.filter(ancestor_id=child_id).values_list('descendant_id', 'depth', 'paths'))
+    counts = defaultdict(int)
+    for ancestor_id, up, up_paths in above:
+        for descendant_id, down, down_paths in below:
+            counts[(ancestor_id, descendant_id, up + down + 1)] += up_paths * down_paths
+    return counts
+
+
+def get_closure_rows(counts):
+    ancestor_ids = list({ancestor_id for ancestor_id, descendant_id, depth in counts})
+    descendant_ids = sorted({descendant_id for ancestor_id, descendant_id, depth in counts})
+    rows = {}
+    for i in range(0, len(ancestor_ids), MAX_IDS_PER_QUERY):
+        for j in range(0, len(descendant_ids), MAX_IDS_PER_QUERY):
+            for pk, ancestor_id, descendant_id, depth, paths in ThingClosure.objects \
+                    .filter(ancestor_id__in=ancestor_ids[i:i + MAX_IDS_PER_QUERY], descendant_id__in=descendant_ids[j:j + MAX_IDS_PER_QUERY]) \
+                    .values_list('pk', 'ancestor_id', 'descendant_id', 'depth', 'paths'):
+                rows[(ancestor_id, descendant_id, depth)] = (pk, paths)
+    return rows
+
+
+def update_paths(changes):
+    for change, pks in changes.items():
+        for i in range(0, len(pks), MAX_IDS_PER_QUERY):
+            ThingClosure.objects.filter(pk__in=pks[i:i + MAX_IDS_PER_QUERY]).update(paths=F('paths') + change)
+
+
+def add_paths(counts):
+    rows = get_closure_rows(counts)
+    new_rows = []
+    changes = defaultdict(list)
+    for key, count in counts.items():
+        if key in rows:
+            changes[count].append(rows[key][0])
+        else:
+            new_rows.append(ThingClosure(ancestor_id=key[0], descendant_id=key[1], depth=key[2], paths=count))
+    ThingClosure.objects.bulk_create(new_rows)
+    update_paths(changes)
+
+
+def remove_paths(counts):
+    rows = get_closure_rows(counts)
+    deleted = []
+    changes = defaultdict(list)
+    for key, count in counts.items():
+        if key not in rows:
+            logger.warning('Closure row {0} is missing: run rebuild_thing_closure to repair it'.format(key))
+        elif rows[key][1] <= count:
+            deleted.append(rows[key][0])
+        else:
+            changes[-count].append(rows[key][0])
+    for i in range(0, len(deleted), MAX_IDS_PER_QUERY):
+        ThingClosure.objects.filter(pk__in=deleted[i:i + MAX_IDS_PER_QUERY]).delete()
+    update_paths(changes)
+
+
+def add_edge_to_closure(parent_id, child_id):
+    add_paths(count_paths_through_edge(parent_id, child_id))
+
+
+def remove_edge_from_closure(parent_id, child_id):
+    remove_paths(count_paths_through_edge(parent_id, child_id))
+
+
+def add_new_things_to_closure(edges):
+    counts = count_paths(edges)
+    ThingClosure.objects.bulk_create([ThingClosure(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=depth, paths=paths)
+                                      for (ancestor_id, descendant_id, depth), paths in counts.items()])
+
+
+def detach_thing(thing):
+    edges = Thing.children.through.objects.filter(from_thing=thing) | Thing.children.through.objects.filter(to_thing=thing)
+    for parent_id, child_id in list(edges.values_list('from_thing_id', 'to_thing_id')):
+        remove_edge_from_closure(parent_id, child_id)
+    edges.delete()
+
+
+def rebuild_thing_closure():
+    with transaction.atomic():
+        ThingClosure.objects.all().delete()
+        add_new_things_to_closure(Thing.children.through.objects.values_list('from_thing_id', 'to_thing_id'))
+    logger.info('Rebuilt the thing closure: {0} rows'.format(ThingClosure.objects.count()))
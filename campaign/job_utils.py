@@ -0,0 +1,141 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+
+from .estimate_utils import estimate_thing_count, get_seconds_per_thing, record_save_time
+from .generator_utils import build_thing_tree, get_generator_plan, save_thing_tree
+from .models import Campaign, GeneratorObject, Thing
+
+
+logger = logging.getLogger(__name__)
+
+
+MAX_GENERATION_WORKERS = 1
+MAX_JOBS = 50
+BACKGROUND_GENERATION_THRESHOLD = 200
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SAVING = 'saving'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+_executor = None
+_executor_lock = threading.Lock()
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+
+
+class GenerationJob(object):
+    def __init__(self, generator_object, campaign, parent=None):
+        self.id = uuid.uuid4().hex
+        self.generator_id = generator_object.pk
+        self.generator_name = generator_object.name
+        self.campaign_id = campaign.pk
+        self.parent_id = parent.pk if parent else None
+        self.parent_name = parent.name if parent else None
+        self.status = JOB_QUEUED
+        self.things_created = 0
+        self.expected_things = max(1, int(round(estimate_thing_count(generator_object))))
+        self.started = None
+        self.saving_started = None
+        self.finished = None
+        self.thing_name = None
+        self.error = None
+
+    def thing_built(self, node):
+        self.things_created += 1
+
+    def get_eta(self):
+        if self.status in (JOB_DONE, JOB_FAILED):
+            return 0
+        if not self.started or not self.things_created:
+            return None
+        expected_things = max(self.expected_things, self.things_created)
+        saving_seconds = expected_things * get_seconds_per_thing()
+        if self.saving_started:
+            return max(saving_seconds - (time.time() - self.saving_started), 0)
+        elapsed = time.time() - self.started
+        return elapsed / self.things_created * (expected_things - self.things_created) + saving_seconds
+
+    def get_percent(self):
+        if self.status == JOB_DONE:
+            return 100
+        eta = self.get_eta()
+        if eta is None:
+            return 0
+        elapsed = time.time() - self.started
+        return min(99, int(100 * elapsed / (elapsed + eta))) if elapsed + eta else 0
+
+    def to_json(self):
+        return {
+            'id': self.id,
+            'generator': self.generator_name,
+            'status': self.status,
+            'things_created': self.things_created,
+            'expected_things': max(self.expected_things, self.things_created),
+            'eta_seconds': self.get_eta(),
+            'percent': self.get_percent(),
+            'thing': self.thing_name,
+            'parent': self.parent_name,
+            'error': self.error
+        }
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_GENERATION_WORKERS)
+        return _executor
+
+
+def should_generate_in_background(generator_object):
+    return estimate_thing_count(generator_object) > BACKGROUND_GENERATION_THRESHOLD
+
+
+def start_generation_job(generator_object, campaign, parent=None):
+    job = GenerationJob(generator_object, campaign, parent)
+    with _jobs_lock:
+        _jobs[job.id] = job
+        while len(_jobs) > MAX_JOBS:
+            _jobs.popitem(last=False)
+    logger.info('Queued generation job {0} for {1} (about {2} things)'.format(job.id, job.generator_name, job.expected_things))
+    get_executor().submit(run_generation_job, job)
+    return job
+
+
+def get_generation_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def run_generation_job(job):
+    job.status = JOB_RUNNING
+    job.started = time.time()
+    try:
+        generator_object = GeneratorObject.objects.get(pk=job.generator_id)
+        campaign = Campaign.objects.get(pk=job.campaign_id)
+        parent = Thing.objects.get(pk=job.parent_id) if job.parent_id else None
+        tree = build_thing_tree(get_generator_plan(generator_object.pk), campaign, parent, progress=job.thing_built)
+        if not tree:
+            raise ValueError('Could not generate {0}: check the log for details'.format(job.generator_name))
+        job.status = JOB_SAVING
+        job.saving_started = time.time()
+        save_thing_tree(tree, campaign, parent)
+        record_save_time(job.things_created, time.time() - job.saving_started)
+        job.thing_name = tree.thing.name
+        job.status = JOB_DONE
+        logger.info('Generation job {0} created {1} things in {2:.1f}s'.format(job.id, job.things_created, time.time() - job.started))
+    except Exception as e:
+        logger.exception('Generation job {0} failed'.format(job.id))
+        job.error = str(e)
+        job.status = JOB_FAILED
+    finally:
+        job.finished = time.time()
+        connection.close()
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from campaign.generator_utils import generate_thing
+from campaign.models import Campaign, GeneratorObject, Thing
+from campaign.name_utils import clear_thing_names
+
+
+class RollbackBenchmark(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Runs a generator in a rolled back transaction and reports the time and query count'
+
+    def add_arguments(self, parser):
+        parser.add_argument('generator_name')
+        parser.add_argument('--runs', type=int, default=3)
+
+    def handle(self, *args, **options):
+        try:
+            generator_object = GeneratorObject.objects.get(name__iexact=options['generator_name'])
+            campaign = Campaign.objects.get(is_active=True)
+        except (GeneratorObject.DoesNotExist, Campaign.DoesNotExist) as e:
+            raise CommandError(e)
+
+        queries = []
+
+        def count_queries(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        for run in range(options['runs']):
+            del queries[:]
+            try:
+                with transaction.atomic():
+                    things_before = Thing.objects.filter(campaign=campaign).count()
+                    start = time.time()
+                    with connection.execute_wrapper(count_queries):
+                        generate_thing(generator_object, campaign)
+                    elapsed = time.time() - start
+                    things_created = Thing.objects.filter(campaign=campaign).count() - things_before
+                    raise RollbackBenchmark()
+            except RollbackBenchmark:
+                clear_thing_names(campaign.pk)
+            self.stdout.write('Run {0}: {1} things in {2:.3f}s using {3} queries'.format(run + 1, things_created, elapsed, len(queries)))
@@ -0,0 +1,89 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from campaign.export_utils import clear_campaign_caches, save_campaign
+from campaign.models import Attribute, Campaign, Thing, ThingType
+from campaign.search_utils import queue_search_index
+from campaign.thing_utils import delete_things
+
+
+BENCHMARK_CAMPAIGN = 'Import benchmark'
+NPCS_PER_TOWN = 49
+
+
+def make_thing(name, thing_type, description, children=(), attribute_values=()):
+    return {
+        'name': name,
+        'description': description,
+        'background': '',
+        'current_state': '',
+        'markup_description': '',
+        'markup_background': '',
+        'markup_current_state': '',
+        'image': None,
+        'thing_type': thing_type,
+        'children': list(children),
+        'attribute_values': list(attribute_values),
+        'links': [],
+        'random_encounters': [],
+        'random_attributes': ['Rolled for {0}'.format(name)],
+        'is_bookmarked': False
+    }
+
+
+def make_campaign_json(thing_count):
+    try:
+        location, npc = ThingType.objects.get(name='Location'), ThingType.objects.get(name='NPC')
+    except ThingType.DoesNotExist as e:
+        raise CommandError(e)
+    attribute = Attribute.objects.filter(thing_type=npc, is_thing=False).order_by('name').first()
+
+    things = []
+    for town in range((thing_count + NPCS_PER_TOWN) // (NPCS_PER_TOWN + 1)):
+        town_name = 'Benchmark Town {0}'.format(town)
+        npc_names = ['Benchmark NPC {0}-{1}'.format(town, i) for i in range(min(NPCS_PER_TOWN, thing_count - len(things) - 1))]
+        things.append(make_thing(town_name, location.name, 'A town of {0} people'.format(len(npc_names)), children=npc_names))
+        for npc_name in npc_names:
+            attribute_values = [{'attribute': attribute.name, 'value': 'Human'}] if attribute else []
+            things.append(make_thing(npc_name, npc.name, 'Lives in @{0}@'.format(town_name), attribute_values=attribute_values))
+    return json.dumps({'things': things, 'weight_presets': []})
+
+
+class Command(BaseCommand):
+    help = 'Imports a generated campaign into a scratch campaign and reports the time and query count'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--things', type=int, default=10000)
+        parser.add_argument('--runs', type=int, default=2)
+
+    def handle(self, *args, **options):
+        if Campaign.objects.filter(name=BENCHMARK_CAMPAIGN).exists():
+            raise CommandError('{0} already exists: delete it first'.format(BENCHMARK_CAMPAIGN))
+        campaign_json = make_campaign_json(options['things'])
+        campaign = Campaign.objects.create(name=BENCHMARK_CAMPAIGN)
+
+        queries = []
+
+        def count_queries(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        try:
+            for run in range(options['runs']):
+                del queries[:]
+                start = time.time()
+                with connection.execute_wrapper(count_queries):
+                    thing_count = save_campaign(campaign, campaign_json)
+                elapsed = time.time() - start
+                self.stdout.write('Run {0}: {1} things in {2:.3f}s using {3} queries'.format(run + 1, thing_count, elapsed, len(queries)))
+        finally:
+            campaign_id = campaign.pk
+            with transaction.atomic():
+                thing_ids = list(Thing.objects.filter(campaign=campaign).values_list('pk', flat=True))
+                delete_things(thing_ids)
+                queue_search_index(thing_ids)
+                campaign.delete()
+            clear_campaign_caches(campaign_id)
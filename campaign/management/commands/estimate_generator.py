@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from campaign.estimate_utils import DEFAULT_SAMPLES, estimate_generator
+from campaign.models import GeneratorObject
+
+
+class Command(BaseCommand):
+    help = 'Estimates how many things a generator creates by sampling its containers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('generator_name')
+        parser.add_argument('--samples', type=int, default=DEFAULT_SAMPLES)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        try:
+            generator_object = GeneratorObject.objects.get(name__iexact=options['generator_name'])
+        except GeneratorObject.DoesNotExist as e:
+            raise CommandError(e)
+
+        estimate = estimate_generator(generator_object, samples=options['samples'], seed=options['seed'])
+        self.stdout.write('{0} ({1} samples)'.format(estimate.generator_name, estimate.samples))
+        self.stdout.write('{0:<10} {1:>10} {2:>10} {3:>10}'.format('Type', 'Expected', 'p95', 'Max'))
+        for count in estimate.counts + [estimate.total]:
+            self.stdout.write('{0:<10} {1:>10.1f} {2:>10.0f} {3:>10}'.format(count.thing_type, count.expected, count.p95, count.max))
+        self.stdout.write('Expected cost: about {0} queries and roughly {1:.2f}s'.format(estimate.expected_queries, estimate.expected_seconds))
+        if estimate.truncated:
+            self.stdout.write(self.style.WARNING('Containers form a cycle: counts were cut off after the maximum depth'))
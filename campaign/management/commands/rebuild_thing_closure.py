@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from campaign.hierarchy_utils import rebuild_thing_closure
+from campaign.models import ThingClosure
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the ancestor/descendant closure table from the thing hierarchy'
+
+    def handle(self, *args, **options):
+        rebuild_thing_closure()
+        self.stdout.write('Rebuilt {0} closure rows'.format(ThingClosure.objects.count()))
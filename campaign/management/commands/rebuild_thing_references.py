@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from campaign.models import ThingReference
+from campaign.reference_utils import rebuild_thing_references
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the thing reference graph used to propagate renames'
+
+    def handle(self, *args, **options):
+        rebuild_thing_references()
+        self.stdout.write('Rebuilt {0} thing references'.format(ThingReference.objects.count()))
@@ -0,0 +1,270 @@
+import hashlib
+import html
+import logging
+import re
+import threading
+from collections import OrderedDict
+
+from django.db import transaction
+from django.db.models import Case, TextField, Value, When
+from django.urls import reverse
+from django.utils.html import escape
+
+from .aho_corasick import Automaton
+from .models import Campaign, DndBeyondRef, DndBeyondType, Thing, ThingTerm
+
+
+logger = logging.getLogger(__name__)
+
+
+THING_MARKUP_SYMBOL = '@'
+TEXT_FIELDS = ['description', 'background', 'current_state']
+TERM_REGEX = re.compile(r'\w+')
+MAX_TERM_LENGTH = 50
+MAX_IDS_PER_QUERY = 500
+MAX_ROWS_PER_UPDATE = 100
+MAX_RENDERED_MARKUP = 5000
+
+MARKUP_LINKS = {
+    '@': ('thing', None),
+    '$': ('monster', 'https://www.dndbeyond.com/monsters/'),
+    '!': ('item', 'https://www.dndbeyond.com/magic-items/'),
+    '^': ('spell', 'https://www.dndbeyond.com/spells/')
+}
+MARKUP_LINK_REGEX = re.compile('([{0}])'.format(re.escape(''.join(MARKUP_LINKS))))
+MARKUP_BLOCKS = [
+    ('\n\n', '</p><p>'),
+    ('*-', '<ul>'),
+    ('-*', '</ul>'),
+    ('- ', '<li>'),
+    ('-\n', '</li>')
+]
+
+_reference_automata = {}
+_automata_lock = threading.RLock()
+_markup_symbols = None
+_pending = threading.local()
+_rendered_markup = OrderedDict()
+
+
+def get_markup_symbols():
+    global _markup_symbols
+    if _markup_symbols is None:
+        _markup_symbols = list(DndBeyondType.objects.values_list('markup_symbol', flat=True))
+    return _markup_symbols
+
+
+def get_reference_automaton(campaign_id):
+    with _automata_lock:
+        automaton = _reference_automata.get(campaign_id)
+        if automaton is None:
+            automaton = Automaton()
+            for name, markup_symbol in DndBeyondRef.objects.values_list('name', 'dndbeyond_type__markup_symbol'):
+                automaton.add(name, markup_symbol)
+            names = Thing.objects.filter(campaign_id=campaign_id).values_list('name', flat=True)
+            for name in names:
+                automaton.add(name, THING_MARKUP_SYMBOL)
+            automaton.build()
+            _reference_automata[campaign_id] = automaton
+            logger.debug('Built reference automaton for campaign {0}: {1} names'.format(campaign_id, len(names)))
+        return automaton
+
+
+def find_references(campaign_id, text):
+    with _automata_lock:
+        return [(start, end, set(symbols)) for start, end, symbols in get_reference_automaton(campaign_id).find_longest(text)]
+
+
+def add_thing_reference(campaign_id, name):
+    with _automata_lock:
+        automaton = _reference_automata.get(campaign_id)
+        if automaton is not None:
+            automaton.add(name, THING_MARKUP_SYMBOL)
+
+
+def remove_thing_reference(campaign_id, name):
+    with _automata_lock:
+        automaton = _reference_automata.get(campaign_id)
+        if automaton is not None:
+            automaton.remove(name, THING_MARKUP_SYMBOL)
+
+
+def add_dndbeyond_reference(name, markup_symbol):
+    with _automata_lock:
+        for automaton in _reference_automata.values():
+            automaton.add(name, markup_symbol)
+
+
+def remove_dndbeyond_reference(name, markup_symbol):
+    with _automata_lock:
+        for automaton in _reference_automata.values():
+            automaton.remove(name, markup_symbol)
+
+
+def clear_reference_automata(campaign_id=None):
+    global _markup_symbols
+    with _automata_lock:
+        if campaign_id is None:
+            _reference_automata.clear()
+            _markup_symbols = None
+        else:
+            _reference_automata.pop(campaign_id, None)
+
+
+def pick_markup_symbol(symbols):
+    if THING_MARKUP_SYMBOL in symbols:
+        return THING_MARKUP_SYMBOL
+    return min(symbols)
+
+
+def update_thing_references(text, campaign):
+    new_text = text.replace(THING_MARKUP_SYMBOL, '')
+    for markup_symbol in get_markup_symbols():
+        new_text = new_text.replace(markup_symbol, '')
+
+    marked_up = []
+    position = 0
+    for start, end, symbols in find_references(campaign.pk, new_text):
+        markup_symbol = pick_markup_symbol(symbols)
+        marked_up.append(new_text[position:start])
+        marked_up.append('{0}{1}{0}'.format(markup_symbol, new_text[start:end]))
+        position = end
+    marked_up.append(new_text[position:])
+    return ''.join(marked_up)
+
+
+def get_terms(texts):
+    terms = set()
+    for text in texts:
+        if text:
+            terms.update(term[:MAX_TERM_LENGTH] for term in TERM_REGEX.findall(text.lower()))
+    return terms
+
+
+def get_thing_text(thing):
+    return tuple(thing.__dict__.get(field) for field in TEXT_FIELDS)
+
+
+def index_thing_terms(thing, created=False):
+    terms = get_terms(get_thing_text(thing))
+    if not created:
+        existing = set(ThingTerm.objects.filter(thing=thing).values_list('term', flat=True))
+        ThingTerm.objects.filter(thing=thing, term__in=list(existing - terms)).delete()
+        terms -= existing
+    ThingTerm.objects.bulk_create([ThingTerm(thing=thing, term=term) for term in terms])
+
+
+def index_new_things(things):
+    ThingTerm.objects.bulk_create([ThingTerm(thing_id=thing.pk, term=term) for thing in things for term in get_terms(get_thing_text(thing))])
+
+
+def get_search_term(name):
+    terms = TERM_REGEX.findall(name.lower())
+    return max(terms, key=len)[:MAX_TERM_LENGTH] if terms else None
+
+
+def find_mentioning_things(campaign_id, names):
+    terms = sorted({get_search_term(name) for name in names} - {None})
+    thing_ids = set()
+    for i in range(0, len(terms), MAX_IDS_PER_QUERY):
+        thing_ids.update(ThingTerm.objects.filter(thing__campaign_id=campaign_id, term__in=terms[i:i + MAX_IDS_PER_QUERY])
+                         .values_list('thing_id', flat=True).distinct())
+    return sorted(thing_ids)
+
+
+def update_markup(changes):
+    for field in TEXT_FIELDS:
+        markup_field = 'markup_{0}'.format(field)
+        rows = [(pk, markups[markup_field]) for pk, markups in changes if markup_field in markups]
+        for i in range(0, len(rows), MAX_ROWS_PER_UPDATE):
+            chunk = rows[i:i + MAX_ROWS_PER_UPDATE]
+            cases = Case(*[When(pk=pk, then=Value(markup)) for pk, markup in chunk], output_field=TextField())
+            Thing.objects.filter(pk__in=[pk for pk, markup in chunk]).update(**{markup_field: cases})
+
+
+def remarkup_mentions(campaign_id, names):
+    campaign = Campaign(pk=campaign_id)
+    lowered_names = [name.lower() for name in names if name]
+    thing_ids = find_mentioning_things(campaign_id, names)
+    changes = []
+    markup_fields = ['markup_{0}'.format(field) for field in TEXT_FIELDS]
+    for i in range(0, len(thing_ids), MAX_IDS_PER_QUERY):
+        for values in Thing.objects.filter(pk__in=thing_ids[i:i + MAX_IDS_PER_QUERY]).values('pk', *(TEXT_FIELDS + markup_fields)):
+            text = '\n'.join(values[field] for field in TEXT_FIELDS if values[field]).lower()
+            if not any(name in text for name in lowered_names):
+                continue
+            markups = {}
+            for field, markup_field in zip(TEXT_FIELDS, markup_fields):
+                if values[field]:
+                    markup = update_thing_references(values[field], campaign)
+                    if markup != values[markup_field]:
+                        markups[markup_field] = markup
+            if markups:
+                changes.append((values['pk'], markups))
+    update_markup(changes)
+    logger.debug('Updated the markup of {0} of {1} things that may mention {2} changed names'.format(len(changes), len(thing_ids), len(names)))
+    return len(changes)
+
+
+def flush_pending_mentions():
+    pending = getattr(_pending, 'names', None)
+    _pending.names = None
+    for campaign_id, names in (pending or {}).items():
+        remarkup_mentions(campaign_id, names)
+
+
+def queue_mentions(campaign_id, names):
+    if campaign_id is None:
+        return
+    if getattr(_pending, 'names', None) is None:
+        _pending.names = {}
+    _pending.names.setdefault(campaign_id, set()).update(name for name in names if name)
+    transaction.on_commit(flush_pending_mentions)
+
+
+def render_link(markup_symbol, name):
+    css_class, base_url = MARKUP_LINKS[markup_symbol]
+    if base_url is None:
+        return '<a class="{0}" href="{1}">{2}</a>'.format(css_class, escape(reverse('campaign:detail', args=(html.unescape(name),))), name)
+    return '<a class="{0}" href="{1}{2}" target="_blank">{3}</a>'.format(css_class, base_url, name.replace(' ', '-'), name)
+
+
+def render_markup(text):
+    body = escape(text)
+    for block_markup, block_html in MARKUP_BLOCKS:
+        body = body.replace(block_markup, block_html)
+
+    rendered = ['<p>']
+    opening_symbol = None
+    name = []
+    for piece in MARKUP_LINK_REGEX.split(body):
+        if piece in MARKUP_LINKS:
+            if opening_symbol:
+                rendered.append(render_link(piece, ''.join(name)))
+                opening_symbol = None
+                name = []
+            else:
+                opening_symbol = piece
+        elif opening_symbol:
+            name.append(piece)
+        else:
+            rendered.append(piece)
+    if opening_symbol:
+        rendered.append(opening_symbol + ''.join(name))
+    rendered.append('</p>')
+    return ''.join(rendered)
+
+
+def get_rendered_markup(text, field):
+    if not text:
+        return ''
+    key = (field, hashlib.sha1(text.encode('utf-8')).hexdigest())
+    rendered = _rendered_markup.get(key)
+    if rendered is None:
+        rendered = render_markup(text)
+        _rendered_markup[key] = rendered
+        while len(_rendered_markup) > MAX_RENDERED_MARKUP:
+            _rendered_markup.popitem(last=False)
+    else:
+        _rendered_markup.move_to_end(key)
+    return rendered
@@ -0,0 +1,65 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:00
+
+from collections import defaultdict
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_closure(apps, schema_editor):
+    Thing = apps.get_model('campaign', 'Thing')
+    ThingClosure = apps.get_model('campaign', 'ThingClosure')
+
+    children = defaultdict(list)
+    for parent_id, child_id in Thing.children.through.objects.values_list('from_thing_id', 'to_thing_id'):
+        children[parent_id].append(child_id)
+
+    below = {}
+
+    def collect(node, visiting):
+        if node not in below:
+            visiting.add(node)
+            paths = defaultdict(int)
+            for child in children.get(node, []):
+                if child not in visiting:
+                    paths[(child, 1)] += 1
+                    for (descendant, depth), count in collect(child, visiting).items():
+                        paths[(descendant, depth + 1)] += count
+            visiting.discard(node)
+            below[node] = paths
+        return below[node]
+
+    rows = []
+    for node in list(children):
+        for (descendant, depth), count in collect(node, set()).items():
+            rows.append(ThingClosure(ancestor_id=node, descendant_id=descendant, depth=depth, paths=count))
+    ThingClosure.objects.bulk_create(rows, batch_size=500)
+
+
+def delete_closure(apps, schema_editor):
+    apps.get_model('campaign', 'ThingClosure').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaign', '0060_auto_20200924_1620'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThingClosure',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('paths', models.PositiveIntegerField(default=1)),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='closure_descendants', to='campaign.Thing')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='closure_ancestors', to='campaign.Thing')),
+            ],
+            options={
+                'unique_together': {('ancestor', 'descendant', 'depth')},
+                'index_together': {('descendant', 'depth')},
+            },
+        ),
+        migrations.RunPython(build_closure, delete_closure),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:06
+
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def index_terms(apps, schema_editor):
+    Thing = apps.get_model('campaign', 'Thing')
+    ThingTerm = apps.get_model('campaign', 'ThingTerm')
+    terms = []
+    for pk, description, background, current_state in Thing.objects.values_list('pk', 'description', 'background', 'current_state'):
+        text = ' '.join(t for t in (description, background, current_state) if t).lower()
+        terms.extend(ThingTerm(thing_id=pk, term=term) for term in {term[:50] for term in re.findall(r'\w+', text)})
+    ThingTerm.objects.bulk_create(terms, batch_size=500)
+
+
+def delete_terms(apps, schema_editor):
+    apps.get_model('campaign', 'ThingTerm').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaign', '0061_thing_closure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThingTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(db_index=True, max_length=50)),
+                ('thing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='campaign.Thing')),
+            ],
+            options={
+                'unique_together': {('thing', 'term')},
+            },
+        ),
+        migrations.RunPython(index_terms, delete_terms),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('CREATE VIRTUAL TABLE IF NOT EXISTS campaign_thing_search USING fts5('
+                          'campaign_id UNINDEXED, name, description, background, current_state, attributes, random_attributes, '
+                          'tokenize = "unicode61 remove_diacritics 2")')
+    schema_editor.execute('INSERT INTO campaign_thing_search(rowid, campaign_id, name, description, background, current_state, attributes, random_attributes) '
+                          'SELECT t.id, t.campaign_id, t.name, t.description, COALESCE(t.background, \'\'), COALESCE(t.current_state, \'\'), '
+                          'COALESCE((SELECT group_concat(a.value, \' \') FROM campaign_attributevalue a WHERE a.thing_id = t.id), \'\'), '
+                          'COALESCE((SELECT group_concat(r.text, \' \') FROM campaign_randomattribute r WHERE r.thing_id = t.id), \'\') '
+                          'FROM campaign_thing t')
+
+
+def delete_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS campaign_thing_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaign', '0062_thing_term'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, delete_search_index),
+    ]
@@ -0,0 +1,119 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:19
+
+from collections import defaultdict
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def is_whole_words(text, start, end):
+    return (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum())
+
+
+def contains_name(text, name):
+    start = text.find(name)
+    while start != -1:
+        if is_whole_words(text, start, start + len(name)):
+            return True
+        start = text.find(name, start + 1)
+    return False
+
+
+def build_trie(patterns):
+    trie = {}
+    for pattern, symbol in patterns:
+        if not pattern:
+            continue
+        node = trie
+        for character in pattern:
+            node = node.setdefault(character, {})
+        node.setdefault(None, set()).add(symbol)
+    return trie
+
+
+def find_longest(trie, text):
+    matches = []
+    position = 0
+    while position < len(text):
+        node = trie
+        longest = None
+        for end in range(position + 1, len(text) + 1):
+            node = node.get(text[end - 1])
+            if node is None:
+                break
+            if None in node:
+                longest = (position, end, node[None])
+        if longest:
+            matches.append(longest)
+            position = longest[1]
+        else:
+            position += 1
+    return matches
+
+
+def index_references(apps, schema_editor):
+    Thing = apps.get_model('campaign', 'Thing')
+    ThingReference = apps.get_model('campaign', 'ThingReference')
+    AttributeValue = apps.get_model('campaign', 'AttributeValue')
+    RandomAttribute = apps.get_model('campaign', 'RandomAttribute')
+    RandomEncounter = apps.get_model('campaign', 'RandomEncounter')
+    DndBeyondRef = apps.get_model('campaign', 'DndBeyondRef')
+
+    things = {pk: (campaign_id, name) for pk, campaign_id, name in Thing.objects.exclude(campaign=None).values_list('pk', 'campaign_id', 'name')}
+    thing_ids = defaultdict(dict)
+    for pk, (campaign_id, name) in things.items():
+        thing_ids[campaign_id][name] = pk
+    dndbeyond_refs = list(DndBeyondRef.objects.values_list('name', 'dndbeyond_type__markup_symbol'))
+    tries = {campaign_id: build_trie(dndbeyond_refs + [(name, '@') for name in names]) for campaign_id, names in thing_ids.items()}
+
+    def find_referenced_things(thing_id, text):
+        campaign_id = things[thing_id][0]
+        return {thing_ids[campaign_id][text[start:end]] for start, end, symbols in find_longest(tries[campaign_id], text)
+                if '@' in symbols and is_whole_words(text, start, end)}
+
+    neighbours = defaultdict(set)
+    for parent_id, child_id in Thing.children.through.objects.values_list('from_thing_id', 'to_thing_id'):
+        if parent_id in things and child_id in things:
+            neighbours[parent_id].add(child_id)
+            neighbours[child_id].add(parent_id)
+
+    references = []
+    for thing_id, (campaign_id, name) in things.items():
+        for neighbour_id in neighbours[thing_id]:
+            if contains_name(name, things[neighbour_id][1]):
+                references.append(ThingReference(thing_id=neighbour_id, referencing_thing_id=thing_id))
+    for pk, thing_id, value, is_thing in AttributeValue.objects.values_list('pk', 'thing_id', 'value', 'attribute__is_thing'):
+        if thing_id not in things:
+            continue
+        if is_thing:
+            references.extend(ThingReference(thing_id=referenced_id, attribute_value_id=pk) for referenced_id in find_referenced_things(thing_id, value))
+        else:
+            references.extend(ThingReference(thing_id=related_id, attribute_value_id=pk) for related_id in neighbours[thing_id] | {thing_id}
+                              if contains_name(value, things[related_id][1]))
+    for model, field, source in [(RandomAttribute, 'text', 'random_attribute'), (RandomEncounter, 'name', 'random_encounter')]:
+        for pk, thing_id, text in model.objects.values_list('pk', 'thing_id', field):
+            if thing_id in things:
+                references.extend(ThingReference(thing_id=referenced_id, **{'{0}_id'.format(source): pk}) for referenced_id in find_referenced_things(thing_id, text))
+    ThingReference.objects.bulk_create(references, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaign', '0063_thing_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThingReference',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attribute_value', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='campaign.AttributeValue')),
+                ('random_attribute', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='campaign.RandomAttribute')),
+                ('random_encounter', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='campaign.RandomEncounter')),
+                ('referencing_thing', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='thing_references', to='campaign.Thing')),
+                ('thing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='references', to='campaign.Thing')),
+            ],
+        ),
+        migrations.RunPython(index_references, migrations.RunPython.noop),
+    ]
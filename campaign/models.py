@@ -39,6 +39,31 @@ class Thing(models.Model):
         return self.name
 
 
+class ThingClosure(models.Model):
+    ancestor = models.ForeignKey(Thing, on_delete=models.CASCADE, related_name='closure_descendants')
+    descendant = models.ForeignKey(Thing, on_delete=models.CASCADE, related_name='closure_ancestors')
+    depth = models.PositiveIntegerField()
+    paths = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        unique_together = (('ancestor', 'descendant', 'depth'),)
+        index_together = (('descendant', 'depth'),)
+
+    def __str__(self):
+        return '{0} > {1} ({2})'.format(self.ancestor.name, self.descendant.name, self.depth)
+
+
+class ThingTerm(models.Model):
+    thing = models.ForeignKey(Thing, on_delete=models.CASCADE)
+    term = models.CharField(max_length=50, db_index=True)
+
+    class Meta:
+        unique_together = (('thing', 'term'),)
+
+    def __str__(self):
+        return '[{0}] {1}'.format(self.thing.name, self.term)
+
+
 class Attribute(models.Model):
     thing_type = models.ForeignKey(ThingType, on_delete=models.CASCADE)
     name = models.CharField(max_length=50)
@@ -65,6 +90,17 @@ class AttributeValue(models.Model):
         return '[{0}] {1}:{2}'.format(self.thing.name, self.attribute.name, self.value)
 
 
+class ThingReference(models.Model):
+    thing = models.ForeignKey(Thing, on_delete=models.CASCADE, related_name='references')
+    referencing_thing = models.ForeignKey(Thing, on_delete=models.CASCADE, null=True, blank=True, related_name='thing_references')
+    attribute_value = models.ForeignKey(AttributeValue, on_delete=models.CASCADE, null=True, blank=True)
+    random_attribute = models.ForeignKey('RandomAttribute', on_delete=models.CASCADE, null=True, blank=True)
+    random_encounter = models.ForeignKey('RandomEncounter', on_delete=models.CASCADE, null=True, blank=True)
+
+    def __str__(self):
+        return '{0} <- {1}'.format(self.thing.name, self.referencing_thing or self.attribute_value or self.random_attribute or self.random_encounter)
+
+
 class UsefulLink(models.Model):
     thing = models.ForeignKey(Thing, on_delete=models.CASCADE)
     name = models.CharField(max_length=50)
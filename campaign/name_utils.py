@@ -0,0 +1,302 @@
+import bisect
+import heapq
+import logging
+import random
+import re
+import threading
+from collections import defaultdict
+
+from .models import Thing
+from .prefix_trie import PrefixTrie
+from .randomizer_registry import get_randomizer_registry
+from .randomizers import get_random_attribute_in_category_raw
+from .trigram_index import TrigramIndex
+
+
+logger = logging.getLogger(__name__)
+
+
+MAX_UNIQUE_NAME_ATTEMPTS = 100
+MAX_SIMILAR_NAMES = 5
+MIN_NAME_SIMILARITY = 0.3
+MIN_REDIRECT_SIMILARITY = 0.5
+MAX_TYPEAHEAD_RESULTS = 20
+MAX_TYPEAHEAD_KEY_LENGTH = 16
+WORD_START_REGEX = re.compile(r'\b\w')
+
+_thing_names = {}
+_name_indexes = {}
+_name_tries = {}
+_names_lock = threading.RLock()
+
+
+def get_thing_names(campaign):
+    with _names_lock:
+        names = _thing_names.get(campaign.pk)
+        if names is None:
+            names = set(Thing.objects.filter(campaign=campaign).values_list('name', flat=True))
+            _thing_names[campaign.pk] = names
+            logger.debug('Loaded {0} thing names for {1}'.format(len(names), campaign.name))
+        return names
+
+
+def is_name_in_use(campaign, name):
+    with _names_lock:
+        return name in get_thing_names(campaign)
+
+
+def get_name_index(campaign):
+    with _names_lock:
+        index = _name_indexes.get(campaign.pk)
+        if index is None:
+            index = TrigramIndex(get_thing_names(campaign))
+            _name_indexes[campaign.pk] = index
+            logger.debug('Built the name trigram index for {0}: {1} trigrams'.format(campaign.name, len(index.postings)))
+        return index
+
+
+def find_similar_names(campaign, name, limit=MAX_SIMILAR_NAMES, min_similarity=MIN_NAME_SIMILARITY):
+    with _names_lock:
+        return get_name_index(campaign).search(name, limit, min_similarity)
+
+
+def get_typeahead_keys(name):
+    lowered = name.lower()
+    return {lowered[match.start():] for match in WORD_START_REGEX.finditer(lowered)}
+
+
+def new_name_trie():
+    return PrefixTrie(MAX_TYPEAHEAD_KEY_LENGTH)
+
+
+def add_name_to_trie(trie, name):
+    for key in get_typeahead_keys(name):
+        trie.add(key, name)
+
+
+def remove_name_from_trie(trie, name):
+    for key in get_typeahead_keys(name):
+        trie.remove(key, name)
+
+
+def get_name_tries(campaign):
+    with _names_lock:
+        tries = _name_tries.get(campaign.pk)
+        if tries is None:
+            tries = defaultdict(new_name_trie)
+            for name, thing_type_id in Thing.objects.filter(campaign=campaign).values_list('name', 'thing_type_id'):
+                add_name_to_trie(tries[thing_type_id], name)
+            _name_tries[campaign.pk] = tries
+            logger.debug('Built the typeahead tries for {0}: {1} nodes'.format(campaign.name, sum(len(trie.transitions) for trie in tries.values())))
+        return tries
+
+
+def find_names_starting_with(campaign, text, thing_type_ids=None, limit=MAX_TYPEAHEAD_RESULTS):
+    prefix = ' '.join(text.lower().split())
+    if not prefix:
+        return []
+    names = []
+    with _names_lock:
+        tries = get_name_tries(campaign)
+        if thing_type_ids is None:
+            thing_type_ids = list(tries)
+        matches = heapq.merge(*[tries[thing_type_id].iter_values(prefix) for thing_type_id in thing_type_ids if thing_type_id in tries])
+        for key, name in matches:
+            if name in names or (len(prefix) > MAX_TYPEAHEAD_KEY_LENGTH and prefix not in name.lower()):
+                continue
+            names.append(name)
+            if len(names) >= limit:
+                break
+    return names
+
+
+def add_thing_name(campaign_id, name, thing_type_id=None):
+    with _names_lock:
+        names = _thing_names.get(campaign_id)
+        if names is not None:
+            names.add(name)
+        index = _name_indexes.get(campaign_id)
+        if index is not None:
+            index.add(name)
+        tries = _name_tries.get(campaign_id)
+        if tries is not None:
+            add_name_to_trie(tries[thing_type_id], name)
+
+
+def remove_thing_name(campaign_id, name, thing_type_id=None):
+    with _names_lock:
+        names = _thing_names.get(campaign_id)
+        if names is not None:
+            names.discard(name)
+        index = _name_indexes.get(campaign_id)
+        if index is not None:
+            index.remove(name)
+        tries = _name_tries.get(campaign_id)
+        if tries is not None and thing_type_id in tries:
+            remove_name_from_trie(tries[thing_type_id], name)
+
+
+def clear_thing_names(campaign_id=None):
+    with _names_lock:
+        if campaign_id is None:
+            _thing_names.clear()
+            _name_indexes.clear()
+            _name_tries.clear()
+        else:
+            _thing_names.pop(campaign_id, None)
+            _name_indexes.pop(campaign_id, None)
+            _name_tries.pop(campaign_id, None)
+
+
+def roll_unique_name(campaign, roll, must_be_unique, randomizer_name, is_in_use=None):
+    if is_in_use is None:
+        is_in_use = lambda name: is_name_in_use(campaign, name)
+    value = roll()
+    attempts = 1
+    while must_be_unique and is_in_use(value):
+        if attempts >= MAX_UNIQUE_NAME_ATTEMPTS:
+            raise ValueError('Ran out of unique names in {0} after {1} attempts'.format(randomizer_name, attempts))
+        logger.debug('Tried to use {0} but was in use'.format(value))
+        value = roll()
+        attempts += 1
+    return value
+
+
+def join_name_parts(first, second):
+    if second == second.lower():
+        return first + second
+    else:
+        return first + ' ' + second
+
+
+class IndexPermutation(object):
+    def __init__(self, size, rounds=4):
+        self.size = size
+        bits = max(2, (size - 1).bit_length())
+        self.half_bits = (bits + 1) // 2
+        self.mask = (1 << self.half_bits) - 1
+        self.keys = [random.getrandbits(32) for i in range(0, rounds)]
+
+    def permute(self, value):
+        left = value >> self.half_bits
+        right = value & self.mask
+        for key in self.keys:
+            left, right = right, left ^ (hash((right, key)) & self.mask)
+        return (left << self.half_bits) | right
+
+    def __getitem__(self, index):
+        value = self.permute(index)
+        while value >= self.size:
+            value = self.permute(value)
+        return value
+
+
+class NameSpace(object):
+    def __init__(self, relations):
+        self.blocks = []
+        self.offsets = []
+        self.size = 0
+
+        if relations.synonym_first:
+            synonym_variants = [(relations.synonym_first.options, lambda synonym, name: synonym + ' ' + name)]
+            if relations.synonym_last:
+                synonym_variants.append((relations.synonym_last.options, lambda synonym, name: name + ' ' + synonym))
+        elif relations.synonym_last:
+            synonym_variants = [(relations.synonym_last.options, lambda synonym, name: name + ' ' + synonym)]
+        else:
+            synonym_variants = [None]
+
+        for source in relations.sources:
+            second_options = source.second.options if source.second else ()
+            cores = []
+            if source.options and second_options:
+                cores.append(((source.options, second_options), lambda parts: join_name_parts(parts[0], parts[1])))
+            elif source.options:
+                cores.append(((source.options,), lambda parts: parts[0]))
+            elif second_options:
+                cores.append(((second_options,), lambda parts: join_name_parts('', parts[0])))
+            if second_options and source.second.can_combine_with_self:
+                cores.append(((second_options, second_options), lambda parts: parts[0] + ' and ' + parts[1]))
+
+            for radices, render_core in cores:
+                for synonym_variant in synonym_variants:
+                    if synonym_variant:
+                        synonym_options, add_synonym = synonym_variant
+                        self.add_block(radices + (synonym_options,),
+                                       lambda parts, render_core=render_core, add_synonym=add_synonym: add_synonym(parts[-1], render_core(parts[:-1])))
+                    else:
+                        self.add_block(radices, render_core)
+
+    def add_block(self, radices, render):
+        size = 1
+        for options in radices:
+            size *= len(options)
+        if size:
+            self.offsets.append(self.size)
+            self.blocks.append((radices, render))
+            self.size += size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        block = bisect.bisect_right(self.offsets, index) - 1
+        radices, render = self.blocks[block]
+        index -= self.offsets[block]
+        parts = []
+        for options in reversed(radices):
+            index, digit = divmod(index, len(options))
+            parts.append(options[digit])
+        parts.reverse()
+        return render(parts)
+
+
+class NameSampler(object):
+    def __init__(self, relations):
+        self.relations = relations
+        self.name_space = NameSpace(relations)
+        self.permutation = IndexPermutation(len(self.name_space))
+        self.cursor = 0
+
+    def next_name(self, is_in_use):
+        restarted = False
+        while True:
+            if self.cursor >= len(self.name_space):
+                if restarted or not len(self.name_space):
+                    return None
+                self.permutation = IndexPermutation(len(self.name_space))
+                self.cursor = 0
+                restarted = True
+            name = self.name_space[self.permutation[self.cursor]]
+            self.cursor += 1
+            if not is_in_use(name):
+                return name
+
+
+_name_samplers = {}
+
+
+def sample_unique_name(campaign, randomizer_attribute_category, is_in_use=None):
+    registry = get_randomizer_registry()
+    relations = registry.relations[randomizer_attribute_category.id]
+    key = (campaign.pk, randomizer_attribute_category.id)
+    if is_in_use is None:
+        is_in_use = lambda name: is_name_in_use(campaign, name)
+    with _names_lock:
+        sampler = _name_samplers.get(key)
+        if sampler is None or sampler.relations is not relations:
+            sampler = NameSampler(relations)
+            _name_samplers[key] = sampler
+        name = sampler.next_name(is_in_use)
+    if name is None:
+        raise ValueError('Ran out of unique names in {0}.{1}: all {2} combinations are in use'.format(registry.attributes_by_id[randomizer_attribute_category.attribute_id].name,
+                                                                                                        randomizer_attribute_category.name,
+                                                                                                        len(sampler.name_space)))
+    return name
+
+
+def roll_name_in_category(campaign, thing_type, attribute, category, must_be_unique, is_in_use=None):
+    if must_be_unique:
+        registry = get_randomizer_registry()
+        return sample_unique_name(campaign, registry.get_category(registry.get_attribute(thing_type, attribute), category), is_in_use)
+    return get_random_attribute_in_category_raw(thing_type=thing_type, attribute=attribute, category=category)
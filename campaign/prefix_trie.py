@@ -0,0 +1,48 @@
+class PrefixTrie(object):
+    __slots__ = ['transitions', 'values', 'max_depth']
+
+    def __init__(self, max_depth=None):
+        self.transitions = [{}]
+        self.values = [None]
+        self.max_depth = max_depth
+
+    def find_node(self, key):
+        node = 0
+        for character in key[:self.max_depth]:
+            node = self.transitions[node].get(character)
+            if node is None:
+                return None
+        return node
+
+    def add(self, key, value):
+        node = 0
+        for character in key[:self.max_depth]:
+            next_node = self.transitions[node].get(character)
+            if next_node is None:
+                next_node = len(self.transitions)
+                self.transitions[node][character] = next_node
+                self.transitions.append({})
+                self.values.append(None)
+            node = next_node
+        if self.values[node] is None:
+            self.values[node] = set()
+        self.values[node].add(value)
+
+    def remove(self, key, value):
+        node = self.find_node(key)
+        if node is not None and self.values[node]:
+            self.values[node].discard(value)
+
+    def iter_values(self, prefix):
+        node = self.find_node(prefix)
+        if node is None:
+            return
+        transitions, values = self.transitions, self.values
+        stack = [(prefix[:self.max_depth], node)]
+        while stack:
+            key, node = stack.pop()
+            if values[node]:
+                for value in sorted(values[node]):
+                    yield key, value
+            for character in sorted(transitions[node], reverse=True):
+                stack.append((key + character, transitions[node][character]))
@@ -0,0 +1,70 @@
+import logging
+import uuid
+from collections import OrderedDict, namedtuple
+
+from django.db import IntegrityError
+
+from .generator_utils import build_thing_tree, get_generator_plan, save_thing_tree
+from .name_utils import is_name_in_use
+
+
+logger = logging.getLogger(__name__)
+
+
+MAX_PREVIEWS = 20
+
+GeneratorPreview = namedtuple('GeneratorPreview', ['token', 'generator_name', 'campaign', 'parent', 'tree'])
+
+_previews = OrderedDict()
+
+
+def create_preview(generator_object, campaign, parent=None):
+    tree = build_thing_tree(get_generator_plan(generator_object.pk), campaign, parent)
+    if not tree:
+        return None
+    preview = GeneratorPreview(token=uuid.uuid4().hex, generator_name=generator_object.name, campaign=campaign, parent=parent, tree=tree)
+    _previews[preview.token] = preview
+    while len(_previews) > MAX_PREVIEWS:
+        expired_token, expired_preview = _previews.popitem(last=False)
+        logger.debug('Discarded preview of {0}: too many previews'.format(expired_preview.tree.thing.name))
+    logger.info('Previewing {0} ({1} things) as {2}'.format(tree.thing.name, len(list(tree.walk())), preview.token))
+    return preview
+
+
+def get_preview(token):
+    return _previews.get(token)
+
+
+def discard_preview(token):
+    return _previews.pop(token, None)
+
+
+def commit_preview(token):
+    preview = _previews.get(token)
+    if preview is None:
+        return None
+    for node in preview.tree.walk():
+        if is_name_in_use(preview.campaign, node.thing.name):
+            raise ValueError('Cannot keep {0}: {1} already exists'.format(preview.tree.thing.name, node.thing.name))
+    try:
+        save_thing_tree(preview.tree, preview.campaign, preview.parent)
+    except IntegrityError:
+        raise ValueError('Cannot keep {0}: one of its names was taken after the preview was made'.format(preview.tree.thing.name))
+    discard_preview(token)
+    return preview
+
+
+def preview_to_context(node, shown=None):
+    if shown is None:
+        shown = set()
+    repeated = id(node) in shown
+    shown.add(id(node))
+    return {
+        'name': node.thing.name,
+        'thing_type': node.thing.thing_type.name,
+        'description': node.thing.description,
+        'repeated': repeated,
+        'attributes': [{'name': a.attribute.name, 'value': a.value} for a in node.attribute_values.values() if a.value] if not repeated else [],
+        'random_attributes': [r.text for r in node.random_attributes] if not repeated else [],
+        'children': [preview_to_context(child, shown) for child in node.children] if not repeated else []
+    }
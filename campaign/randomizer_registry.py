@@ -0,0 +1,130 @@
+import logging
+from collections import OrderedDict, namedtuple
+
+from .models import RandomizerAttribute, RandomizerAttributeCategory, RandomizerAttributeOption, RandomizerAttributeCategoryOption
+
+
+logger = logging.getLogger(__name__)
+
+
+CompiledAttribute = namedtuple('CompiledAttribute', ['id', 'name', 'thing_type', 'concatenate_results', 'can_randomize_later',
+                                                     'must_be_unique', 'max_options_to_use', 'options', 'categories'])
+CompiledCategory = namedtuple('CompiledCategory', ['id', 'name', 'attribute_id', 'show', 'can_combine_with_self', 'max_options_to_use',
+                                                   'can_randomize_later', 'must_be_unique', 'options', 'use_values_from'])
+
+CategorySource = namedtuple('CategorySource', ['options', 'second'])
+CategoryRelations = namedtuple('CategoryRelations', ['sources', 'synonym_first', 'synonym_last'])
+
+
+class RandomizerRegistry(object):
+    def __init__(self, attributes, categories):
+        self.attributes = attributes
+        self.categories = categories
+        self.attributes_by_id = {a.id: a for a in attributes.values()}
+        self.relations = {c.id: self.build_category_relations(c) for c in categories.values()}
+
+    def get_attribute(self, thing_type, attribute):
+        try:
+            return self.attributes[(str(thing_type).lower(), attribute.lower())]
+        except KeyError:
+            raise ValueError('Invalid randomizer attribute: {0}'.format(attribute))
+
+    def get_category(self, compiled_attribute, category):
+        try:
+            return compiled_attribute.categories[category.lower()]
+        except KeyError:
+            raise ValueError('Invalid randomizer attribute category for {0}: {1}'.format(compiled_attribute.name, category))
+
+    def get_sibling_category(self, category, suffix):
+        sibling = self.attributes_by_id[category.attribute_id].categories.get((category.name + suffix).lower())
+        if sibling and not sibling.options:
+            logger.warning('Ignoring {0}: it has no options'.format(sibling.name))
+            return None
+        return sibling
+
+    def build_category_relations(self, category):
+        if category.use_values_from:
+            source_categories = [self.categories[category_id] for category_id in category.use_values_from]
+        else:
+            source_categories = [category]
+        return CategoryRelations(sources=tuple(CategorySource(options=c.options, second=self.get_sibling_category(c, '_2')) for c in source_categories),
+                                 synonym_first=self.get_sibling_category(category, '_synonym_first'),
+                                 synonym_last=self.get_sibling_category(category, '_synonym_last'))
+
+    def get_attributes_for_thing_type(self, thing_type):
+        thing_type_name = str(thing_type).lower()
+        return [a for key, a in self.attributes.items() if key[0] == thing_type_name]
+
+
+_registry = None
+_registry_version = 0
+
+
+def build_randomizer_registry():
+    attribute_options = {}
+    for attribute_id, name in RandomizerAttributeOption.objects.order_by('pk').values_list('attribute_id', 'name'):
+        attribute_options.setdefault(attribute_id, []).append(name)
+
+    category_options = {}
+    for category_id, name in RandomizerAttributeCategoryOption.objects.order_by('pk').values_list('category_id', 'name'):
+        category_options.setdefault(category_id, []).append(name)
+
+    use_values_from = {}
+    through = RandomizerAttributeCategory.use_values_from.through
+    for from_id, to_id in through.objects.order_by('pk').values_list('from_randomizerattributecategory_id', 'to_randomizerattributecategory_id'):
+        use_values_from.setdefault(from_id, []).append(to_id)
+
+    categories = {}
+    categories_by_attribute = {}
+    for category in RandomizerAttributeCategory.objects.order_by('name'):
+        compiled_category = CompiledCategory(id=category.pk,
+                                             name=category.name,
+                                             attribute_id=category.attribute_id,
+                                             show=category.show,
+                                             can_combine_with_self=category.can_combine_with_self,
+                                             max_options_to_use=category.max_options_to_use,
+                                             can_randomize_later=category.can_randomize_later,
+                                             must_be_unique=category.must_be_unique,
+                                             options=tuple(category_options.get(category.pk, [])),
+                                             use_values_from=tuple(use_values_from.get(category.pk, [])))
+        categories[category.pk] = compiled_category
+        categories_by_attribute.setdefault(category.attribute_id, OrderedDict())[category.name.lower()] = compiled_category
+
+    attributes = {}
+    for attribute in RandomizerAttribute.objects.select_related('thing_type'):
+        attributes[(attribute.thing_type.name.lower(), attribute.name.lower())] = CompiledAttribute(id=attribute.pk,
+                                                                                                 name=attribute.name,
+                                                                                                 thing_type=attribute.thing_type.name,
+                                                                                                 concatenate_results=attribute.concatenate_results,
+                                                                                                 can_randomize_later=attribute.can_randomize_later,
+                                                                                                 must_be_unique=attribute.must_be_unique,
+                                                                                                 max_options_to_use=attribute.max_options_to_use,
+                                                                                                 options=tuple(attribute_options.get(attribute.pk, [])),
+                                                                                                 categories=categories_by_attribute.get(attribute.pk, OrderedDict()))
+
+    logger.debug('Compiled randomizer registry: {0} attributes, {1} categories'.format(len(attributes), len(categories)))
+    return RandomizerRegistry(attributes=attributes, categories=categories)
+
+
+def get_randomizer_registry():
+    global _registry
+    registry = _registry
+    if registry is None:
+        version = _registry_version
+        registry = build_randomizer_registry()
+        if version == _registry_version:
+            _registry = registry
+    return registry
+
+
+def rebuild_randomizer_registry():
+    global _registry
+    clear_randomizer_registry()
+    _registry = build_randomizer_registry()
+    return _registry
+
+
+def clear_randomizer_registry():
+    global _registry, _registry_version
+    _registry_version += 1
+    _registry = None
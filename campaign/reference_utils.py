@@ -0,0 +1,235 @@
+import logging
+import threading
+from collections import defaultdict, deque
+
+from django.db import transaction
+from django.db.models import Case, Q, TextField, Value, When
+
+from .markup_utils import TEXT_FIELDS, THING_MARKUP_SYMBOL, find_references
+from .models import AttributeValue, RandomAttribute, RandomEncounter, Thing, ThingReference
+from .search_utils import queue_search_index
+
+
+logger = logging.getLogger(__name__)
+
+
+MAX_IDS_PER_QUERY = 500
+MAX_NAMES_PER_QUERY = 100
+MAX_ROWS_PER_UPDATE = 100
+REFERENCE_SOURCES = [
+    ('attribute_value', AttributeValue, 'value'),
+    ('random_attribute', RandomAttribute, 'text'),
+    ('random_encounter', RandomEncounter, 'name')
+]
+
+_pending = threading.local()
+
+
+def is_whole_words(text, start, end):
+    return (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum())
+
+
+def contains_name(text, name):
+    start = text.find(name)
+    while start != -1:
+        if is_whole_words(text, start, start + len(name)):
+            return True
+        start = text.find(name, start + 1)
+    return False
+
+
+def find_referenced_names(campaign_id, text):
+    return {text[start:end] for start, end, symbols in find_references(campaign_id, text)
+            if THING_MARKUP_SYMBOL in symbols and is_whole_words(text, start, end)}
+
+
+def get_neighbours(thing_ids):
+    neighbours = defaultdict(set)
+    edges = Thing.children.through.objects
+    for i in range(0, len(thing_ids), MAX_IDS_PER_QUERY):
+        chunk = thing_ids[i:i + MAX_IDS_PER_QUERY]
+        for parent_id, child_id in edges.filter(Q(from_thing_id__in=chunk) | Q(to_thing_id__in=chunk)).values_list('from_thing_id', 'to_thing_id'):
+            neighbours[parent_id].add(child_id)
+            neighbours[child_id].add(parent_id)
+    return neighbours
+
+
+def find_things_mentioning(campaign_id, names):
+    names = sorted(names)
+    thing_ids = set()
+    for i in range(0, len(names), MAX_NAMES_PER_QUERY):
+        chunk = names[i:i + MAX_NAMES_PER_QUERY]
+        for source, model, field in REFERENCE_SOURCES:
+            mentions = Q()
+            for name in chunk:
+                mentions |= Q(**{'{0}__contains'.format(field): name})
+            thing_ids.update(model.objects.filter(mentions, thing__campaign_id=campaign_id).values_list('thing_id', flat=True).distinct())
+    return thing_ids
+
+
+def index_thing_references(campaign_id, thing_ids):
+    thing_ids = sorted(thing_ids)
+    neighbours = get_neighbours(thing_ids)
+    references = []
+    referenced_names = defaultdict(set)
+    for i in range(0, len(thing_ids), MAX_IDS_PER_QUERY):
+        chunk = thing_ids[i:i + MAX_IDS_PER_QUERY]
+        ThingReference.objects.filter(Q(referencing_thing_id__in=chunk) | Q(attribute_value__thing_id__in=chunk) |
+                                      Q(random_attribute__thing_id__in=chunk) | Q(random_encounter__thing_id__in=chunk)).delete()
+
+        names = dict(Thing.objects.filter(pk__in=set(chunk).union(*[neighbours[thing_id] for thing_id in chunk])).values_list('pk', 'name'))
+        for thing_id in chunk:
+            for neighbour_id in neighbours[thing_id]:
+                if thing_id in names and contains_name(names[thing_id], names[neighbour_id]):
+                    references.append(ThingReference(thing_id=neighbour_id, referencing_thing_id=thing_id))
+
+        for pk, thing_id, value, is_thing in AttributeValue.objects.filter(thing_id__in=chunk).values_list('pk', 'thing_id', 'value', 'attribute__is_thing'):
+            if is_thing:
+                for name in find_referenced_names(campaign_id, value):
+                    referenced_names[name].add(('attribute_value', pk))
+            else:
+                for related_id in neighbours[thing_id] | {thing_id}:
+                    if contains_name(value, names[related_id]):
+                        references.append(ThingReference(thing_id=related_id, attribute_value_id=pk))
+
+        for source, model, field in REFERENCE_SOURCES[1:]:
+            for pk, text in model.objects.filter(thing_id__in=chunk).values_list('pk', field):
+                for name in find_referenced_names(campaign_id, text):
+                    referenced_names[name].add((source, pk))
+
+    names = sorted(referenced_names)
+    for i in range(0, len(names), MAX_IDS_PER_QUERY):
+        for name, thing_id in Thing.objects.filter(campaign_id=campaign_id, name__in=names[i:i + MAX_IDS_PER_QUERY]).values_list('name', 'pk'):
+            for source, pk in referenced_names[name]:
+                references.append(ThingReference(thing_id=thing_id, **{'{0}_id'.format(source): pk}))
+    ThingReference.objects.bulk_create(references)
+    logger.debug('Indexed {0} references from {1} things'.format(len(references), len(thing_ids)))
+    return len(references)
+
+
+def get_reference_origins(thing_ids):
+    thing_ids = sorted(thing_ids)
+    origins = set()
+    for i in range(0, len(thing_ids), MAX_IDS_PER_QUERY):
+        for row in ThingReference.objects.filter(thing_id__in=thing_ids[i:i + MAX_IDS_PER_QUERY]) \
+                .values_list('referencing_thing_id', 'attribute_value__thing_id', 'random_attribute__thing_id', 'random_encounter__thing_id'):
+            origins.update(row)
+    origins.discard(None)
+    return origins
+
+
+def flush_pending_references():
+    thing_ids = getattr(_pending, 'thing_ids', None) or set()
+    names = getattr(_pending, 'names', None) or {}
+    _pending.thing_ids = None
+    _pending.names = None
+    if not thing_ids and not names:
+        return
+
+    for campaign_id, campaign_names in names.items():
+        thing_ids.update(find_things_mentioning(campaign_id, campaign_names))
+    neighbours = get_neighbours(sorted(thing_ids))
+    thing_ids = thing_ids.union(*neighbours.values()) | get_reference_origins(thing_ids)
+
+    things_by_campaign = defaultdict(set)
+    thing_ids = sorted(thing_ids)
+    for i in range(0, len(thing_ids), MAX_IDS_PER_QUERY):
+        for thing_id, campaign_id in Thing.objects.filter(pk__in=thing_ids[i:i + MAX_IDS_PER_QUERY]).values_list('pk', 'campaign_id'):
+            if campaign_id is not None:
+                things_by_campaign[campaign_id].add(thing_id)
+    for campaign_id, campaign_thing_ids in things_by_campaign.items():
+        index_thing_references(campaign_id, campaign_thing_ids)
+
+
+def queue_references(thing_ids, campaign_id=None, names=()):
+    if getattr(_pending, 'thing_ids', None) is None:
+        _pending.thing_ids = set()
+    if getattr(_pending, 'names', None) is None:
+        _pending.names = {}
+    _pending.thing_ids.update(thing_id for thing_id in thing_ids if thing_id)
+    if campaign_id is not None and names:
+        _pending.names.setdefault(campaign_id, set()).update(name for name in names if name)
+    transaction.on_commit(flush_pending_references)
+
+
+def rebuild_thing_references():
+    with transaction.atomic():
+        ThingReference.objects.all().delete()
+        for campaign_id in Thing.objects.exclude(campaign=None).values_list('campaign_id', flat=True).distinct():
+            index_thing_references(campaign_id, Thing.objects.filter(campaign_id=campaign_id).values_list('pk', flat=True))
+    logger.info('Rebuilt the thing references: {0} rows'.format(ThingReference.objects.count()))
+
+
+def update_value_in_string(string, old_value, new_value):
+    new_string = string.replace(old_value, new_value)
+
+    if ' ' in old_value:
+        old_pieces = old_value.split(' ')
+        new_pieces = new_value.split(' ')
+        for i, piece in enumerate(old_pieces):
+            if i >= len(new_pieces):
+                break
+            new_string = new_string.replace(piece, new_pieces[i])
+    return new_string
+
+
+def collect_renames(thing, new_name):
+    renames = []
+    row_renames = defaultdict(list)
+    seen = {thing.pk}
+    worklist = deque([(thing, new_name)])
+    while worklist:
+        current, name = worklist.popleft()
+        renames.append((current, current.name, name))
+        referencing_ids = []
+        for row in ThingReference.objects.filter(thing=current).values_list('referencing_thing_id', 'attribute_value_id', 'random_attribute_id', 'random_encounter_id'):
+            if row[0]:
+                referencing_ids.append(row[0])
+            for (source, model, field), pk in zip(REFERENCE_SOURCES, row[1:]):
+                if pk:
+                    row_renames[(source, pk)].append((current.name, name))
+        for referencing_thing in Thing.objects.filter(pk__in=referencing_ids).exclude(pk__in=seen):
+            referencing_name = update_value_in_string(referencing_thing.name, current.name, name)
+            if referencing_name != referencing_thing.name:
+                seen.add(referencing_thing.pk)
+                worklist.append((referencing_thing, referencing_name))
+    return renames, row_renames
+
+
+def rewrite_reference_rows(row_renames):
+    thing_ids = set()
+    for source, model, field in REFERENCE_SOURCES:
+        pks = sorted(pk for row_source, pk in row_renames if row_source == source)
+        changes = []
+        for i in range(0, len(pks), MAX_IDS_PER_QUERY):
+            for pk, thing_id, text in model.objects.filter(pk__in=pks[i:i + MAX_IDS_PER_QUERY]).values_list('pk', 'thing_id', field):
+                new_text = text
+                for old_name, new_name in row_renames[(source, pk)]:
+                    new_text = update_value_in_string(new_text, old_name, new_name)
+                if new_text != text:
+                    changes.append((pk, new_text))
+                    thing_ids.add(thing_id)
+        for i in range(0, len(changes), MAX_ROWS_PER_UPDATE):
+            chunk = changes[i:i + MAX_ROWS_PER_UPDATE]
+            cases = Case(*[When(pk=pk, then=Value(text)) for pk, text in chunk], output_field=TextField())
+            model.objects.filter(pk__in=[pk for pk, text in chunk]).update(**{field: cases})
+        if changes:
+            logger.info('Updated {0} {1} references'.format(len(changes), source.replace('_', ' ')))
+    queue_search_index(thing_ids)
+
+
+def rename_thing(thing, new_name):
+    flush_pending_references()
+    renames, row_renames = collect_renames(thing, new_name)
+    with transaction.atomic():
+        for renamed_thing, old_name, name in renames:
+            renamed_thing.name = name
+            for field in TEXT_FIELDS:
+                value = getattr(renamed_thing, field)
+                if value:
+                    setattr(renamed_thing, field, update_value_in_string(value, old_name, name))
+            renamed_thing.save()
+            if renamed_thing is not thing:
+                logger.info('Updated name of {0}: {1}'.format(old_name, name))
+        rewrite_reference_rows(row_renames)
+    return renames
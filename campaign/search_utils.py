@@ -0,0 +1,112 @@
+import logging
+import re
+import threading
+from collections import namedtuple
+
+from django.db import DatabaseError, connection, transaction
+from django.utils.html import escape
+
+from .models import Thing
+
+
+logger = logging.getLogger(__name__)
+
+
+SEARCH_TABLE = 'campaign_thing_search'
+MAX_SEARCH_RESULTS = 50
+MAX_IDS_PER_QUERY = 500
+SEARCH_TERM_REGEX = re.compile(r'\w+')
+SNIPPET_START = '\x02'
+SNIPPET_END = '\x03'
+SNIPPET_TOKENS = 12
+COLUMN_WEIGHTS = (0.0, 10.0, 2.0, 1.0, 1.0, 1.5, 0.5)
+
+INDEX_THINGS_SQL = (
+    'INSERT INTO {0}(rowid, campaign_id, name, description, background, current_state, attributes, random_attributes) '
+    'SELECT t.id, t.campaign_id, t.name, t.description, COALESCE(t.background, \'\'), COALESCE(t.current_state, \'\'), '
+    'COALESCE((SELECT group_concat(a.value, \' \') FROM campaign_attributevalue a WHERE a.thing_id = t.id), \'\'), '
+    'COALESCE((SELECT group_concat(r.text, \' \') FROM campaign_randomattribute r WHERE r.thing_id = t.id), \'\') '
+    'FROM campaign_thing t WHERE t.id IN ({1})'
+)
+SEARCH_SQL = (
+    'SELECT t.name, tt.name, snippet({0}, -1, %s, %s, \'...\', {1}), bm25({0}, {2}) AS rank '
+    'FROM {0} JOIN campaign_thing t ON t.id = {0}.rowid LEFT JOIN campaign_thingtype tt ON tt.id = t.thing_type_id '
+    'WHERE {0} MATCH %s AND {0}.campaign_id = %s ORDER BY rank LIMIT %s'
+)
+
+SearchResult = namedtuple('SearchResult', ['name', 'thing_type', 'snippet', 'rank'])
+
+_search_index_available = None
+_pending = threading.local()
+
+
+def is_search_index_available():
+    global _search_index_available
+    if _search_index_available is None:
+        _search_index_available = connection.vendor == 'sqlite' and SEARCH_TABLE in connection.introspection.table_names()
+        if not _search_index_available:
+            logger.warning('Full-text search is not available: searching thing names only')
+    return _search_index_available
+
+
+def index_things(thing_ids):
+    if not thing_ids or not is_search_index_available():
+        return
+    thing_ids = sorted(thing_ids)
+    with connection.cursor() as cursor:
+        for i in range(0, len(thing_ids), MAX_IDS_PER_QUERY):
+            chunk = thing_ids[i:i + MAX_IDS_PER_QUERY]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute('DELETE FROM {0} WHERE rowid IN ({1})'.format(SEARCH_TABLE, placeholders), chunk)
+            cursor.execute(INDEX_THINGS_SQL.format(SEARCH_TABLE, placeholders), chunk)
+    logger.debug('Reindexed {0} things for search'.format(len(thing_ids)))
+
+
+def flush_pending_search_index():
+    thing_ids = getattr(_pending, 'thing_ids', None)
+    _pending.thing_ids = None
+    index_things(thing_ids)
+
+
+def queue_search_index(thing_ids):
+    if getattr(_pending, 'thing_ids', None) is None:
+        _pending.thing_ids = set()
+    _pending.thing_ids.update(thing_id for thing_id in thing_ids if thing_id)
+    transaction.on_commit(flush_pending_search_index)
+
+
+def get_match_query(text):
+    terms = SEARCH_TERM_REGEX.findall(text)
+    return ' '.join('"{0}"*'.format(term) for term in terms)
+
+
+def format_snippet(snippet):
+    return escape(snippet).replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>')
+
+
+def search_things(campaign, text, limit=MAX_SEARCH_RESULTS):
+    if not is_search_index_available():
+        return [SearchResult(name=name, thing_type=thing_type, snippet='', rank=0)
+                for name, thing_type in Thing.objects.filter(campaign=campaign, name__icontains=text).order_by('name')
+                .values_list('name', 'thing_type__name')[:limit]]
+
+    match_query = get_match_query(text)
+    if not match_query:
+        return []
+    weights = ', '.join(str(weight) for weight in COLUMN_WEIGHTS)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(SEARCH_SQL.format(SEARCH_TABLE, SNIPPET_TOKENS, weights), [SNIPPET_START, SNIPPET_END, match_query, campaign.pk, limit])
+            rows = cursor.fetchall()
+    except DatabaseError as e:
+        logger.warning('Could not search for {0}: {1}'.format(text, e))
+        return []
+    return [SearchResult(name=name, thing_type=thing_type, snippet=format_snippet(snippet), rank=rank) for name, thing_type, snippet, rank in rows]
+
+
+def find_closest_name(names, text):
+    lowered = text.lower()
+    names = [name for name in names if lowered in name.lower()]
+    if not names:
+        return None
+    return min(names, key=lambda name: len(name) - len(text))
@@ -0,0 +1,155 @@
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import Thing, AttributeValue, DndBeyondRef, DndBeyondType, RandomAttribute, RandomEncounter, Weight, WeightPreset, ThingType, Attribute, GeneratorObject, GeneratorObjectContains, GeneratorObjectFieldToRandomizerAttribute, RandomizerAttribute, RandomizerAttributeCategory, RandomizerAttributeOption, RandomizerAttributeCategoryOption
+from .generator_utils import clear_generator_plans
+from .hierarchy_utils import add_edge_to_closure, check_for_cycle, detach_thing, remove_edge_from_closure
+from .markup_utils import add_dndbeyond_reference, add_thing_reference, clear_reference_automata, get_thing_text, index_thing_terms, queue_mentions, remove_dndbeyond_reference, remove_thing_reference
+from .name_utils import add_thing_name, remove_thing_name
+from .randomizer_registry import clear_randomizer_registry
+from .reference_utils import queue_references
+from .search_utils import queue_search_index
+from .weighted_sampling import clear_alias_tables
+
+
+def invalidate_randomizer_registry(sender, **kwargs):
+    clear_randomizer_registry()
+    clear_alias_tables()
+
+
+def invalidate_alias_tables(sender, **kwargs):
+    clear_alias_tables()
+
+
+def invalidate_generator_plans(sender, **kwargs):
+    clear_generator_plans()
+
+
+for randomizer_model in [ThingType, RandomizerAttribute, RandomizerAttributeCategory, RandomizerAttributeOption, RandomizerAttributeCategoryOption]:
+    post_save.connect(invalidate_randomizer_registry, sender=randomizer_model)
+    post_delete.connect(invalidate_randomizer_registry, sender=randomizer_model)
+
+for weight_model in [WeightPreset, Weight]:
+    post_save.connect(invalidate_alias_tables, sender=weight_model)
+    post_delete.connect(invalidate_alias_tables, sender=weight_model)
+
+for generator_model in [ThingType, Attribute, RandomizerAttribute, RandomizerAttributeCategory, GeneratorObject, GeneratorObjectContains,
+                        GeneratorObjectFieldToRandomizerAttribute]:
+    post_save.connect(invalidate_generator_plans, sender=generator_model)
+    post_delete.connect(invalidate_generator_plans, sender=generator_model)
+
+
+@receiver(m2m_changed, sender=RandomizerAttributeCategory.use_values_from.through)
+def invalidate_randomizer_registry_for_categories(sender, action, **kwargs):
+    if action.startswith('post_'):
+        clear_randomizer_registry()
+
+
+@receiver(post_init, sender=Thing)
+def remember_thing_name(sender, instance, **kwargs):
+    instance._original_name = instance.__dict__.get('name')
+    instance._original_campaign_id = instance.__dict__.get('campaign_id')
+    instance._original_thing_type_id = instance.__dict__.get('thing_type_id')
+    instance._original_text = get_thing_text(instance)
+
+
+@receiver(post_save, sender=Thing)
+def update_thing_names(sender, instance, created, **kwargs):
+    renamed = not created and (instance._original_name != instance.name or instance._original_campaign_id != instance.campaign_id)
+    if renamed or instance._original_thing_type_id != instance.thing_type_id:
+        remove_thing_name(instance._original_campaign_id, instance._original_name, instance._original_thing_type_id)
+    if renamed:
+        remove_thing_reference(instance._original_campaign_id, instance._original_name)
+        queue_mentions(instance._original_campaign_id, [instance._original_name])
+    add_thing_name(instance.campaign_id, instance.name, instance.thing_type_id)
+    add_thing_reference(instance.campaign_id, instance.name)
+    if created or renamed:
+        queue_mentions(instance.campaign_id, [instance.name])
+        queue_references([instance.pk], instance.campaign_id, [instance.name])
+    text_changed = instance._original_text != get_thing_text(instance)
+    if created or text_changed:
+        index_thing_terms(instance, created)
+    if created or renamed or text_changed:
+        queue_search_index([instance.pk])
+    instance._original_name = instance.name
+    instance._original_campaign_id = instance.campaign_id
+    instance._original_thing_type_id = instance.thing_type_id
+    instance._original_text = get_thing_text(instance)
+
+
+@receiver(post_delete, sender=Thing)
+def remove_deleted_thing_name(sender, instance, **kwargs):
+    remove_thing_name(instance._original_campaign_id, instance._original_name, instance._original_thing_type_id)
+    remove_thing_reference(instance._original_campaign_id, instance._original_name)
+    queue_mentions(instance._original_campaign_id, [instance._original_name])
+    queue_search_index([instance.pk])
+
+
+def reindex_thing_for_search(sender, instance, **kwargs):
+    queue_search_index([instance.thing_id])
+
+
+for searchable_model in [AttributeValue, RandomAttribute]:
+    post_save.connect(reindex_thing_for_search, sender=searchable_model)
+    post_delete.connect(reindex_thing_for_search, sender=searchable_model)
+
+
+def reindex_thing_references(sender, instance, **kwargs):
+    queue_references([instance.thing_id])
+
+
+for referencing_model in [AttributeValue, RandomAttribute, RandomEncounter]:
+    post_save.connect(reindex_thing_references, sender=referencing_model)
+
+
+@receiver(post_save, sender=DndBeyondRef)
+def update_dndbeyond_references(sender, instance, created, **kwargs):
+    if created:
+        add_dndbeyond_reference(instance.name, instance.dndbeyond_type.markup_symbol)
+    else:
+        clear_reference_automata()
+
+
+@receiver(post_delete, sender=DndBeyondRef)
+def remove_dndbeyond_references(sender, instance, **kwargs):
+    remove_dndbeyond_reference(instance.name, instance.dndbeyond_type.markup_symbol)
+
+
+def invalidate_reference_automata(sender, **kwargs):
+    clear_reference_automata()
+
+
+post_save.connect(invalidate_reference_automata, sender=DndBeyondType)
+post_delete.connect(invalidate_reference_automata, sender=DndBeyondType)
+
+
+def get_changed_edges(instance, reverse, pk_set):
+    edges = Thing.children.through.objects.filter(to_thing_id=instance.pk) if reverse else Thing.children.through.objects.filter(from_thing_id=instance.pk)
+    if pk_set is not None:
+        edges = edges.filter(from_thing_id__in=pk_set) if reverse else edges.filter(to_thing_id__in=pk_set)
+    return list(edges.values_list('from_thing_id', 'to_thing_id'))
+
+
+@receiver(m2m_changed, sender=Thing.children.through)
+def update_thing_closure(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('pre_add', 'post_add'):
+        edges = [(pk, instance.pk) if reverse else (instance.pk, pk) for pk in pk_set]
+        for parent_id, child_id in edges:
+            if action == 'pre_add':
+                check_for_cycle(parent_id, child_id)
+            else:
+                add_edge_to_closure(parent_id, child_id)
+    elif action in ('pre_remove', 'pre_clear'):
+        for parent_id, child_id in get_changed_edges(instance, reverse, pk_set if action == 'pre_remove' else None):
+            remove_edge_from_closure(parent_id, child_id)
+
+
+@receiver(m2m_changed, sender=Thing.children.through)
+def reindex_edge_references(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        queue_references([instance.pk])
+
+
+@receiver(pre_delete, sender=Thing)
+def remove_deleted_thing_from_closure(sender, instance, **kwargs):
+    detach_thing(instance)
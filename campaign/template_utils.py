@@ -0,0 +1,63 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+
+VARIABLE_REGEX = r'\$\{([^\}]+)\}'
+VARIABLE_PATTERN = re.compile(VARIABLE_REGEX)
+
+TemplateVariable = namedtuple('TemplateVariable', ['text', 'scope', 'name'])
+CompiledTemplate = namedtuple('CompiledTemplate', ['text', 'segments', 'variables'])
+
+
+def parse_variable(text, expression):
+    if '.' in expression:
+        scope, name = expression.split('.', 1)
+        return TemplateVariable(text=text, scope=scope.lower(), name=name)
+    return TemplateVariable(text=text, scope=None, name=expression)
+
+
+@lru_cache(maxsize=4096)
+def compile_template(text):
+    segments = []
+    variables = []
+    position = 0
+    for match in VARIABLE_PATTERN.finditer(text):
+        if match.start() > position:
+            segments.append(text[position:match.start()])
+        variable = parse_variable(match.group(0), match.group(1))
+        segments.append(variable)
+        variables.append(variable)
+        position = match.end()
+    if position < len(text):
+        segments.append(text[position:])
+    return CompiledTemplate(text=text, segments=tuple(segments), variables=tuple(variables))
+
+
+def render_template(template, resolve):
+    if not template.variables:
+        return template.text
+    rendered = []
+    for segment in template.segments:
+        if isinstance(segment, TemplateVariable):
+            value = resolve(segment)
+            rendered.append(segment.text if value is None else value)
+        else:
+            rendered.append(segment)
+    return ''.join(rendered)
+
+
+def render(text, resolve):
+    if not text or '${' not in text:
+        return text
+    return render_template(compile_template(text), resolve)
+
+
+def make_resolver(fields=None, get_parent_value=None):
+    def resolve(variable):
+        if variable.scope == 'parent':
+            return get_parent_value(variable.name) if get_parent_value else None
+        elif variable.scope is None and fields:
+            return fields.get(variable.name.lower())
+        return None
+    return resolve
@@ -0,0 +1,12 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from ..markup_utils import get_rendered_markup
+
+
+register = template.Library()
+
+
+@register.filter
+def render_markup(text, field='description'):
+    return mark_safe(get_rendered_markup(text, field))
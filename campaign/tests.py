@@ -1,3 +1,972 @@
-from django.test import TestCase
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 
-# Create your tests here.
+import json
+import random
+
+from .aho_corasick import Automaton
+from .estimate_utils import ESTIMATED_SECONDS_PER_THING, clear_save_timings, estimate_generator, record_save_time
+from .export_utils import EXPORT_CHUNK_SIZE, iter_campaign_json, save_campaign
+from .generator_utils import build_thing_tree, clear_generator_plans, edit_generator, generate_thing, get_generator_plan, get_template_problems, save_new_generator, save_thing_tree
+from .hierarchy_utils import ancestors, count_paths, descendants, nearest_ancestor, rebuild_thing_closure
+from .job_utils import BACKGROUND_GENERATION_THRESHOLD, JOB_DONE, JOB_FAILED, JOB_QUEUED, GenerationJob, run_generation_job, should_generate_in_background
+from .markup_utils import get_rendered_markup, render_markup, update_thing_references
+from .models import Attribute, AttributeValue, Campaign, DndBeyondRef, DndBeyondType, GeneratorObject, GeneratorObjectContains, GeneratorObjectFieldToRandomizerAttribute, RandomAttribute, RandomEncounter, RandomizerAttribute, RandomizerAttributeCategory, RandomizerAttributeCategoryOption, RandomizerAttributeOption, Thing, ThingClosure, ThingReference, ThingTerm, ThingType, Weight, WeightPreset
+from .name_utils import MAX_UNIQUE_NAME_ATTEMPTS, IndexPermutation, NameSampler, NameSpace, clear_thing_names, find_names_starting_with, find_similar_names, is_name_in_use, roll_name_in_category, roll_unique_name
+from .preview_utils import commit_preview, create_preview, get_preview
+from .randomizer_registry import clear_randomizer_registry, get_randomizer_registry
+from .randomizers import MAX_ROLLS_PER_REQUEST, get_random_attribute_in_category_raw, get_random_attribute_raw, get_randomization_options_for_new_thing
+from .reference_utils import rename_thing
+from .search_utils import search_things
+from .thing_utils import count_subtree, delete_subtree, get_details, get_list_data
+from .trigram_index import TrigramIndex
+from .weighted_sampling import NO_ACTIVE_PRESET, AliasTable, get_alias_table
+
+
+class RandomizerTestCase(TestCase):
+    def setUp(self):
+        self.campaign = Campaign.objects.create(name='Randomizers', is_active=True)
+        self.npc_type = ThingType.objects.get(name='NPC')
+        clear_randomizer_registry()
+
+    def create_randomizer_attribute(self, thing_type, name, options=(), **kwargs):
+        attribute = RandomizerAttribute.objects.create(thing_type=thing_type, name=name, **kwargs)
+        for option in options:
+            RandomizerAttributeOption.objects.create(attribute=attribute, name=option)
+        return attribute
+
+    def create_category(self, attribute, name, options=(), **kwargs):
+        category = RandomizerAttributeCategory.objects.create(attribute=attribute, name=name, **kwargs)
+        for option in options:
+            RandomizerAttributeCategoryOption.objects.create(category=category, name=option)
+        return category
+
+
+class RandomizerRegistryTests(RandomizerTestCase):
+    def test_registry_is_compiled_once_and_follows_changes(self):
+        race = self.create_randomizer_attribute(self.npc_type, 'Race', ['Human', 'Elf'])
+        name = self.create_randomizer_attribute(self.npc_type, 'Name')
+        self.create_category(name, 'Human', ['Ada', 'Bram'])
+        self.create_category(name, 'Hidden', ['Zed'], show=False)
+
+        registry = get_randomizer_registry()
+        with self.assertNumQueries(0):
+            self.assertIs(get_randomizer_registry(), registry)
+            self.assertEqual(registry.get_attribute('npc', 'RACE').options, ('Human', 'Elf'))
+            self.assertIn(get_random_attribute_in_category_raw('NPC', 'Name', 'human'), ['Ada', 'Bram'])
+        self.assertIn(get_random_attribute_raw(self.campaign, 'NPC', 'Race'), ['Human', 'Elf'])
+        self.assertEqual(get_randomization_options_for_new_thing('NPC'), {
+            'allow_random': ['race'],
+            'allow_random_by_category': ['name'],
+            'randomizer_categories': [{'field_name': 'name', 'categories': ['Human']}]
+        })
+
+        RandomizerAttributeOption.objects.create(attribute=race, name='Dwarf')
+        self.assertIsNot(get_randomizer_registry(), registry)
+        self.assertEqual(get_randomizer_registry().get_attribute('NPC', 'Race').options, ('Human', 'Elf', 'Dwarf'))
+
+    def test_unknown_attributes_and_categories_are_rejected(self):
+        name = self.create_randomizer_attribute(self.npc_type, 'Name')
+        self.create_category(name, 'Human', ['Ada'])
+        with self.assertRaisesRegex(ValueError, 'Invalid randomizer attribute: Height'):
+            get_random_attribute_raw(self.campaign, 'NPC', 'Height')
+        with self.assertRaisesRegex(ValueError, 'Invalid randomizer attribute: Name'):
+            get_random_attribute_raw(self.campaign, 'Location', 'Name')
+        with self.assertRaisesRegex(ValueError, 'Invalid randomizer attribute category for Name: Orc'):
+            get_random_attribute_in_category_raw('NPC', 'Name', 'Orc')
+
+
+class AliasTableTests(RandomizerTestCase):
+    def get_probabilities(self, alias_table):
+        probabilities = dict((value, 0.0) for value in alias_table.values)
+        for i, value in enumerate(alias_table.values):
+            probabilities[value] += alias_table.probabilities[i] / len(alias_table.values)
+            probabilities[alias_table.values[alias_table.aliases[i]]] += (1 - alias_table.probabilities[i]) / len(alias_table.values)
+        return probabilities
+
+    def test_alias_table_matches_the_weights(self):
+        alias_table = AliasTable([('Human', 6), ('Elf', 3), ('Dwarf', 1), ('Orc', 10)])
+        for value, probability in self.get_probabilities(alias_table).items():
+            with self.subTest(value=value):
+                self.assertAlmostEqual(probability, {'Human': 0.3, 'Elf': 0.15, 'Dwarf': 0.05, 'Orc': 0.5}[value])
+
+        random.seed(1)
+        counts = dict((value, 0) for value in alias_table.values)
+        for i in range(20000):
+            counts[alias_table.sample()] += 1
+        self.assertAlmostEqual(counts['Orc'] / 20000, 0.5, delta=0.02)
+        self.assertAlmostEqual(counts['Dwarf'] / 20000, 0.05, delta=0.01)
+
+    def test_presets_drop_zero_weights_and_follow_changes(self):
+        race = self.create_randomizer_attribute(self.npc_type, 'Race', ['Human', 'Elf', 'Dwarf'])
+        compiled_race = get_randomizer_registry().get_attribute('NPC', 'Race')
+        self.assertIs(get_alias_table(self.campaign, compiled_race), NO_ACTIVE_PRESET)
+
+        preset = WeightPreset.objects.create(campaign=self.campaign, name='No dwarves', attribute_name='race', is_active=True)
+        Weight.objects.create(weight_preset=preset, name_to_weight='human', weight=3)
+        Weight.objects.create(weight_preset=preset, name_to_weight='Elf', weight=1)
+        dwarf = Weight.objects.create(weight_preset=preset, name_to_weight='Dwarf', weight=0)
+        alias_table = get_alias_table(self.campaign, compiled_race)
+        self.assertEqual(alias_table.values, ('Human', 'Elf'))
+        self.assertEqual(self.get_probabilities(alias_table), {'Human': 0.75, 'Elf': 0.25})
+        with self.assertNumQueries(0):
+            self.assertIs(get_alias_table(self.campaign, compiled_race), alias_table)
+            self.assertEqual(set(get_random_attribute_raw(self.campaign, 'NPC', 'Race') for i in range(200)), {'Human', 'Elf'})
+
+        dwarf.weight = 4
+        dwarf.save()
+        self.assertEqual(get_alias_table(self.campaign, compiled_race).values, ('Human', 'Elf', 'Dwarf'))
+
+        Weight.objects.filter(weight_preset=preset).delete()
+        self.assertIsNone(get_alias_table(self.campaign, compiled_race))
+        self.assertIsNone(get_random_attribute_raw(self.campaign, 'NPC', 'Race'))
+
+        preset.is_active = False
+        preset.save()
+        self.assertIs(get_alias_table(self.campaign, compiled_race), NO_ACTIVE_PRESET)
+        self.assertIn(get_random_attribute_raw(self.campaign, 'NPC', 'Race'), ['Human', 'Elf', 'Dwarf'])
+
+
+class BatchRollTests(RandomizerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_randomizer_attribute(self.npc_type, 'Race', ['Human', 'Elf', 'Dwarf'])
+        self.create_category(self.create_randomizer_attribute(self.npc_type, 'Name'), 'Human', ['Ada', 'Bram'])
+
+    def test_batches_are_capped(self):
+        self.assertEqual(len(self.client.get('/campaign/random/NPC/Race', {'n': 5}).json()['names']), 5)
+        self.assertEqual(len(self.client.get('/campaign/random/NPC/Race', {'n': 100000}).json()['names']), MAX_ROLLS_PER_REQUEST)
+        self.assertEqual(len(self.client.get('/campaign/random/NPC/Race', {'n': -3}).json()['names']), 1)
+        for url in ('/campaign/random/NPC/Race', '/campaign/random/NPC/Name/Human', '/campaign/random/NPC'):
+            with self.subTest(url=url):
+                response = self.client.get(url, {'n': 'many', 'attribute': 'Race'})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': 'Invalid number of rolls: many'})
+        self.assertIn(self.client.get('/campaign/random/NPC/Race').json()['name'], ['Human', 'Elf', 'Dwarf'])
+
+    def test_unique_batches_stop_when_the_options_run_out(self):
+        names = self.client.get('/campaign/random/NPC/Race', {'n': 10, 'unique': 1}).json()['names']
+        self.assertEqual(sorted(names), ['Dwarf', 'Elf', 'Human'])
+        names = self.client.get('/campaign/random/NPC/Name/Human', {'n': 10, 'unique': 1}).json()['names']
+        self.assertEqual(sorted(names), ['Ada', 'Bram'])
+
+        results = self.client.get('/campaign/random/NPC', {'attribute': ['Race', 'Name.Human'], 'n': 2, 'unique': 1}).json()['results']
+        self.assertEqual(len(results['Race']), 2)
+        self.assertEqual(len(set(results['Race'])), 2)
+        self.assertEqual(sorted(results['Name.Human']), ['Ada', 'Bram'])
+
+
+class CategoryRelationsTests(RandomizerTestCase):
+    def test_relations_link_sibling_and_shared_categories(self):
+        name = self.create_randomizer_attribute(self.npc_type, 'Name')
+        human = self.create_category(name, 'Human', ['Ada', 'Bram'])
+        self.create_category(name, 'Human_2', ['son'])
+        self.create_category(name, 'Human_synonym_last', ['the Bold'])
+        elf = self.create_category(name, 'Elf', ['Ela'])
+        self.create_category(name, 'Elf_2', [])
+        mixed = self.create_category(name, 'Mixed')
+        mixed.use_values_from.add(human, elf)
+
+        registry = get_randomizer_registry()
+        human_relations = registry.relations[human.pk]
+        self.assertEqual([(s.options, s.second.name) for s in human_relations.sources], [(('Ada', 'Bram'), 'Human_2')])
+        self.assertIsNone(human_relations.synonym_first)
+        self.assertEqual(human_relations.synonym_last.options, ('the Bold',))
+        self.assertEqual(registry.relations[elf.pk].sources[0].second, None)
+        mixed_relations = registry.relations[mixed.pk]
+        self.assertEqual([s.options for s in mixed_relations.sources], [('Ada', 'Bram'), ('Ela',)])
+        self.assertIsNone(mixed_relations.synonym_last)
+
+        self.assertEqual(set(get_random_attribute_in_category_raw('NPC', 'Name', 'Human') for i in range(100)), {'Adason the Bold', 'Bramson the Bold'})
+        self.assertEqual(set(get_random_attribute_in_category_raw('NPC', 'Name', 'Mixed') for i in range(100)), {'Adason', 'Bramson', 'Ela'})
+
+        mixed.use_values_from.remove(human)
+        self.assertEqual(set(get_random_attribute_in_category_raw('NPC', 'Name', 'Mixed') for i in range(20)), {'Ela'})
+
+
+class UniqueNameTests(TestCase):
+    def setUp(self):
+        self.campaign = Campaign.objects.create(name='Unique names', is_active=True)
+        self.npc_type = ThingType.objects.get(name='NPC')
+        clear_thing_names()
+
+    def create_thing(self, name):
+        return Thing.objects.create(campaign=self.campaign, thing_type=self.npc_type, name=name)
+
+    def test_name_set_follows_created_renamed_and_deleted_things(self):
+        ada = self.create_thing('Ada')
+        self.assertTrue(is_name_in_use(self.campaign, 'Ada'))
+        with self.assertNumQueries(0):
+            self.assertFalse(is_name_in_use(self.campaign, 'Bram'))
+
+        ada.name = 'Bram'
+        ada.save()
+        self.create_thing('Cora')
+        self.assertFalse(is_name_in_use(self.campaign, 'Ada'))
+        self.assertTrue(is_name_in_use(self.campaign, 'Bram'))
+        self.assertTrue(is_name_in_use(self.campaign, 'Cora'))
+        self.assertFalse(is_name_in_use(Campaign.objects.create(name='Other'), 'Cora'))
+
+        ada.delete()
+        self.assertFalse(is_name_in_use(self.campaign, 'Bram'))
+
+    def test_unique_names_skip_names_in_use_until_they_run_out(self):
+        self.create_thing('Ada')
+        self.create_thing('Bram')
+        rolls = iter(['Ada', 'Bram', 'Ada', 'Cora'])
+        self.assertEqual(roll_unique_name(self.campaign, lambda: next(rolls), True, 'Name.Human'), 'Cora')
+        self.assertEqual(roll_unique_name(self.campaign, lambda: 'Ada', False, 'Name.Human'), 'Ada')
+
+        rolls = []
+        def roll():
+            rolls.append('Ada')
+            return 'Ada'
+        with self.assertRaisesRegex(ValueError, 'Ran out of unique names in Name.Human after {0} attempts'.format(MAX_UNIQUE_NAME_ATTEMPTS)):
+            roll_unique_name(self.campaign, roll, True, 'Name.Human')
+        self.assertEqual(len(rolls), MAX_UNIQUE_NAME_ATTEMPTS)
+
+
+class NameSamplerTests(RandomizerTestCase):
+    def setUp(self):
+        super().setUp()
+        clear_thing_names()
+        name = self.create_randomizer_attribute(self.npc_type, 'Name')
+        self.human = self.create_category(name, 'Human', ['Ada', 'Bram'])
+        self.create_category(name, 'Human_2', ['son', 'Stone'], can_combine_with_self=True)
+        self.create_category(name, 'Human_synonym_last', ['the Bold'])
+
+    def create_thing(self, name):
+        return Thing.objects.create(campaign=self.campaign, thing_type=self.npc_type, name=name)
+
+    def test_index_permutation_visits_every_index_once(self):
+        for size in (1, 2, 7, 64, 1000):
+            with self.subTest(size=size):
+                permutation = IndexPermutation(size)
+                self.assertEqual(sorted(permutation[i] for i in range(size)), list(range(size)))
+
+    def test_sampler_draws_every_name_once_then_runs_out(self):
+        relations = get_randomizer_registry().relations[self.human.pk]
+        name_space = NameSpace(relations)
+        self.assertEqual(len(name_space), 8)
+        self.assertEqual(set(name_space[i] for i in range(8)), {'Adason the Bold', 'Ada Stone the Bold', 'Bramson the Bold', 'Bram Stone the Bold',
+                                                                   'son and Stone the Bold', 'son and son the Bold', 'Stone and son the Bold',
+                                                                   'Stone and Stone the Bold'})
+
+        sampler = NameSampler(relations)
+        names = [sampler.next_name(lambda name: name == 'Adason the Bold') for i in range(7)]
+        self.assertEqual(set(names), set(name_space[i] for i in range(8)) - {'Adason the Bold'})
+        self.assertIsNone(sampler.next_name(lambda name: name in names or name == 'Adason the Bold'))
+
+    def test_unique_names_are_sampled_from_names_not_in_use(self):
+        for name in ['Adason the Bold', 'Bramson the Bold', 'Bram Stone the Bold']:
+            self.create_thing(name)
+        names = []
+        for i in range(5):
+            names.append(roll_name_in_category(self.campaign, 'NPC', 'Name', 'Human', True))
+            self.create_thing(names[-1])
+        self.assertEqual(len(set(names)), 5)
+        self.assertNotIn('Adason the Bold', names)
+        with self.assertRaisesRegex(ValueError, 'Ran out of unique names in Name.Human: all 8 combinations are in use'):
+            roll_name_in_category(self.campaign, 'NPC', 'Name', 'Human', True)
+        self.assertIn(roll_name_in_category(self.campaign, 'NPC', 'Name', 'Human', False), names + ['Adason the Bold', 'Bramson the Bold', 'Bram Stone the Bold'])
+
+
+class GeneratorTestCase(RandomizerTestCase):
+    def setUp(self):
+        super().setUp()
+        clear_generator_plans()
+        clear_thing_names()
+        self.location_type = ThingType.objects.get(name='Location')
+        for thing_type in (self.location_type, self.npc_type):
+            Attribute.objects.get_or_create(thing_type=thing_type, name='Name Randomizer')
+        self.npc_race = self.create_randomizer_attribute(self.npc_type, 'Race', ['Human', 'Elf'])
+        npc_name = self.create_randomizer_attribute(self.npc_type, 'Name')
+        self.human_name = self.create_category(npc_name, 'Human', [a + b for a in 'ABCDEFGHJK' for b in ('da', 'ra', 'lo', 'mi')])
+        self.create_category(npc_name, 'Human_2', ['son', 'wick', 'ford', 'more', 'ton'])
+        self.elf_name = self.create_category(npc_name, 'Elf', ['Ela', 'Ilo', 'Yra'])
+        self.town_name = self.create_category(self.create_randomizer_attribute(self.location_type, 'Name'), 'Town', ['Ash', 'Oak', 'Elm', 'Yew'])
+        self.create_category(self.town_name.attribute, 'Town_2', ['ford', 'field', 'bridge', 'moor', 'vale'])
+
+        self.townsfolk = self.create_generator('Townsfolk', self.npc_type, [('name', self.human_name), (None, self.npc_race)])
+        self.town = self.create_generator('Town', self.location_type, [('name', self.town_name)])
+        self.add_container(self.town, self.townsfolk, 4, 4)
+
+    def create_generator(self, name, thing_type, mappings=(), **kwargs):
+        generator_object = GeneratorObject.objects.create(name=name, thing_type=thing_type, **kwargs)
+        for field_name, randomizer in mappings:
+            if isinstance(randomizer, RandomizerAttributeCategory):
+                GeneratorObjectFieldToRandomizerAttribute.objects.create(generator_object=generator_object, field_name=field_name,
+                                                                         randomizer_attribute_category=randomizer)
+            else:
+                GeneratorObjectFieldToRandomizerAttribute.objects.create(generator_object=generator_object, field_name=field_name,
+                                                                         randomizer_attribute=randomizer)
+        return generator_object
+
+    def add_container(self, generator_object, contained_object, min_objects, max_objects, percent_chance_for_one=0):
+        return GeneratorObjectContains.objects.create(generator_object=generator_object, contained_object=contained_object, min_objects=min_objects,
+                                                      max_objects=max_objects, percent_chance_for_one=percent_chance_for_one)
+
+
+class GeneratorPlanTests(GeneratorTestCase):
+    def get_mappings(self, plan):
+        return [(m.field_name, (m.randomizer_attribute or m.randomizer_attribute_category).name, m.target_attribute.name if m.target_attribute else None)
+                for m in plan.field_mappings]
+
+    def test_child_mappings_override_inherited_ones(self):
+        self.townsfolk.attribute_for_container = 'Leader'
+        self.townsfolk.save()
+        elves = self.create_generator('Elves', self.npc_type, [('name', self.elf_name)], inherit_settings_from=self.townsfolk)
+        elf_heroes = self.create_generator('Elf heroes', self.npc_type, [('description', self.npc_race)], inherit_settings_from=elves)
+
+        plan = get_generator_plan(elves.pk)
+        self.assertEqual(self.get_mappings(plan), [('name', 'Elf', None), (None, 'Race', 'Race')])
+        self.assertEqual(plan.attribute_for_container, 'Leader')
+        self.assertEqual(plan.name_randomizer_attribute.name, 'Name Randomizer')
+        self.assertEqual(self.get_mappings(get_generator_plan(elf_heroes.pk)), [('description', 'Race', None), ('name', 'Elf', None)])
+
+    def test_plans_are_cached_until_a_generator_changes(self):
+        plan = get_generator_plan(self.town.pk)
+        self.assertEqual([(c.contained_object_id, c.min_objects, c.max_objects) for c in plan.containers], [(self.townsfolk.pk, 4, 4)])
+        with self.assertNumQueries(0):
+            self.assertIs(get_generator_plan(self.town.pk), plan)
+
+        self.add_container(self.town, self.townsfolk, 0, 0, percent_chance_for_one=50)
+        self.assertEqual([c.percent_chance_for_one for c in get_generator_plan(self.town.pk).containers], [0, 50])
+        self.town.name = 'Village'
+        self.town.save()
+        self.assertEqual(get_generator_plan(self.town.pk).name, 'Village')
+        GeneratorObjectFieldToRandomizerAttribute.objects.filter(generator_object=self.townsfolk, randomizer_attribute=self.npc_race).delete()
+        self.assertEqual(self.get_mappings(get_generator_plan(self.townsfolk.pk)), [('name', 'Human', None)])
+
+
+class SaveThingTreeTests(GeneratorTestCase):
+    def count_save_queries(self, townsfolk_count):
+        GeneratorObjectContains.objects.filter(generator_object=self.town).update(min_objects=townsfolk_count, max_objects=townsfolk_count)
+        clear_generator_plans()
+        tree = build_thing_tree(get_generator_plan(self.town.pk), self.campaign)
+        with CaptureQueriesContext(connection) as queries:
+            things = save_thing_tree(tree, self.campaign)
+        self.assertEqual(len(things), townsfolk_count + 1)
+        return len(queries)
+
+    def test_saved_things_get_their_database_ids(self):
+        tree = build_thing_tree(get_generator_plan(self.town.pk), self.campaign)
+        self.assertFalse(Thing.objects.filter(campaign=self.campaign).exists())
+        things = save_thing_tree(tree, self.campaign)
+
+        self.assertEqual(dict((thing.name, thing.pk) for thing in things), dict(Thing.objects.filter(campaign=self.campaign).values_list('name', 'pk')))
+        self.assertEqual(sorted(tree.thing.children.values_list('name', flat=True)), sorted(node.thing.name for node in tree.children))
+        for node in tree.children:
+            self.assertEqual(dict(AttributeValue.objects.filter(thing=node.thing).values_list('attribute__name', 'value')),
+                             {'Race': node.get_attribute_value('Race'), 'Name Randomizer': node.get_attribute_value('Race')})
+        self.assertTrue(all(is_name_in_use(self.campaign, thing.name) for thing in things))
+
+    def test_generated_things_are_linked_to_their_parent(self):
+        kingdom = Thing.objects.create(campaign=self.campaign, thing_type=self.location_type, name='Kingdom')
+        tree = build_thing_tree(get_generator_plan(self.town.pk), self.campaign, kingdom)
+        save_thing_tree(tree, self.campaign, kingdom)
+        self.assertEqual(list(kingdom.children.values_list('name', flat=True)), [tree.thing.name])
+
+    def test_query_count_does_not_grow_with_the_tree(self):
+        query_count = self.count_save_queries(4)
+        self.assertLessEqual(query_count, 12)
+        self.assertEqual(self.count_save_queries(40), query_count)
+
+    def test_generated_names_are_unique(self):
+        GeneratorObjectContains.objects.filter(generator_object=self.town).update(min_objects=150, max_objects=150)
+        clear_generator_plans()
+        town = generate_thing(self.town, self.campaign)
+        names = list(Thing.objects.filter(campaign=self.campaign).values_list('name', flat=True))
+        self.assertEqual(len(names), 151)
+        self.assertEqual(len(set(names)), 151)
+        self.assertEqual(town.children.count(), 150)
+
+
+class PreviewTests(GeneratorTestCase):
+    def get_saved_names(self):
+        return sorted(Thing.objects.filter(campaign=self.campaign).values_list('name', flat=True))
+
+    def test_previews_are_only_saved_when_kept(self):
+        kingdom = Thing.objects.create(campaign=self.campaign, thing_type=self.location_type, name='Kingdom')
+        preview = create_preview(self.town, self.campaign, kingdom)
+        names = sorted(node.thing.name for node in preview.tree.walk())
+        self.assertEqual(len(names), 5)
+        self.assertEqual(self.get_saved_names(), ['Kingdom'])
+
+        url = '/campaign/generate_preview/{0}'.format(preview.token)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, preview.tree.thing.name)
+        self.assertEqual(self.client.post(url, {'discard': '1'})['Location'], '/campaign/thing/Kingdom')
+        self.assertIsNone(get_preview(preview.token))
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.get_saved_names(), ['Kingdom'])
+
+        preview = create_preview(self.town, self.campaign, kingdom)
+        url = '/campaign/generate_preview/{0}'.format(preview.token)
+        self.assertEqual(self.client.post(url)['Location'], '/campaign/thing/{0}'.format(preview.tree.thing.name.replace(' ', '%20')))
+        self.assertIsNone(get_preview(preview.token))
+        self.assertEqual(self.get_saved_names(), sorted(['Kingdom'] + [node.thing.name for node in preview.tree.walk()]))
+        self.assertEqual(list(kingdom.children.values_list('name', flat=True)), [preview.tree.thing.name])
+
+    def test_previews_with_taken_names_are_kept_for_another_try(self):
+        preview = create_preview(self.town, self.campaign)
+        townsperson = preview.tree.children[0].thing.name
+        Thing.objects.create(campaign=self.campaign, thing_type=self.npc_type, name=townsperson)
+        with self.assertRaisesRegex(ValueError, 'Cannot keep {0}: {1} already exists'.format(preview.tree.thing.name, townsperson)):
+            commit_preview(preview.token)
+        self.assertIs(get_preview(preview.token), preview)
+        self.assertEqual(self.get_saved_names(), [townsperson])
+
+        response = self.client.post('/campaign/generate_preview/{0}'.format(preview.token))
+        self.assertContains(response, 'already exists')
+
+
+class GenerateViewTests(GeneratorTestCase):
+    def test_generator_errors_are_shown_on_an_error_page(self):
+        mood = self.create_randomizer_attribute(self.npc_type, 'Mood', ['Calm', 'Cross'])
+        self.create_generator('Moody', self.npc_type, [('name', self.human_name), (None, mood)])
+        kingdom = Thing.objects.create(campaign=self.campaign, thing_type=self.location_type, name='Kingdom')
+        for url in ('/campaign/generate/Moody', '/campaign/generate/Moody?preview=1', '/campaign/generate_in_location/Kingdom/Moody'):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertContains(response, 'Could not generate Moody')
+                self.assertContains(response, 'Moody needs a Mood attribute on NPC')
+        self.assertEqual(list(Thing.objects.filter(campaign=self.campaign)), [kingdom])
+
+    def test_exhausted_name_spaces_are_shown_on_an_error_page(self):
+        self.elf_name.must_be_unique = True
+        self.elf_name.save()
+        self.create_generator('Elves', self.npc_type, [('name', self.elf_name), (None, self.npc_race)])
+        name_space = NameSpace(get_randomizer_registry().relations[self.elf_name.pk])
+        for i in range(len(name_space)):
+            Thing.objects.create(campaign=self.campaign, thing_type=self.npc_type, name=name_space[i])
+        response = self.client.get('/campaign/generate/Elves')
+        self.assertContains(response, 'Could not generate Elves')
+        self.assertContains(response, 'Ran out of unique names in Name.Elf: all {0} combinations are in use'.format(len(name_space)))
+        self.assertEqual(Thing.objects.filter(campaign=self.campaign).count(), len(name_space))
+
+
+class GenerationJobTests(GeneratorTestCase):
+    def test_job_reports_progress_until_done(self):
+        kingdom = Thing.objects.create(campaign=self.campaign, thing_type=self.location_type, name='Kingdom')
+        job = GenerationJob(self.town, self.campaign, kingdom)
+        self.assertEqual(job.to_json(), {
+            'id': job.id,
+            'generator': 'Town',
+            'status': JOB_QUEUED,
+            'things_created': 0,
+            'expected_things': 5,
+            'eta_seconds': None,
+            'percent': 0,
+            'thing': None,
+            'parent': 'Kingdom',
+            'error': None
+        })
+
+        run_generation_job(job)
+        data = job.to_json()
+        self.assertEqual((data['status'], data['things_created'], data['eta_seconds'], data['percent'], data['error']), (JOB_DONE, 5, 0, 100, None))
+        self.assertEqual(list(kingdom.children.values_list('name', flat=True)), [job.thing_name])
+        self.assertEqual(Thing.objects.filter(campaign=self.campaign).count(), 6)
+        self.assertEqual(self.client.get('/campaign/generation_job/{0}/progress'.format(job.id)).status_code, 404)
+
+    def test_failed_jobs_report_the_error(self):
+        nameless = self.create_generator('Nameless', self.npc_type, [('name', self.human_name)])
+        job = GenerationJob(nameless, self.campaign)
+        run_generation_job(job)
+        self.assertEqual(job.status, JOB_FAILED)
+        self.assertRegex(job.error, 'has no Race')
+        self.assertEqual(job.get_eta(), 0)
+        self.assertFalse(Thing.objects.filter(campaign=self.campaign).exists())
+
+    def test_only_large_generators_run_in_the_background(self):
+        self.assertFalse(should_generate_in_background(self.town))
+        GeneratorObjectContains.objects.filter(generator_object=self.town).update(max_objects=BACKGROUND_GENERATION_THRESHOLD * 4)
+        clear_generator_plans()
+        self.assertTrue(should_generate_in_background(self.town))
+
+
+class GeneratorTemplateTests(GeneratorTestCase):
+    def setUp(self):
+        super().setUp()
+        Attribute.objects.get_or_create(thing_type=self.location_type, name='Ruler')
+        self.hold_name = self.create_category(self.town_name.attribute, 'Hold', ["${ruler}'s Hold", 'Hold of ${parent.name}', '${parent.banner} Hold'])
+
+    def get_form_data(self, name, mappings, contains=''):
+        return {'name': name, 'inherit_settings_from': None, 'attribute_for_container': None, 'contains': contains, 'mappings': mappings}
+
+    def test_unknown_variables_are_reported(self):
+        hold = self.create_generator('Hold', self.location_type, [('name', self.hold_name)])
+        self.assertEqual(get_template_problems(hold), ['${ruler} is not known to Hold (used in "${ruler}\'s Hold")',
+                                                       '${parent.banner} is not known to Hold (used in "${parent.banner} Hold")'])
+
+        self.townsfolk.attribute_for_container = 'Ruler'
+        self.townsfolk.save()
+        self.add_container(hold, self.townsfolk, 1, 1)
+        self.assertEqual(get_template_problems(hold), ['${parent.banner} is not known to Hold (used in "${parent.banner} Hold")'])
+
+        RandomizerAttributeCategoryOption.objects.filter(category=self.hold_name).exclude(name="${ruler}'s Hold").delete()
+        self.assertEqual(get_template_problems(hold), [])
+        hold_thing = generate_thing(hold, self.campaign)
+        ruler = hold_thing.children.get()
+        self.assertEqual(hold_thing.name, "{0}'s Hold".format(ruler.name))
+        self.assertEqual(AttributeValue.objects.get(thing=hold_thing, attribute__name='Ruler').value, ruler.name)
+
+    def test_generators_with_problems_are_not_saved(self):
+        with self.assertRaisesRegex(ValueError, r'Unresolved variables: \$\{ruler\} is not known to Keep .*; \$\{parent.banner\} is not known to Keep'):
+            save_new_generator(self.location_type, self.get_form_data('Keep', 'name: Name.Hold'))
+        self.assertFalse(GeneratorObject.objects.filter(name='Keep').exists())
+
+        response = self.client.post('/campaign/new_generator/Location', {'name': 'Keep', 'mappings': 'name: Name.Hold'})
+        self.assertContains(response, 'Unresolved variables')
+        self.assertFalse(GeneratorObject.objects.filter(name='Keep').exists())
+
+    def test_missing_plan_attributes_are_reported(self):
+        with self.assertRaisesRegex(ValueError, 'Town needs a Name attribute on Location'):
+            edit_generator(self.town, self.get_form_data('Town', 'Name.Town', 'NPC.Townsfolk'))
+        self.town.refresh_from_db()
+        self.assertEqual(self.town.name, 'Town')
+        self.assertEqual(list(GeneratorObjectFieldToRandomizerAttribute.objects.filter(generator_object=self.town).values_list('field_name', flat=True)), ['name'])
+        self.assertEqual(get_generator_plan(self.town.pk).containers[0].min_objects, 4)
+
+
+class EstimateGeneratorTests(GeneratorTestCase):
+    def setUp(self):
+        super().setUp()
+        clear_save_timings()
+
+    def test_seeded_estimates_are_repeatable(self):
+        GeneratorObjectContains.objects.filter(generator_object=self.town).update(min_objects=2, max_objects=6)
+        guard = self.create_generator('Guard', self.npc_type, [('name', self.human_name), (None, self.npc_race)])
+        self.add_container(self.townsfolk, guard, 0, 0, percent_chance_for_one=50)
+
+        estimate = estimate_generator(self.town, samples=4000, seed=7)
+        self.assertEqual(estimate_generator(self.town, samples=4000, seed=7), estimate)
+        self.assertEqual((estimate.generator_name, estimate.samples, estimate.truncated), ('Town', 4000, False))
+        location, npc = estimate.counts
+        self.assertEqual((location.thing_type, location.expected, location.p95, location.max), ('Location', 1, 1, 1))
+        self.assertEqual(npc.thing_type, 'NPC')
+        self.assertAlmostEqual(npc.expected, 6, delta=0.1)
+        self.assertLessEqual(npc.max, 12)
+        self.assertAlmostEqual(estimate.total.expected, 7, delta=0.1)
+        self.assertEqual(estimate.total.max, npc.max + 1)
+        self.assertGreater(estimate.expected_queries, 0)
+        self.assertAlmostEqual(estimate.expected_seconds, estimate.total.expected * ESTIMATED_SECONDS_PER_THING)
+        self.assertFalse(estimate.measured)
+
+    def test_save_time_follows_measured_jobs(self):
+        record_save_time(100, 1.5)
+        record_save_time(300, 2.5)
+        estimate = estimate_generator(self.town, samples=10, seed=1)
+        self.assertTrue(estimate.measured)
+        self.assertAlmostEqual(estimate.expected_seconds, 5 * 0.01)
+
+    def test_edit_page_estimates_on_request(self):
+        response = self.client.get('/campaign/edit_generator/Town')
+        self.assertNotContains(response, 'Expected output')
+        self.assertContains(response, '/campaign/edit_generator/Town?estimate=1')
+        response = self.client.get('/campaign/edit_generator/Town?estimate=1')
+        self.assertContains(response, 'Expected output')
+        self.assertContains(response, 'As a rough guide')
+
+    def test_cycles_are_truncated(self):
+        self.add_container(self.townsfolk, self.townsfolk, 1, 1)
+        estimate = estimate_generator(self.townsfolk, samples=10, seed=1)
+        self.assertTrue(estimate.truncated)
+        self.assertEqual(estimate.total.max, 20)
+
+
+class ThingTreeTestCase(TestCase):
+    def setUp(self):
+        self.campaign = Campaign.objects.create(name='Query counts', is_active=True)
+        self.location_type = ThingType.objects.get(name='Location')
+        self.npc_type = ThingType.objects.get(name='NPC')
+        self.faction_type = ThingType.objects.get(name='Faction')
+        self.race = Attribute.objects.get(thing_type=self.npc_type, name='Race')
+        self.race.display_in_summary = True
+        self.race.save()
+
+    def create_things(self, thing_type, names):
+        Thing.objects.bulk_create([Thing(campaign=self.campaign, thing_type=thing_type, name=name, description='About ' + name) for name in names])
+        return list(Thing.objects.filter(campaign=self.campaign, name__in=names).order_by('name'))
+
+    def add_children(self, parent, children):
+        Thing.children.through.objects.bulk_create([Thing.children.through(from_thing_id=parent.pk, to_thing_id=child.pk) for child in children])
+
+    def create_city(self, child_count):
+        city, kingdom = self.create_things(self.location_type, ['City', 'Kingdom'])
+        guild = self.create_things(self.faction_type, ['Guild'])[0]
+        self.add_children(kingdom, [city])
+        self.add_children(guild, [city])
+
+        npcs = self.create_things(self.npc_type, ['NPC {0:04d}'.format(i) for i in range(child_count)])
+        self.add_children(city, npcs)
+        AttributeValue.objects.bulk_create([AttributeValue(thing=npc, attribute=self.race, value='Elf') for npc in npcs])
+        for npc in npcs[:5]:
+            self.add_children(npc, self.create_things(self.npc_type, ['{0} retainer'.format(npc.name)]))
+        rebuild_thing_closure()
+        return city
+
+
+class GetDetailsQueryCountTests(ThingTreeTestCase):
+    def count_detail_queries(self, child_count):
+        city = self.create_city(child_count)
+        with CaptureQueriesContext(connection) as queries:
+            details = get_details(campaign=self.campaign, thing=city)
+        self.assertEqual(len(details['child_npcs']), child_count)
+        self.assertEqual(details['parent_locations'][0]['name'], 'Kingdom')
+        self.assertEqual(details['parent_factions'][0]['name'], 'Guild')
+        self.assertEqual(details['child_npcs'][0]['attributes'][0]['value'], 'Elf')
+        self.assertEqual(details['child_npcs'][0]['attributes'][-1]['value'], 'City')
+        self.assertEqual(details['child_npcs'][0]['child_npcs'][0]['name'], 'NPC 0000 retainer')
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_children(self):
+        query_count = self.count_detail_queries(10)
+        self.assertLessEqual(query_count, 20)
+        for child_count in (100, 1000):
+            with self.subTest(child_count=child_count):
+                Thing.objects.filter(campaign=self.campaign).delete()
+                self.assertEqual(self.count_detail_queries(child_count), query_count)
+
+    def test_parent_summaries_use_the_marked_up_description(self):
+        city = self.create_city(1)
+        Thing.objects.filter(name='Guild').update(markup_description='Based in @City@')
+        details = get_details(campaign=self.campaign, thing=city)
+        self.assertEqual(details['parent_factions'][0]['description'], 'Based in @City@')
+        self.assertEqual(details['parent_locations'][0]['description'], 'About Kingdom')
+
+
+class GetListDataQueryCountTests(ThingTreeTestCase):
+    def count_list_queries(self, child_count):
+        self.create_city(child_count)
+        with CaptureQueriesContext(connection) as queries:
+            list_data = get_list_data(campaign=self.campaign, thing_type=None)
+        things = dict((thing_type['name'], thing_type['things']) for thing_type in list_data)
+        self.assertEqual(len(things['NPCs']), child_count + 5)
+        self.assertEqual([t['name'] for t in things['Locations']], ['City', 'Kingdom'])
+        self.assertEqual(len(things['Locations'][0]['child_npcs']), child_count)
+        self.assertEqual(things['NPCs'][0]['attributes'][-1]['value'], 'City')
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_campaign(self):
+        query_count = self.count_list_queries(10)
+        self.assertLessEqual(query_count, 10)
+        for child_count in (100, 1000):
+            with self.subTest(child_count=child_count):
+                Thing.objects.filter(campaign=self.campaign).delete()
+                self.assertEqual(self.count_list_queries(child_count), query_count)
+
+
+class ExportQueryCountTests(ThingTreeTestCase):
+    def count_export_queries(self, child_count):
+        self.create_city(child_count)
+        with CaptureQueriesContext(connection) as queries:
+            data = json.loads(''.join(iter_campaign_json(self.campaign)))
+        things = dict((thing['name'], thing) for thing in data['things'])
+        self.assertEqual(len(things), child_count + 8)
+        self.assertEqual(len(things['City']['children']), child_count)
+        self.assertEqual(things['Kingdom']['children'], ['City'])
+        self.assertEqual(things['NPC 0000']['attribute_values'], [{'attribute': 'Race', 'value': 'Elf'}])
+        self.assertEqual(things['NPC 0000']['children'], ['NPC 0000 retainer'])
+        return len(queries)
+
+    def test_query_count_grows_with_chunks_only(self):
+        query_count = self.count_export_queries(10)
+        Thing.objects.filter(campaign=self.campaign).delete()
+        self.assertEqual(self.count_export_queries(EXPORT_CHUNK_SIZE - 10), query_count)
+        Thing.objects.filter(campaign=self.campaign).delete()
+        self.assertEqual(self.count_export_queries(EXPORT_CHUNK_SIZE * 5 - 10), query_count + 4 * 5)
+
+
+class ThingClosureTests(ThingTreeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.city, self.kingdom, self.town = self.create_things(self.location_type, ['City', 'Kingdom', 'Town'])
+        self.guild = self.create_things(self.faction_type, ['Guild'])[0]
+        self.alice, self.bob = self.create_things(self.npc_type, ['Alice', 'Bob'])
+        self.kingdom.children.add(self.city, self.town)
+        self.city.children.add(self.guild, self.alice)
+        self.guild.children.add(self.alice, self.bob)
+
+    def assertClosureMatchesEdges(self):
+        rows = dict(((r.ancestor_id, r.descendant_id, r.depth), r.paths) for r in ThingClosure.objects.all())
+        self.assertEqual(rows, count_paths(Thing.children.through.objects.values_list('from_thing_id', 'to_thing_id')))
+
+    def test_ancestors_and_descendants(self):
+        self.assertEqual([t.name for t in ancestors(self.alice)], ['City', 'Guild', 'Kingdom'])
+        self.assertEqual([t.name for t in descendants(self.kingdom)], ['Alice', 'Bob', 'City', 'Guild', 'Town'])
+        self.assertEqual([t.name for t in descendants(self.kingdom, thing_type='NPC')], ['Alice', 'Bob'])
+        self.assertEqual(nearest_ancestor(self.bob, 'Location'), self.city)
+        self.assertIsNone(nearest_ancestor(self.bob, 'Location', max_depth=1))
+        self.assertClosureMatchesEdges()
+
+    def test_closure_follows_removes_and_clears(self):
+        self.city.children.remove(self.alice)
+        self.assertEqual([t.name for t in ancestors(self.alice)], ['City', 'Guild', 'Kingdom'])
+        self.guild.children.remove(self.alice)
+        self.assertEqual(list(ancestors(self.alice)), [])
+        self.guild.thing_set.add(self.town)
+        self.assertEqual(nearest_ancestor(self.bob, 'Location'), self.city)
+        self.city.children.clear()
+        self.assertEqual(nearest_ancestor(self.bob, 'Location'), self.town)
+        self.assertClosureMatchesEdges()
+
+    def test_deleting_a_thing_detaches_its_descendants(self):
+        self.city.delete()
+        self.assertEqual([t.name for t in ancestors(self.bob)], ['Guild'])
+        self.assertClosureMatchesEdges()
+
+    def test_delete_subtree_removes_every_descendant(self):
+        attribute_value = AttributeValue.objects.create(thing=self.bob, attribute=self.race, value='Elf')
+        RandomAttribute.objects.create(thing=self.bob, text='Tall')
+        ThingReference.objects.create(thing=self.town, attribute_value=attribute_value)
+        self.assertEqual(count_subtree(self.city), {'Faction': 1, 'Location': 1, 'NPC': 2})
+        with self.assertNumQueries(13):
+            self.assertEqual(delete_subtree(self.city), 4)
+        self.assertEqual(sorted(Thing.objects.filter(campaign=self.campaign).values_list('name', flat=True)), ['Kingdom', 'Town'])
+        self.assertFalse(AttributeValue.objects.filter(thing_id=self.bob.pk).exists())
+        self.assertFalse(RandomAttribute.objects.filter(thing_id=self.bob.pk).exists())
+        self.assertFalse(ThingReference.objects.filter(thing=self.town).exists())
+        self.assertEqual([t.name for t in descendants(self.kingdom)], ['Town'])
+        self.assertClosureMatchesEdges()
+
+    def test_delete_subtree_keeps_things_shared_with_another_parent(self):
+        self.town.children.add(self.bob)
+        self.assertEqual(count_subtree(self.city), {'Faction': 1, 'Location': 1, 'NPC': 1})
+        self.assertContains(self.client.get('/campaign/delete/City'), 'so they are kept: Bob.')
+        self.assertEqual(delete_subtree(self.city), 3)
+        self.assertEqual(sorted(Thing.objects.filter(campaign=self.campaign).values_list('name', flat=True)), ['Bob', 'Kingdom', 'Town'])
+        self.assertEqual([t.name for t in ancestors(self.bob)], ['Kingdom', 'Town'])
+        self.assertClosureMatchesEdges()
+
+    def test_cycles_are_rejected(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            self.alice.children.add(self.kingdom)
+        with self.assertRaises(ValueError), transaction.atomic():
+            self.city.thing_set.add(self.guild)
+        self.assertFalse(self.alice.children.exists())
+        self.assertClosureMatchesEdges()
+
+
+class ThingReferenceTests(ThingTreeTestCase):
+    def test_automaton_finds_leftmost_longest_matches(self):
+        automaton = Automaton([('Al', 1), ('Alice', 2), ('ice', 3), ('Bob', 4)])
+        matches = automaton.find_longest('Alice and Al met Bobice')
+        self.assertEqual([(start, end, sorted(values)) for start, end, values in matches],
+                         [(0, 5, [2]), (10, 12, [1]), (17, 20, [4]), (20, 23, [3])])
+
+    def test_references_follow_thing_and_ref_changes(self):
+        monster = DndBeyondType.objects.create(name='Beast', base_url='https://example.com/', markup_symbol='%')
+        DndBeyondRef.objects.create(dndbeyond_type=monster, name='Owlbear')
+        al, alice = self.create_things(self.npc_type, ['Al', 'Alice'])
+        self.assertEqual(update_thing_references('@Alice saw Al and an Owlbear%', self.campaign), '@Alice@ saw @Al@ and an %Owlbear%')
+
+        alice.name = 'Alicia'
+        alice.save()
+        al.delete()
+        Thing.objects.create(campaign=self.campaign, thing_type=self.npc_type, name='Owl')
+        self.assertEqual(update_thing_references('Alice saw Alicia, Al and an Owlbear', self.campaign),
+                         'Alice saw @Alicia@, Al and an %Owlbear%')
+
+
+class MentionIndexTests(TransactionTestCase):
+    def setUp(self):
+        self.campaign = Campaign.objects.create(name='Mentions', is_active=True)
+        self.npc_type = ThingType.objects.get_or_create(name='NPC')[0]
+        self.location_type = ThingType.objects.get_or_create(name='Location')[0]
+
+    def create_thing(self, thing_type, name, description):
+        return Thing.objects.create(campaign=self.campaign, thing_type=thing_type, name=name, description=description,
+                                    markup_description=update_thing_references(description, self.campaign))
+
+    def get_markup(self, thing):
+        return Thing.objects.get(pk=thing.pk).markup_description
+
+    def test_markup_follows_created_renamed_and_deleted_things(self):
+        town = self.create_thing(self.location_type, 'Town', 'Bob Stone runs the inn.')
+        farm = self.create_thing(self.location_type, 'Farm', 'Nobody lives here.')
+        bob = self.create_thing(self.npc_type, 'Bob Stone', 'Innkeeper.')
+        self.assertEqual(self.get_markup(town), '@Bob Stone@ runs the inn.')
+        self.assertEqual(self.get_markup(farm), 'Nobody lives here.')
+
+        farm.description = 'Bob Stone grew up here.'
+        farm.save()
+        self.assertEqual(set(ThingTerm.objects.filter(thing=farm).values_list('term', flat=True)), {'bob', 'stone', 'grew', 'up', 'here'})
+
+        bob.name = 'Bob'
+        bob.save()
+        self.assertEqual(self.get_markup(town), '@Bob@ Stone runs the inn.')
+        self.assertEqual(self.get_markup(farm), '@Bob@ Stone grew up here.')
+
+        bob.delete()
+        self.assertEqual(self.get_markup(town), 'Bob Stone runs the inn.')
+
+
+class SearchTests(TransactionTestCase):
+    def setUp(self):
+        self.campaign = Campaign.objects.create(name='Search', is_active=True)
+        self.npc_type = ThingType.objects.get_or_create(name='NPC')[0]
+        clear_thing_names()
+
+    def create_thing(self, name, description):
+        return Thing.objects.create(campaign=self.campaign, thing_type=self.npc_type, name=name, description=description)
+
+    def get_names(self, text):
+        return [result.name for result in search_things(self.campaign, text)]
+
+    def test_search_ranks_names_first_and_follows_changes(self):
+        smith = self.create_thing('Ada Smith', 'Works the forge.')
+        self.create_thing('Bram', 'Buys horseshoes from the smith.')
+        RandomAttribute.objects.create(thing=smith, text='Collects teacups')
+
+        self.assertEqual(self.get_names('smith'), ['Ada Smith', 'Bram'])
+        self.assertEqual(self.get_names('teacup'), ['Ada Smith'])
+        self.assertEqual(search_things(self.campaign, 'forge')[0].snippet, 'Works the <mark>forge</mark>.')
+        self.assertEqual(self.get_names('"AND ('), [])
+
+        smith.name = 'Ada Cooper'
+        smith.save()
+        self.assertEqual(self.get_names('smith'), ['Bram'])
+        self.assertEqual(self.get_names('cooper'), ['Ada Cooper'])
+
+        response = self.client.post('/campaign/search', {'search_text': 'cooper'})
+        self.assertEqual(response['Location'], '/campaign/thing/Ada%20Cooper')
+
+        smith.delete()
+        self.assertEqual(self.get_names('cooper'), [])
+        self.assertEqual(self.client.post('/campaign/search', {'search_text': 'cooper'}).status_code, 404)
+
+    def test_trigram_index_ranks_similar_names(self):
+        index = TrigramIndex(['Neverwinter', 'Neverland', 'Waterdeep'])
+        self.assertEqual([name for name, similarity in index.search('Neverwnter', min_similarity=0.3)], ['Neverwinter', 'Neverland'])
+        index.remove('Neverwinter')
+        self.assertEqual([name for name, similarity in index.search('Neverwnter')], ['Neverland', 'Waterdeep'])
+
+    def test_misspelled_names_redirect_to_similar_things(self):
+        self.create_thing('Neverwinter', 'A city.')
+        self.create_thing('Waterdeep', 'Another city.')
+        self.assertEqual(self.client.get('/campaign/thing/Neverwnter')['Location'], '/campaign/thing/Neverwinter')
+
+        city = Thing.objects.get(name='Waterdeep')
+        city.name = 'Baldurs Gate'
+        city.save()
+        self.assertEqual([name for name, similarity in find_similar_names(self.campaign, 'Baldur Gate')], ['Baldurs Gate'])
+        self.assertEqual(find_similar_names(self.campaign, 'Waterdeep'), [])
+        self.assertEqual(self.client.get('/campaign/thing/Qqqq').status_code, 404)
+
+    def test_typeahead_matches_word_prefixes_by_thing_type(self):
+        location_type = ThingType.objects.get_or_create(name='Location')[0]
+        Thing.objects.create(campaign=self.campaign, thing_type=location_type, name='The Golden Goose')
+        Thing.objects.bulk_create([Thing(campaign=self.campaign, thing_type=self.npc_type, name='Goose {0:02d}'.format(i)) for i in range(30)])
+        self.assertEqual(find_names_starting_with(self.campaign, 'gol'), ['The Golden Goose'])
+        self.assertEqual(len(find_names_starting_with(self.campaign, 'goose')), 20)
+
+        response = self.client.get('/campaign/typeahead', {'q': 'goose', 'type': 'Location'})
+        self.assertEqual([result['name'] for result in response.json()['results']], ['The Golden Goose'])
+
+        inn = Thing.objects.get(name='The Golden Goose')
+        inn.name = 'The Silver Swan'
+        inn.thing_type = self.npc_type
+        inn.save()
+        self.assertEqual(find_names_starting_with(self.campaign, 'gol'), [])
+        self.assertEqual(find_names_starting_with(self.campaign, 'silver', [location_type.pk]), [])
+        self.assertEqual(find_names_starting_with(self.campaign, 'silver', [self.npc_type.pk]), ['The Silver Swan'])
+
+
+class RenameTests(TransactionTestCase):
+    def setUp(self):
+        self.campaign = Campaign.objects.create(name='Renames', is_active=True)
+        self.location_type = ThingType.objects.get_or_create(name='Location')[0]
+        self.npc_type = ThingType.objects.get_or_create(name='NPC')[0]
+
+    def create_thing(self, thing_type, name):
+        return Thing.objects.create(campaign=self.campaign, thing_type=thing_type, name=name, description='About ' + name)
+
+    def get_names(self):
+        return sorted(Thing.objects.filter(campaign=self.campaign).values_list('name', flat=True))
+
+    def test_rename_rewrites_exactly_the_referencing_rows(self):
+        ruler = Attribute.objects.get_or_create(thing_type=self.location_type, name='Ruler')[0]
+        ruler.is_thing = True
+        ruler.save()
+        occupation = Attribute.objects.get_or_create(thing_type=self.npc_type, name='Occupation')[0]
+        race = Attribute.objects.get_or_create(thing_type=self.npc_type, name='Race')[0]
+
+        town = self.create_thing(self.location_type, 'Ashford')
+        docks = self.create_thing(self.location_type, 'Ashford Docks')
+        shire = self.create_thing(self.location_type, 'Ashfordshire')
+        bob = self.create_thing(self.npc_type, 'Bob Stone')
+        elf = self.create_thing(self.npc_type, 'Elf')
+        town.children.add(docks, bob)
+        AttributeValue.objects.create(thing=town, attribute=ruler, value='Bob Stone')
+        AttributeValue.objects.create(thing=bob, attribute=occupation, value='Ruler of Ashford')
+        AttributeValue.objects.create(thing=bob, attribute=race, value='Elf')
+        RandomAttribute.objects.create(thing=shire, text='Feuds with Bob Stone')
+        RandomEncounter.objects.create(thing=shire, name='Bandits from Ashford')
+        self.assertEqual(ThingReference.objects.filter(thing=town).count(), 3)
+        self.assertEqual(ThingReference.objects.filter(thing=elf).count(), 0)
+
+        rename_thing(town, 'Westham')
+        rename_thing(Thing.objects.get(pk=bob.pk), 'Rob Smith')
+        self.assertEqual(self.get_names(), ['Ashfordshire', 'Elf', 'Rob Smith', 'Westham', 'Westham Docks'])
+        self.assertEqual(sorted(AttributeValue.objects.filter(thing__campaign=self.campaign).values_list('value', flat=True)),
+                         ['Elf', 'Rob Smith', 'Ruler of Westham'])
+        self.assertEqual(RandomAttribute.objects.get(thing=shire).text, 'Feuds with Rob Smith')
+        self.assertEqual(RandomEncounter.objects.get(thing=shire).name, 'Bandits from Westham')
+        self.assertEqual(Thing.objects.get(pk=town.pk).description, 'About Westham')
+
+
+class ImportTests(TransactionTestCase):
+    def setUp(self):
+        self.location_type = ThingType.objects.get_or_create(name='Location')[0]
+        self.npc_type = ThingType.objects.get_or_create(name='NPC')[0]
+        self.race = Attribute.objects.get_or_create(thing_type=self.npc_type, name='Race')[0]
+
+    def export_things(self, campaign):
+        return json.loads(''.join(iter_campaign_json(campaign)))
+
+    def test_import_replaces_the_campaign_and_keeps_indexes_in_sync(self):
+        source = Campaign.objects.create(name='Source')
+        town = Thing.objects.create(campaign=source, thing_type=self.location_type, name='Ashford', description='A market town.')
+        bob = Thing.objects.create(campaign=source, thing_type=self.npc_type, name='Bob Stone', description='Runs the inn.')
+        town.children.add(bob)
+        AttributeValue.objects.create(thing=bob, attribute=self.race, value='Elf')
+        RandomAttribute.objects.create(thing=bob, text='Was born in @Ashford@')
+        RandomEncounter.objects.create(thing=town, name='A stray dog')
+        preset = WeightPreset.objects.create(campaign=source, name='Elvish', attribute_name='Race')
+        Weight.objects.create(weight_preset=preset, name_to_weight='Elf', weight=5)
+        campaign_json = json.dumps(self.export_things(source))
+
+        target = Campaign.objects.create(name='Target', is_active=True)
+        Thing.objects.create(campaign=target, thing_type=self.location_type, name='Old Mill')
+        self.assertEqual(save_campaign(target, campaign_json), 2)
+        imported_town = Thing.objects.get(campaign=target, name='Ashford')
+        self.assertEqual(self.export_things(target), self.export_things(source))
+        self.assertEqual([thing.name for thing in descendants(imported_town)], ['Bob Stone'])
+        self.assertEqual(ThingReference.objects.filter(thing=imported_town).count(), 1)
+        self.assertEqual(list(RandomEncounter.objects.filter(thing=imported_town).values_list('name', 'random_encounter_type')), [('A stray dog', None)])
+        self.assertEqual([result.name for result in search_things(target, 'inn')], ['Bob Stone'])
+        self.assertEqual(find_names_starting_with(target, 'old'), [])
+        self.assertEqual(find_names_starting_with(target, 'stone'), ['Bob Stone'])
+
+        with self.assertRaisesRegex(ValueError, 'Unknown child of Ashford: Nobody'):
+            save_campaign(target, campaign_json.replace('["Bob Stone"]', '["Nobody"]'))
+        self.assertEqual(self.export_things(target), self.export_things(source))
+
+
+class MarkupRenderingTests(TestCase):
+    def test_markup_is_rendered_to_html(self):
+        self.assertEqual(render_markup('@Bob Stone@ fought a $Goblin King$ <b>once</b>\n\n*-\n- !Rope! -\n- ^Fire Bolt^-\n-*'),
+                         '<p><a class="thing" href="/campaign/thing/Bob%20Stone">Bob Stone</a> fought a '
+                         '<a class="monster" href="https://www.dndbeyond.com/monsters/Goblin-King" target="_blank">Goblin King</a> '
+                         '&lt;b&gt;once&lt;/b&gt;</p><p><ul>\n<li><a class="item" href="https://www.dndbeyond.com/magic-items/Rope" target="_blank">Rope</a> </li>'
+                         '<li><a class="spell" href="https://www.dndbeyond.com/spells/Fire-Bolt" target="_blank">Fire Bolt</a></li></ul></p>')
+        self.assertEqual(render_markup('An unclosed @marker'), '<p>An unclosed @marker</p>')
+
+    def test_rendered_markup_is_cached_by_content(self):
+        rendered = get_rendered_markup('Hello @Bob@', 'description')
+        self.assertIs(get_rendered_markup('Hello @Bob@', 'description'), rendered)
+        self.assertEqual(get_rendered_markup('', 'description'), '')
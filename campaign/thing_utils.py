@@ -1,89 +1,116 @@
 import logging
 import random
 import re
-from django.db.models.functions import Length
+from collections import OrderedDict, defaultdict, namedtuple
 from operator import methodcaller
 
-from .generator_utils import VARIABLE_REGEX
-from .models import Thing, ThingType, DndBeyondRef, DndBeyondType, RandomEncounter, RandomizerAttribute, Attribute, UsefulLink, RandomAttribute, AttributeValue, RandomEncounterType
+from django.db import connection, transaction
+from django.db.models import Count, Q
+
+from .models import Thing, ThingClosure, ThingReference, ThingTerm, ThingType, RandomEncounter, RandomizerAttribute, Attribute, UsefulLink, RandomAttribute, AttributeValue, RandomEncounterType
+from .hierarchy_utils import nearest_ancestor, remove_edge_from_closure
+from .markup_utils import queue_mentions, remove_thing_reference, update_thing_references
+from .name_utils import remove_thing_name, roll_unique_name
 from .randomizers import get_random_attribute_raw, get_random_attribute_in_category_raw
+from .reference_utils import rename_thing
+from .search_utils import queue_search_index
+from .template_utils import compile_template, make_resolver, render_template
 
 
 logger = logging.getLogger(__name__)
 
 
-def get_js_class(name, value):
-    return re.sub(r'\W+', '-', '{0}-{1}'.format(name, value))
+MAX_IDS_PER_QUERY = 500
+SUBTREE_ROW_MODELS = [ThingTerm, AttributeValue, UsefulLink, RandomEncounter, RandomAttribute]
 
+Subtree = namedtuple('Subtree', ['thing_ids', 'shared_ids', 'shared_edges'])
 
-def get_attributes_to_display(campaign, thing, include_location=True):
-    attributes_to_display = []
-    attribute_values = AttributeValue.objects.filter(thing=thing, attribute__display_in_summary=True).order_by('attribute__name')
-    for attribute_value in attribute_values:
-        attributes_to_display.append({
-            'name': attribute_value.attribute.name,
-            'value': attribute_value.value,
-            'can_link': attribute_value.attribute.is_thing,
-            'js_class': get_js_class(attribute_value.attribute.name, attribute_value.value)
-        })
 
-    if include_location:
-        parent_location = get_parent_location(campaign=campaign, thing=thing)
-        if parent_location:
-            attributes_to_display.append({
-                'name': 'Location',
-                'value': parent_location,
-                'can_link': True,
-                'js_class': get_js_class('Location', parent_location)
-            })
-    return attributes_to_display
+def get_js_class(name, value):
+    return re.sub(r'\W+', '-', '{0}-{1}'.format(name, value))
 
 
-def get_basic_data_for_thing(campaign, thing):
+def get_display_attribute(name, value, can_link):
     return {
-        'name': thing.name,
-        'description': thing.description,
-        'attributes': get_attributes_to_display(campaign=campaign, thing=thing),
-        'child_locations': thing.children.filter(thing_type__name='Location'),
-        'child_npcs': thing.children.filter(thing_type__name='NPC'),
-        'child_factions': thing.children.filter(thing_type__name='Faction')
+        'name': name,
+        'value': value,
+        'can_link': can_link,
+        'js_class': get_js_class(name, value)
     }
 
 
-def get_parent_location(campaign, thing):
-    parents = Thing.objects.filter(campaign=campaign, children=thing, thing_type__name='Location').order_by('name')
-    if len(parents) == 0:
-        return None
-    else:
-        return parents[0].name
+def load_thing_summaries(campaign, things, include_location=True, use_markup=False):
+    thing_ids = things.values('pk')
+    summaries = OrderedDict()
+    for thing in things.select_related('thing_type'):
+        summaries[thing.pk] = {
+            'name': thing.name,
+            'thing_type': thing.thing_type.name if thing.thing_type else None,
+            'description': thing.markup_description or thing.description if use_markup else thing.description,
+            'attributes': [],
+            'child_locations': [],
+            'child_npcs': [],
+            'child_factions': []
+        }
+    if not summaries:
+        return summaries
+
+    attribute_values = AttributeValue.objects.filter(thing_id__in=thing_ids, attribute__display_in_summary=True) \
+        .order_by('attribute__name').values_list('thing_id', 'attribute__name', 'attribute__is_thing', 'value')
+    for thing_id, name, is_thing, value in attribute_values:
+        if thing_id in summaries:
+            summaries[thing_id]['attributes'].append(get_display_attribute(name, value, is_thing))
+
+    if include_location:
+        parent_locations = Thing.children.through.objects.filter(to_thing_id__in=thing_ids, from_thing__campaign=campaign,
+                                                                 from_thing__thing_type__name='Location') \
+            .order_by('from_thing__name').values_list('to_thing_id', 'from_thing__name')
+        located = set()
+        for thing_id, parent_name in parent_locations:
+            if thing_id in summaries and thing_id not in located:
+                located.add(thing_id)
+                summaries[thing_id]['attributes'].append(get_display_attribute('Location', parent_name, True))
+
+    child_lists = {
+        'Location': 'child_locations',
+        'NPC': 'child_npcs',
+        'Faction': 'child_factions'
+    }
+    children = Thing.children.through.objects.filter(from_thing_id__in=thing_ids, to_thing__thing_type__name__in=child_lists.keys()) \
+        .order_by('to_thing__name').values_list('from_thing_id', 'to_thing__name', 'to_thing__thing_type__name')
+    for thing_id, child_name, child_type in children:
+        if thing_id in summaries:
+            summaries[thing_id][child_lists[child_type]].append({'name': child_name})
+    return summaries
 
 
 def get_details(campaign, thing, include_location=True):
     parent_locations = []
     parent_factions = []
-    for parent in Thing.objects.filter(campaign=campaign, children=thing).order_by('name'):
-        if parent.thing_type.name == 'Location':
-            parent_locations.append(get_details(campaign=campaign, thing=parent))
-        elif parent.thing_type.name == 'Faction':
-            parent_factions.append(get_details(campaign=campaign, thing=parent))
+    parents = load_thing_summaries(campaign, Thing.objects.filter(campaign=campaign, children=thing).order_by('name'), use_markup=True)
+    for parent in parents.values():
+        if parent['thing_type'] == 'Location':
+            parent_locations.append(parent)
+        elif parent['thing_type'] == 'Faction':
+            parent_factions.append(parent)
 
     child_locations = []
     child_factions = []
     child_npcs = []
-    for child in thing.children.order_by('name'):
-        if child.thing_type.name == 'Location':
-            child_locations.append(get_basic_data_for_thing(campaign=campaign, thing=child))
-        elif child.thing_type.name == 'Faction':
-            child_factions.append(get_basic_data_for_thing(campaign=campaign, thing=child))
-        elif child.thing_type.name == 'NPC':
-            child_npcs.append(get_basic_data_for_thing(campaign=campaign, thing=child))
-
-    encounter_types = [t.name for t in RandomEncounterType.objects.all()]
-    encounter_types.sort()
+    for child in load_thing_summaries(campaign, thing.children.order_by('name')).values():
+        if child['thing_type'] == 'Location':
+            child_locations.append(child)
+        elif child['thing_type'] == 'Faction':
+            child_factions.append(child)
+        elif child['thing_type'] == 'NPC':
+            child_npcs.append(child)
+
+    encounters_by_type = OrderedDict((t, []) for t in sorted(RandomEncounterType.objects.values_list('name', flat=True)))
+    for random_encounter in RandomEncounter.objects.filter(thing=thing, random_encounter_type__isnull=False).select_related('random_encounter_type').order_by('pk'):
+        encounters_by_type[random_encounter.random_encounter_type.name].append(random_encounter)
     encounters = []
     display_encounters = False
-    for encounter_type in encounter_types:
-        random_encounters = RandomEncounter.objects.filter(thing=thing, random_encounter_type__name=encounter_type)
+    for encounter_type, random_encounters in encounters_by_type.items():
         if random_encounters:
             display_encounters = True
         encounters.append({
@@ -92,8 +119,13 @@ def get_details(campaign, thing, include_location=True):
             'list': random_encounters
         })
 
-    attributes_to_display = [a.name for a in Attribute.objects.filter(thing_type=thing.thing_type, display_in_summary=True).order_by('name')]
-    editable_attributes = [a.name for a in Attribute.objects.filter(thing_type=thing.thing_type, editable=True).order_by('name')]
+    attributes_to_display = []
+    editable_attributes = []
+    for name, display_in_summary, editable in Attribute.objects.filter(thing_type=thing.thing_type).order_by('name').values_list('name', 'display_in_summary', 'editable'):
+        if display_in_summary:
+            attributes_to_display.append(name)
+        if editable:
+            editable_attributes.append(name)
 
     random_attributes = [{'text': r.text, 'id': r.pk} for r in RandomAttribute.objects.filter(thing=thing).order_by('text')]
     randomizable_attributes = [a.name for a in RandomizerAttribute.objects.filter(thing_type=thing.thing_type, can_randomize_later=True).order_by('name')]
@@ -111,13 +143,27 @@ def get_details(campaign, thing, include_location=True):
     if not cs:
         cs = thing.current_state
 
+    summary_attributes = []
+    other_attributes = {}
+    show_name_randomizer = False
+    for name, display_in_summary, is_thing, value in AttributeValue.objects.filter(thing=thing).order_by('attribute__name') \
+            .values_list('attribute__name', 'attribute__display_in_summary', 'attribute__is_thing', 'value'):
+        if name == 'Name Randomizer':
+            show_name_randomizer = True
+        if display_in_summary:
+            summary_attributes.append(get_display_attribute(name, value, is_thing))
+        else:
+            other_attributes[name.lower()] = value
+    if include_location and parent_locations:
+        summary_attributes.append(get_display_attribute('Location', parent_locations[0]['name'], True))
+
     thing_info = {
         'name': thing.name,
         'thing_type': thing.thing_type.name,
         'description': desc,
         'background': bgrnd,
         'current_state': cs,
-        'attributes': get_attributes_to_display(campaign=campaign, thing=thing, include_location=include_location),
+        'attributes': summary_attributes,
         'useful_links': UsefulLink.objects.filter(thing=thing).order_by('name'),
         'image': thing.image,
         'random_attributes': random_attributes,
@@ -128,17 +174,14 @@ def get_details(campaign, thing, include_location=True):
         'editable_attributes': editable_attributes,
         'randomizable_attributes': randomizable_attributes,
         'is_bookmarked': thing.is_bookmarked,
-        'show_name_randomizer': len(AttributeValue.objects.filter(attribute__name='Name Randomizer', thing=thing)) > 0,
+        'show_name_randomizer': show_name_randomizer,
         'parent_locations': parent_locations,
         'parent_factions': parent_factions,
         'child_locations': child_locations,
         'child_factions': child_factions,
         'child_npcs': child_npcs
     }
-
-    attribute_values = AttributeValue.objects.filter(thing=thing, attribute__display_in_summary=False).order_by('attribute__name')
-    for attribute_value in attribute_values:
-        thing_info[attribute_value.attribute.name.lower()] = attribute_value.value
+    thing_info.update(other_attributes)
 
     return thing_info
 
@@ -181,32 +224,24 @@ def order_attribute_filters(attribute_filters):
 
 
 def get_list_data(campaign, thing_type, bookmarks_only=False):
+    things_to_show = Thing.objects.filter(campaign=campaign, thing_type__isnull=False).order_by('name')
     if thing_type:
         types = [thing_type]
+        things_to_show = things_to_show.filter(thing_type__name__iexact=thing_type)
     else:
-        types = [thing.name for thing in ThingType.objects.all()]
+        types = [t.name for t in ThingType.objects.all()]
+    if bookmarks_only:
+        things_to_show = things_to_show.filter(is_bookmarked=True)
 
-    list_data = []
+    things_by_type = {}
+    for summary in load_thing_summaries(campaign, things_to_show).values():
+        things_by_type.setdefault(summary['thing_type'].lower(), []).append(summary)
 
+    list_data = []
     for t in types:
-        data_for_type = []
-        if bookmarks_only:
-            things_to_show = Thing.objects.filter(campaign=campaign, thing_type__name__iexact=t, is_bookmarked=True).order_by('name')
-        else:
-            things_to_show = Thing.objects.filter(campaign=campaign, thing_type__name__iexact=t).order_by('name')
-
-        for thing in things_to_show:
-            data_for_type.append({
-                'name': thing.name,
-                'description': thing.description,
-                'attributes': get_attributes_to_display(campaign=campaign, thing=thing),
-                'child_locations': thing.children.filter(thing_type__name='Location'),
-                'child_npcs': thing.children.filter(thing_type__name='NPC'),
-                'child_factions': thing.children.filter(thing_type__name='Faction')
-            })
         list_data.append({
             'name': '{0}s'.format(t),
-            'things': data_for_type
+            'things': things_by_type.get(t.lower(), [])
         })
 
     return list_data
@@ -392,27 +427,29 @@ def save_new_note(campaign, form_data):
 
 
 def replace_variables_in_name(thing, name):
-    var_search = re.findall(VARIABLE_REGEX, name)
-    if var_search:
-        for variable in var_search:
-            if '.' in variable:
-                parts = variable.split('.')
-                if parts[0] == 'parent':
-                    try:
-                        parent_object = Thing.objects.get(campaign=thing.campaign, thing_type__name='Location', children=thing)
-                    except Thing.DoesNotExist:
-                        parent_object = None
-                    if parent_object:
-                        try:
-                            parent_value = getattr(parent_object, parts[1])
-                        except AttributeError:
-                            parent_value = AttributeValue.objects.get(attribute__name__iexact=parts[1], thing=parent_object).value
-                        return re.sub(r'\$\{' + variable + '\}', parent_value, name)
-            else:
-                for attribute_value in AttributeValue.objects.filter(thing=thing):
-                    if attribute_value.attribute.name.lower() == variable:
-                        return re.sub(r'\$\{' + variable + '\}', attribute_value.value, name)
-    return name
+    if not name or '${' not in name:
+        return name
+    template = compile_template(name)
+
+    fields = {}
+    if any(variable.scope is None for variable in template.variables):
+        for attribute_name, value in AttributeValue.objects.filter(thing=thing).values_list('attribute__name', 'value'):
+            fields.setdefault(attribute_name.lower(), value)
+
+    parent = []
+
+    def get_parent_value(attribute_name):
+        if not parent:
+            parent.append(nearest_ancestor(thing, 'Location'))
+        if not parent[0]:
+            return None
+        try:
+            return getattr(parent[0], attribute_name)
+        except AttributeError:
+            attribute_value = AttributeValue.objects.filter(attribute__name__iexact=attribute_name, thing=parent[0]).first()
+            return attribute_value.value if attribute_value else None
+
+    return render_template(template, make_resolver(fields, get_parent_value))
 
 
 def randomize_name_for_thing(thing):
@@ -422,115 +459,103 @@ def randomize_name_for_thing(thing):
         name_randomizer = None
 
     if name_randomizer:
-        new_name = None
-        while not new_name or thing.name != new_name and Thing.objects.filter(name__iexact=new_name):
-            if new_name:
-                logger.debug('Tried randomizing {0} to {1} but it was in use.'.format(thing.name, new_name))
-            else:
-                logger.debug('Getting new name for {0}.'.format(thing.name))
-            raw_name = get_random_attribute_in_category_raw(thing.thing_type, 'name', AttributeValue.objects.get(attribute__name='Name Randomizer', thing=thing).value)
+        def roll():
+            raw_name = get_random_attribute_in_category_raw(thing.thing_type, 'name', name_randomizer.value)
             logger.debug('Got {0}'.format(raw_name))
-            new_name = replace_variables_in_name(thing, raw_name)
+            return replace_variables_in_name(thing, raw_name)
+
+        logger.debug('Getting new name for {0}.'.format(thing.name))
+        new_name = roll_unique_name(thing.campaign, roll, True, 'Name.{0}'.format(name_randomizer.value))
 
-        update_thing_name_and_all_related(thing, new_name)
+        rename_thing(thing, new_name)
     else:
         logger.info('Cannot randomize name for {0}: no name randomizer set (likely not a generated object).'.format(thing.name))
 
 
-def update_value_in_string(string, old_value, new_value):
-    new_string = string.replace(old_value, new_value)
-
-    if ' ' in old_value:
-        old_pieces = old_value.split(' ')
-        new_pieces = new_value.split(' ')
-        for i, piece in enumerate(old_pieces):
-            if i >= len(new_pieces):
-                break
-            new_string = new_string.replace(piece, new_pieces[i])
-    return new_string
-
-
-def update_thing_name_and_all_related(thing, new_name, check_parents=True):
-    name = thing.name
-
-    thing.name = new_name
-    thing.description = update_value_in_string(thing.description, name, new_name)
-    if thing.background:
-        thing.background = update_value_in_string(thing.background, name, new_name)
-    if thing.current_state:
-        thing.current_state = update_value_in_string(thing.current_state, name, new_name)
-    thing.save()
-
-    if thing.thing_type.name == 'NPC':
-        try:
-            faction = Thing.objects.get(campaign=thing.campaign, thing_type__name='Faction', children=thing)
-            try:
-                leader = AttributeValue.objects.get(attribute__name='Leader', thing=faction)
-                leader.value = update_value_in_string(leader.value, name, new_name)
-                leader.save()
-                logger.info('Updated leader attribute of {0}: {1}'.format(faction.name, leader.value))
-            except AttributeValue.DoesNotExist:
-                pass
-        except Thing.DoesNotExist:
-            pass
-        try:
-            location = Thing.objects.get(campaign=thing.campaign, thing_type__name='Location', children=thing)
-            try:
-                ruler = AttributeValue.objects.get(attribute__name='Ruler', thing=location)
-                ruler.value = update_value_in_string(ruler.value, name, new_name)
-                ruler.save()
-                logger.info('Updated ruler attribute of {0}: {1}'.format(location.name, ruler.value))
-            except AttributeValue.DoesNotExist:
-                pass
-        except Thing.DoesNotExist:
-            pass
-        try:
-            parent_with_name = Thing.objects.get(campaign=thing.campaign, name__icontains=name, children=thing)
-            parent_new_name = update_value_in_string(parent_with_name.name, name, new_name)
-            old_name = parent_with_name.name
-            update_thing_name_and_all_related(parent_with_name, parent_new_name, False)
-            logger.info('Updated name of {0}: {1}'.format(old_name, parent_with_name.name))
-        except Thing.DoesNotExist:
-            pass
-    elif thing.thing_type.name == 'Location':
-        try:
-            ruler = AttributeValue.objects.get(attribute__name='Ruler', thing=thing)
-            npc = Thing.objects.get(campaign=thing.campaign, thing_type__name='NPC', name=ruler.value)
-            npc_occupation = AttributeValue.objects.get(attribute__name='Occupation', thing=npc)
-            npc_occupation.value = update_value_in_string(npc_occupation.value, name, new_name)
-            npc_occupation.save()
-            logger.info('Updated occupation of {0}: {1}'.format(npc.name, npc_occupation.value))
-        except AttributeValue.DoesNotExist:
-            pass
-        for child_with_name in thing.children.filter(name__icontains=name):
-            child_new_name = update_value_in_string(child_with_name.name, name, new_name)
-            old_name = child_with_name.name
-            update_thing_name_and_all_related(child_with_name, child_new_name, False)
-            logger.info('Updated name of {0}: {1}'.format(old_name, child_with_name.name))
-    elif thing.thing_type.name == 'Faction':
-        try:
-            leader = AttributeValue.objects.get(attribute__name='Leader', thing=thing)
-            npc = Thing.objects.get(campaign=thing.campaign, thing_type__name='NPC', name=leader.value)
-            npc_occupation = AttributeValue.objects.get(attribute__name='Occupation', thing=npc)
-            npc_occupation.value = update_value_in_string(npc_occupation.value, name, new_name)
-            npc_occupation.save()
-            logger.info('Updated occupation of {0}: {1}'.format(npc.name, npc_occupation.value))
-        except AttributeValue.DoesNotExist:
-            pass
-
-
 def clean_description(text):
     return text.replace('@', '').replace('$', '').replace('!', '').replace('^', '')
 
 
-def update_thing_references(text, campaign):
-    new_text = text.replace('@', '')
-    for thing in Thing.objects.filter(campaign=campaign).order_by(Length('name').asc()):
-        new_text = new_text.replace(thing.name, '@{0}@'.format(thing.name))
-
-    for dndbeyond_type in DndBeyondType.objects.all():
-        new_text = new_text.replace(dndbeyond_type.markup_symbol, '')
-        for dndbeyond_ref in DndBeyondRef.objects.filter(dndbeyond_type=dndbeyond_type):
-            new_text = new_text.replace(dndbeyond_ref.name, '{0}{1}{0}'.format(dndbeyond_type.markup_symbol, dndbeyond_ref.name))
-
-    return new_text
+def get_subtree_things(thing):
+    return Thing.objects.filter(Q(pk=thing.pk) | Q(pk__in=ThingClosure.objects.filter(ancestor=thing).values('descendant_id')))
+
+
+def get_subtree(thing):
+    edges = list(Thing.children.through.objects.filter(to_thing_id__in=ThingClosure.objects.filter(ancestor=thing).values('descendant_id'))
+                 .values_list('from_thing_id', 'to_thing_id'))
+    parents = defaultdict(set)
+    children = defaultdict(list)
+    for parent_id, child_id in edges:
+        parents[child_id].add(parent_id)
+        children[parent_id].append(child_id)
+
+    thing_ids = [thing.pk]
+    owned = {thing.pk}
+    for parent_id in thing_ids:
+        for child_id in children[parent_id]:
+            if child_id not in owned and parents[child_id] <= owned:
+                owned.add(child_id)
+                thing_ids.append(child_id)
+    shared_ids = set(parents) - owned
+    shared_edges = [(parent_id, child_id) for parent_id, child_id in edges if parent_id in owned and child_id in shared_ids]
+    return Subtree(thing_ids=thing_ids, shared_ids=sorted(shared_ids), shared_edges=shared_edges)
+
+
+def count_subtree(thing):
+    thing_ids = set(get_subtree(thing).thing_ids)
+    counts = OrderedDict()
+    for pk, thing_type_name in get_subtree_things(thing).order_by('thing_type__name').values_list('pk', 'thing_type__name'):
+        if pk in thing_ids:
+            counts[thing_type_name] = counts.get(thing_type_name, 0) + 1
+    return counts
+
+
+def get_shared_names(thing):
+    shared_ids = set(get_subtree(thing).shared_ids)
+    return [name for pk, name in get_subtree_things(thing).order_by('name').values_list('pk', 'name') if pk in shared_ids]
+
+
+DELETE_REFERENCES_SQL = '''
+DELETE FROM {0}
+WHERE thing_id IN ({1}) OR referencing_thing_id IN ({1})
+    OR attribute_value_id IN (SELECT id FROM {2} WHERE thing_id IN ({1}))
+    OR random_attribute_id IN (SELECT id FROM {3} WHERE thing_id IN ({1}))
+    OR random_encounter_id IN (SELECT id FROM {4} WHERE thing_id IN ({1}))
+'''
+
+
+def delete_things(thing_ids):
+    children_table = Thing.children.through._meta.db_table
+    with connection.cursor() as cursor:
+        for i in range(0, len(thing_ids), MAX_IDS_PER_QUERY):
+            chunk = thing_ids[i:i + MAX_IDS_PER_QUERY]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(DELETE_REFERENCES_SQL.format(ThingReference._meta.db_table, placeholders, AttributeValue._meta.db_table,
+                                                        RandomAttribute._meta.db_table, RandomEncounter._meta.db_table), chunk * 5)
+            cursor.execute('DELETE FROM {0} WHERE ancestor_id IN ({1}) OR descendant_id IN ({1})'.format(ThingClosure._meta.db_table, placeholders), chunk * 2)
+            cursor.execute('DELETE FROM {0} WHERE from_thing_id IN ({1}) OR to_thing_id IN ({1})'.format(children_table, placeholders), chunk * 2)
+            for model in SUBTREE_ROW_MODELS:
+                cursor.execute('DELETE FROM {0} WHERE thing_id IN ({1})'.format(model._meta.db_table, placeholders), chunk)
+            cursor.execute('DELETE FROM {0} WHERE id IN ({1})'.format(Thing._meta.db_table, placeholders), chunk)
+
+
+def delete_subtree(thing):
+    subtree = get_subtree(thing)
+    owned = set(subtree.thing_ids)
+    things = [row for row in get_subtree_things(thing).values_list('pk', 'campaign_id', 'name', 'thing_type_id') if row[0] in owned]
+    thing_ids = [pk for pk, campaign_id, name, thing_type_id in things]
+    with transaction.atomic():
+        for parent_id, child_id in subtree.shared_edges:
+            remove_edge_from_closure(parent_id, child_id)
+        delete_things(thing_ids)
+        queue_search_index(thing_ids)
+
+    names_by_campaign = OrderedDict()
+    for pk, campaign_id, name, thing_type_id in things:
+        remove_thing_name(campaign_id, name, thing_type_id)
+        remove_thing_reference(campaign_id, name)
+        names_by_campaign.setdefault(campaign_id, []).append(name)
+    for campaign_id, names in names_by_campaign.items():
+        queue_mentions(campaign_id, names)
+    logger.info('Deleted {0} and {1} descendants, kept {2} shared descendants'.format(thing.name, len(thing_ids) - 1, len(subtree.shared_ids)))
+    return len(thing_ids)
@@ -0,0 +1,64 @@
+import heapq
+from collections import defaultdict
+
+
+def get_trigrams(text):
+    padded = '  {0} '.format(' '.join(text.lower().split()))
+    return {padded[i:i + 3] for i in range(0, len(padded) - 2)}
+
+
+class TrigramIndex(object):
+    __slots__ = ['names', 'trigrams', 'ids', 'postings']
+
+    def __init__(self, names=()):
+        self.names = []
+        self.trigrams = []
+        self.ids = {}
+        self.postings = defaultdict(set)
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, name):
+        if not name or name in self.ids:
+            return
+        name_id = len(self.names)
+        trigrams = get_trigrams(name)
+        self.names.append(name)
+        self.trigrams.append(len(trigrams))
+        self.ids[name] = name_id
+        for trigram in trigrams:
+            self.postings[trigram].add(name_id)
+
+    def remove(self, name):
+        name_id = self.ids.pop(name, None)
+        if name_id is None:
+            return
+        for trigram in get_trigrams(name):
+            posting = self.postings.get(trigram)
+            if posting is not None:
+                posting.discard(name_id)
+                if not posting:
+                    del self.postings[trigram]
+        self.names[name_id] = None
+
+    def search(self, text, limit=10, min_similarity=0.0):
+        trigrams = get_trigrams(text)
+        if not trigrams:
+            return []
+        overlaps = defaultdict(int)
+        for trigram in trigrams:
+            for name_id in self.postings.get(trigram, ()):
+                overlaps[name_id] += 1
+
+        sizes = self.trigrams
+        query_size = len(trigrams)
+        scored = []
+        for name_id, overlap in overlaps.items():
+            similarity = overlap / (query_size + sizes[name_id] - overlap)
+            if similarity >= min_similarity:
+                scored.append((similarity, name_id))
+        names = self.names
+        return [(names[name_id], similarity) for similarity, name_id in heapq.nlargest(limit, scored, key=lambda score: (score[0], -score[1]))]
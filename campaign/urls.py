@@ -10,6 +10,8 @@ urlpatterns = [
     path('', views.list_bookmarks, name='list_bookmarks'),
     path('thing/<name>', views.detail, name='detail'),
     path('search', views.search, name='search'),
+    path('search_results', views.search_results, name='search_results'),
+    path('typeahead', views.typeahead, name='typeahead'),
     path('export', views.export, name='export'),
     path('import', views.import_campaign, name='import'),
     path('import_settings', views.import_settings, name='import_settings'),
@@ -28,6 +30,7 @@ urlpatterns = [
     path('remove_link/<name>/<link_name>', views.remove_link, name='remove_link'),
     path('change_parent/<thing_type_name>/<name>', views.change_parent, name='change_parent'),
     path('change_thing_type/<name>/<thing_type_name>', views.change_thing_type, name='change_thing_type'),
+    path('random/<thing_type>', views.get_random_attributes, name='get_random_attributes'),
     path('random/<thing_type>/<attribute>', views.get_random_attribute, name='get_random_attribute'),
     path('random/<thing_type>/<attribute>/<category>', views.get_random_attribute_in_category, name='get_random_attribute_in_category'),
     path('manage/<thing_type>/<attribute>', views.manage_randomizer_options, name='manage_randomizer_options'),
@@ -40,6 +43,9 @@ urlpatterns = [
     path('bookmark/<name>', views.bookmark, name='bookmark'),
     path('generate/<name>', views.generate_object, name='generate'),
     path('generate_in_location/<location_name>/<generator_name>', views.generate_object_in_location, name='generate_in_location'),
+    path('generate_preview/<token>', views.preview_generated_object, name='generate_preview'),
+    path('generation_job/<job_id>', views.generation_job, name='generation_job'),
+    path('generation_job/<job_id>/progress', views.generation_job_progress, name='generation_job_progress'),
     path('select_generator/<thing_type>', views.select_object_to_generate, name='select_generator'),
     path('new_generator/<thing_type_name>', views.new_generator_object, name='new_generator'),
     path('manage_generators/<thing_type_name>', views.select_generator_to_edit, name='manage_generators'),
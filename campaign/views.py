@@ -1,15 +1,24 @@
 import logging
 
-from django.http import HttpResponseRedirect, Http404, JsonResponse
+from django.db import transaction
+from django.http import HttpResponseRedirect, Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
+from django.utils.http import urlencode
 
-from .export_utils import get_campaign_json, get_settings_json, save_campaign, save_settings
+from .estimate_utils import estimate_generator
+from .export_utils import iter_campaign_json, get_settings_json, save_campaign, save_settings
 from .forms import AddLinkForm, ChangeRequiredTextAttributeForm, SearchForm, UploadFileForm, NewLocationForm, NewFactionForm, NewNpcForm, NewItemForm, NewNoteForm, EditEncountersForm, EditDescriptionForm, ChangeTextAttributeForm, ChangeOptionAttributeForm, ChangeParentForm, EditOptionalTextFieldForm, SelectCategoryForAttributeForm, SelectGeneratorObject, SelectPreset, NewPreset, GeneratorObjectForm, SelectGeneratorObjectWithLocation
 from .models import Thing, ThingType, Attribute, AttributeValue, UsefulLink, Campaign, RandomEncounter, RandomEncounterType, RandomizerAttribute, RandomizerAttributeCategory, RandomizerAttributeCategoryOption, RandomizerAttributeOption, RandomAttribute, GeneratorObject, GeneratorObjectContains, GeneratorObjectFieldToRandomizerAttribute, Weight, WeightPreset, DndBeyondRef, DndBeyondType
-from .randomizers import get_randomization_options_for_new_thing, get_random_attribute_in_category_raw, get_random_attribute_raw, generate_random_attributes_for_thing_raw
+from .randomizers import get_randomization_options_for_new_thing, get_random_attribute_in_category_raw, get_random_attribute_raw, get_random_attributes_in_category_raw, get_random_attributes_raw, generate_random_attributes_for_thing_raw, MAX_ROLLS_PER_REQUEST
 from .generator_utils import generate_thing, save_new_generator, edit_generator
-from .thing_utils import get_details, get_list_data, get_filters, save_new_faction, save_new_location, save_new_npc, save_new_item, save_new_note, randomize_name_for_thing, update_thing_name_and_all_related, update_thing_references, clean_description
+from .job_utils import get_generation_job, should_generate_in_background, start_generation_job
+from .markup_utils import update_thing_references
+from .name_utils import find_names_starting_with, find_similar_names, MIN_REDIRECT_SIMILARITY
+from .preview_utils import create_preview, get_preview, discard_preview, commit_preview, preview_to_context
+from .reference_utils import rename_thing
+from .search_utils import find_closest_name, search_things
+from .thing_utils import get_details, get_list_data, get_filters, save_new_faction, save_new_location, save_new_npc, save_new_item, save_new_note, randomize_name_for_thing, clean_description, count_subtree, delete_subtree, get_shared_names
 
 
 logger = logging.getLogger(__name__)
@@ -60,21 +69,47 @@ def search(request):
         return go_to_closest_thing(campaign=campaign, name=form.cleaned_data['search_text'])
 
 
+def search_results(request):
+    campaign = Campaign.objects.get(is_active=True)
+    text = request.GET.get('q', '')
+    results = search_things(campaign, text) if text else []
+    result_names = {result.name for result in results}
+    context = {
+        'search_text': text,
+        'results': results,
+        'similar_names': [similar_name for similar_name, similarity in find_similar_names(campaign, text) if similar_name not in result_names] if text else []
+    }
+    return render(request, 'campaign/search_results.html', build_context(context))
+
+
+def typeahead(request):
+    campaign = Campaign.objects.get(is_active=True)
+    thing_types = request.GET.getlist('type')
+    thing_type_ids = list(ThingType.objects.filter(name__in=thing_types).values_list('pk', flat=True)) if thing_types else None
+    names = find_names_starting_with(campaign, request.GET.get('q', ''), thing_type_ids)
+    thing_ids = dict(Thing.objects.filter(campaign=campaign, name__in=names).values_list('name', 'pk')) if names else {}
+    return JsonResponse({
+        'results': [{'id': thing_ids[name], 'name': name} for name in names if name in thing_ids]
+    })
+
+
 def go_to_closest_thing(campaign, name):
-    results = Thing.objects.filter(campaign=campaign, name__icontains=name)
-    if len(results) == 0:
-        raise Http404('"{0}" does not exist.'.format(name))
+    results = search_things(campaign, name)
+    closest_name = find_closest_name([result.name for result in results], name)
+    if closest_name is None and not results:
+        closest_name = find_closest_name(Thing.objects.filter(campaign=campaign, name__icontains=name).values_list('name', flat=True), name)
+    if closest_name is not None:
+        return HttpResponseRedirect(reverse('campaign:detail', args=(closest_name,)))
     elif len(results) == 1:
         return HttpResponseRedirect(reverse('campaign:detail', args=(results[0].name,)))
-    else:
-        min_length_diff = len(results[0].name) - len(name)
-        result = results[0]
-        for r in results[1:]:
-            new_length_diff = len(r.name) - len(name)
-            if new_length_diff < min_length_diff:
-                result = r
-                min_length_diff = new_length_diff
-        return HttpResponseRedirect(reverse('campaign:detail', args=(result.name,)))
+
+    similar_names = find_similar_names(campaign, name)
+    if not results and similar_names and (len(similar_names) == 1 or similar_names[0][1] >= MIN_REDIRECT_SIMILARITY):
+        logger.debug('Redirecting {0} to the similar name {1}'.format(name, similar_names[0][0]))
+        return HttpResponseRedirect(reverse('campaign:detail', args=(similar_names[0][0],)))
+    elif results or similar_names:
+        return HttpResponseRedirect('{0}?{1}'.format(reverse('campaign:search_results'), urlencode({'q': name})))
+    raise Http404('"{0}" does not exist.'.format(name))
 
 
 def list_all(request, thing_type, bookmarks_only=False):
@@ -84,14 +119,6 @@ def list_all(request, thing_type, bookmarks_only=False):
 
     context = {
         'types': list_data,
-        'thing_link_marker': '@',
-        'thing_url': '/campaign/thing/',
-        'beyond_link_marker': '$',
-        'beyond_url': 'https://www.dndbeyond.com/monsters/',
-        'item_link_marker': '!',
-        'item_url': 'https://www.dndbeyond.com/magic-items/',
-        'spell_link_marker': '^',
-        'spell_url': 'https://www.dndbeyond.com/spells/',
         'filters': get_filters(list_data)
     }
 
@@ -114,15 +141,7 @@ def detail(request, name):
         return go_to_closest_thing(campaign=campaign, name=name)
 
     context = {
-        'thing': get_details(campaign=campaign, thing=thing),
-        'thing_link_marker': '@',
-        'thing_url': '/campaign/thing/',
-        'beyond_link_marker': '$',
-        'beyond_url': 'https://www.dndbeyond.com/monsters/',
-        'item_link_marker': '!',
-        'item_url': 'https://www.dndbeyond.com/magic-items/',
-        'spell_link_marker': '^',
-        'spell_url': 'https://www.dndbeyond.com/spells/'
+        'thing': get_details(campaign=campaign, thing=thing)
     }
     return render(request, 'campaign/detail.html', build_context(context))
 
@@ -130,7 +149,7 @@ def detail(request, name):
 def export(request):
     campaign = Campaign.objects.get(is_active=True)
 
-    response = JsonResponse(get_campaign_json(campaign=campaign))
+    response = StreamingHttpResponse(iter_campaign_json(campaign=campaign), content_type='application/json')
     response['Content-Disposition'] = 'attachment; filename="{0}.json"'.format(campaign.name.lower().replace(' ', '_'))
 
     return response
@@ -141,8 +160,11 @@ def import_campaign(request):
     if request.method == 'POST':
         form = UploadFileForm(request.POST, request.FILES)
         if form.is_valid():
-            save_campaign(campaign=campaign, json_file=request.FILES['file'].read().decode('UTF-8'))
-            return HttpResponseRedirect(reverse('campaign:list_bookmarks'))
+            try:
+                save_campaign(campaign=campaign, json_file=request.FILES['file'].read().decode('UTF-8'))
+                return HttpResponseRedirect(reverse('campaign:list_bookmarks'))
+            except ValueError as e:
+                form.add_error('file', str(e))
         else:
             logger.info(form.errors)
     else:
@@ -188,14 +210,19 @@ def change_parent(request, thing_type_name, name):
     if request.method == 'POST':
         form = ChangeParentForm(request.POST)
         if form.is_valid():
-            for old_parent in Thing.objects.filter(campaign=campaign, children=thing, thing_type=thing_type):
-                old_parent.children.remove(thing)
-                old_parent.save()
-            if not form.cleaned_data['clear_parent'] and form.cleaned_data['parent']:
-                new_parent = get_object_or_404(Thing, campaign=campaign, thing_type=thing_type, name=form.cleaned_data['parent'])
-                new_parent.children.add(thing)
-                new_parent.save()
-            return HttpResponseRedirect(reverse('campaign:detail', args=(thing.name,)))
+            try:
+                with transaction.atomic():
+                    for old_parent in Thing.objects.filter(campaign=campaign, children=thing, thing_type=thing_type):
+                        old_parent.children.remove(thing)
+                        old_parent.save()
+                    if not form.cleaned_data['clear_parent'] and form.cleaned_data['parent']:
+                        new_parent = get_object_or_404(Thing, campaign=campaign, thing_type=thing_type, name=form.cleaned_data['parent'])
+                        new_parent.children.add(thing)
+                        new_parent.save()
+                return HttpResponseRedirect(reverse('campaign:detail', args=(thing.name,)))
+            except ValueError as e:
+                form.add_error('parent', str(e))
+                form.refresh_fields(thing_type=thing_type)
     else:
         try:
             current_parent = Thing.objects.get(campaign=campaign, children=thing, thing_type=thing_type).pk
@@ -227,16 +254,19 @@ def change_thing_type(request, thing_type_name, name):
 def delete_thing(request, name):
     campaign = Campaign.objects.get(is_active=True)
     thing = get_object_or_404(Thing, campaign=campaign, name=name)
-    delete_thing_and_children(thing)
-    return HttpResponseRedirect(reverse('campaign:list_bookmarks'))
-
+    if request.method == 'POST':
+        delete_subtree(thing)
+        return HttpResponseRedirect(reverse('campaign:list_bookmarks'))
 
-def delete_thing_and_children(thing):
-    for child in thing.children.all():
-        logger.info('Deleting {0}...'.format(child.name))
-        child.delete()
-    logger.info('Deleting {0}...'.format(thing.name))
-    thing.delete()
+    counts = count_subtree(thing)
+    context = {
+        'thing': thing,
+        'counts': counts,
+        'total': sum(counts.values()),
+        'shared': get_shared_names(thing),
+        'url': reverse('campaign:delete_thing', args=(thing.name,))
+    }
+    return render(request, 'campaign/confirm_delete.html', build_context(context))
 
 
 def new_thing(request, thing_type):
@@ -431,7 +461,7 @@ def edit_name(request, name):
         form = ChangeRequiredTextAttributeForm(request.POST)
         if form.is_valid():
             new_name = form.cleaned_data['value']
-            update_thing_name_and_all_related(thing, new_name)
+            rename_thing(thing, new_name)
             return HttpResponseRedirect(reverse('campaign:detail', args=(thing.name,)))
     else:
         form = ChangeRequiredTextAttributeForm({'value': thing.name})
@@ -575,8 +605,29 @@ def bookmark(request, name):
     return HttpResponseRedirect(reverse('campaign:detail', args=(thing.name,)))
 
 
+def get_roll_count(request):
+    try:
+        count = int(request.GET.get('n', 1))
+    except ValueError:
+        raise ValueError('Invalid number of rolls: {0}'.format(request.GET['n']))
+    return max(1, min(count, MAX_ROLLS_PER_REQUEST))
+
+
+def invalid_roll_count(error):
+    return JsonResponse({'error': str(error)}, status=400)
+
+
 def get_random_attribute(request, thing_type, attribute):
     campaign = Campaign.objects.get(is_active=True)
+    if 'n' in request.GET:
+        try:
+            count = get_roll_count(request)
+        except ValueError as e:
+            return invalid_roll_count(e)
+        return JsonResponse({
+            'names': get_random_attributes_raw(campaign=campaign, thing_type=thing_type, attribute=attribute,
+                                               count=count, unique=request.GET.get('unique') == '1')
+        })
     result = get_random_attribute_raw(campaign=campaign, thing_type=thing_type, attribute=attribute)
     if result:
         return JsonResponse({
@@ -587,6 +638,15 @@ def get_random_attribute(request, thing_type, attribute):
 
 
 def get_random_attribute_in_category(request, thing_type, attribute, category):
+    if 'n' in request.GET:
+        try:
+            count = get_roll_count(request)
+        except ValueError as e:
+            return invalid_roll_count(e)
+        return JsonResponse({
+            'names': get_random_attributes_in_category_raw(thing_type, attribute, category,
+                                                           count=count, unique=request.GET.get('unique') == '1')
+        })
     result = get_random_attribute_in_category_raw(thing_type, attribute, category)
     if result:
         return JsonResponse({
@@ -596,6 +656,25 @@ def get_random_attribute_in_category(request, thing_type, attribute, category):
         return JsonResponse({})
 
 
+def get_random_attributes(request, thing_type):
+    campaign = Campaign.objects.get(is_active=True)
+    try:
+        count = get_roll_count(request)
+    except ValueError as e:
+        return invalid_roll_count(e)
+    unique = request.GET.get('unique') == '1'
+    results = {}
+    for attribute in request.GET.getlist('attribute'):
+        if '.' in attribute:
+            attribute_name, category = attribute.split('.', 1)
+            results[attribute] = get_random_attributes_in_category_raw(thing_type, attribute_name, category, count=count, unique=unique)
+        else:
+            results[attribute] = get_random_attributes_raw(campaign=campaign, thing_type=thing_type, attribute=attribute, count=count, unique=unique)
+    return JsonResponse({
+        'results': results
+    })
+
+
 def change_campaign(request, name):
     new_campaign = get_object_or_404(Campaign, name=name)
     old_campaign = Campaign.objects.get(is_active=True)
@@ -808,11 +887,14 @@ def select_object_to_generate(request, thing_type):
         form.refresh_fields(thing_type)
         if form.is_valid():
             if form.cleaned_data['parent']:
-                return HttpResponseRedirect(reverse('campaign:generate_in_location',
-                                                    args=(form.cleaned_data['parent'],
-                                                          form.cleaned_data['generator_object'])))
+                url = reverse('campaign:generate_in_location', args=(form.cleaned_data['parent'], form.cleaned_data['generator_object']))
             else:
-                return HttpResponseRedirect(reverse('campaign:generate', args=(form.cleaned_data['generator_object'],)))
+                url = reverse('campaign:generate', args=(form.cleaned_data['generator_object'],))
+            if form.cleaned_data['preview']:
+                url += '?preview=1'
+            elif form.cleaned_data['background']:
+                url += '?background=1'
+            return HttpResponseRedirect(url)
     else:
         form = SelectGeneratorObjectWithLocation()
         form.refresh_fields(thing_type)
@@ -827,7 +909,17 @@ def select_object_to_generate(request, thing_type):
 def generate_object(request, name):
     generator_object = get_object_or_404(GeneratorObject, name=name)
     campaign = get_object_or_404(Campaign, is_active=True)
-    thing = generate_thing(generator_object, campaign)
+    try:
+        if request.GET.get('preview'):
+            return redirect_to_preview(create_preview(generator_object, campaign))
+        if request.GET.get('background') or should_generate_in_background(generator_object):
+            job = start_generation_job(generator_object, campaign)
+            return HttpResponseRedirect(reverse('campaign:generation_job', args=(job.id,)))
+        thing = generate_thing(generator_object, campaign)
+    except ValueError as e:
+        return render_generation_error(request, generator_object, None, str(e))
+    if not thing:
+        return render_generation_error(request, generator_object, None, 'Could not generate {0}: check the generator configuration'.format(generator_object.name))
     return HttpResponseRedirect(reverse('campaign:detail', args=(thing.name,)))
 
 
@@ -835,15 +927,97 @@ def generate_object_in_location(request, location_name, generator_name):
     generator_object = get_object_or_404(GeneratorObject, name=generator_name)
     campaign = get_object_or_404(Campaign, is_active=True)
     parent = get_object_or_404(Thing, thing_type__name='Location', name__iexact=location_name, campaign=campaign)
-    thing = generate_thing(generator_object, campaign, parent)
+    try:
+        if request.GET.get('preview'):
+            return redirect_to_preview(create_preview(generator_object, campaign, parent))
+        if request.GET.get('background') or should_generate_in_background(generator_object):
+            job = start_generation_job(generator_object, campaign, parent)
+            return HttpResponseRedirect(reverse('campaign:generation_job', args=(job.id,)))
+        thing = generate_thing(generator_object, campaign, parent)
+    except ValueError as e:
+        return render_generation_error(request, generator_object, parent, str(e))
     if thing:
-        parent.children.add(thing)
-        parent.save()
         return HttpResponseRedirect(reverse('campaign:detail', args=(thing.name,)))
     else:
         return HttpResponseRedirect(reverse('campaign:detail', args=(parent.name,)))
 
 
+def render_generation_error(request, generator_object, parent, error):
+    context = {
+        'header': 'Could not generate {0}'.format(generator_object.name),
+        'generator_name': generator_object.name,
+        'parent': parent.name if parent else None,
+        'error': error,
+        'edit_url': reverse('campaign:edit_generator', args=(generator_object.name,))
+    }
+    return render(request, 'campaign/generation_error.html', build_context(context))
+
+
+def redirect_to_preview(preview):
+    if not preview:
+        raise Http404('Could not generate a preview: check the generator configuration')
+    return HttpResponseRedirect(reverse('campaign:generate_preview', args=(preview.token,)))
+
+
+def preview_generated_object(request, token):
+    preview = get_preview(token)
+    if not preview:
+        raise Http404('Preview has expired: {0}'.format(token))
+
+    error = None
+    if request.method == 'POST':
+        if 'reroll' in request.POST:
+            discard_preview(token)
+            generator_object = get_object_or_404(GeneratorObject, name=preview.generator_name)
+            try:
+                return redirect_to_preview(create_preview(generator_object, preview.campaign, preview.parent))
+            except ValueError as e:
+                return render_generation_error(request, generator_object, preview.parent, str(e))
+        elif 'discard' in request.POST:
+            discard_preview(token)
+            if preview.parent:
+                return HttpResponseRedirect(reverse('campaign:detail', args=(preview.parent.name,)))
+            return HttpResponseRedirect(reverse('campaign:list_bookmarks'))
+        else:
+            try:
+                commit_preview(token)
+                return HttpResponseRedirect(reverse('campaign:detail', args=(preview.tree.thing.name,)))
+            except ValueError as e:
+                error = str(e)
+
+    context = {
+        'header': 'Preview: {0}'.format(preview.tree.thing.name),
+        'generator_name': preview.generator_name,
+        'parent': preview.parent.name if preview.parent else None,
+        'thing': preview_to_context(preview.tree),
+        'error': error,
+        'url': reverse('campaign:generate_preview', args=(token,))
+    }
+    return render(request, 'campaign/generator_preview.html', build_context(context))
+
+
+def generation_job(request, job_id):
+    job = get_generation_job(job_id)
+    if not job:
+        raise Http404('Unknown generation job: {0}'.format(job_id))
+    context = {
+        'header': 'Generating {0}'.format(job.generator_name),
+        'job': job.to_json(),
+        'progress_url': reverse('campaign:generation_job_progress', args=(job.id,))
+    }
+    return render(request, 'campaign/generation_job.html', build_context(context))
+
+
+def generation_job_progress(request, job_id):
+    job = get_generation_job(job_id)
+    if not job:
+        raise Http404('Unknown generation job: {0}'.format(job_id))
+    data = job.to_json()
+    if data['thing']:
+        data['url'] = reverse('campaign:detail', args=(data['thing'],))
+    return JsonResponse(data)
+
+
 def new_generator_object(request, thing_type_name):
     thing_type = get_object_or_404(ThingType, name=thing_type_name)
 
@@ -851,8 +1025,11 @@ def new_generator_object(request, thing_type_name):
         form = GeneratorObjectForm(request.POST)
         form.refresh_fields(thing_type)
         if form.is_valid():
-            generator_object = save_new_generator(thing_type=thing_type, form_data=form.cleaned_data)
-            return HttpResponseRedirect(reverse('campaign:list_bookmarks'))
+            try:
+                generator_object = save_new_generator(thing_type=thing_type, form_data=form.cleaned_data)
+                return HttpResponseRedirect(reverse('campaign:list_bookmarks'))
+            except ValueError as e:
+                form.add_error(None, str(e))
         else:
             logger.info(form.errors)
     else:
@@ -868,6 +1045,14 @@ def new_generator_object(request, thing_type_name):
     return render(request, 'campaign/edit_page.html', build_context(context))
 
 
+def get_generator_estimate(generator_object):
+    try:
+        return estimate_generator(generator_object)
+    except ValueError as e:
+        logger.warning('Could not estimate {0}: {1}'.format(generator_object.name, e))
+        return None
+
+
 def edit_generator_object(request, name):
     generator_object = get_object_or_404(GeneratorObject, name__iexact=name)
 
@@ -875,8 +1060,12 @@ def edit_generator_object(request, name):
         form = GeneratorObjectForm(request.POST)
         form.refresh_fields(generator_object.thing_type)
         if form.is_valid():
-            generator_object = edit_generator(generator_object, form.cleaned_data)
-            return HttpResponseRedirect(reverse('campaign:list_bookmarks'))
+            try:
+                generator_object = edit_generator(generator_object, form.cleaned_data)
+                return HttpResponseRedirect(reverse('campaign:list_bookmarks'))
+            except ValueError as e:
+                generator_object.refresh_from_db()
+                form.add_error(None, str(e))
         else:
             logger.info(form.errors)
     else:
@@ -919,7 +1108,9 @@ def edit_generator_object(request, name):
     context = {
         'form': form,
         'header': 'Edit {0} generator'.format(generator_object.name),
-        'url': reverse('campaign:edit_generator', args=(generator_object.name,))
+        'url': reverse('campaign:edit_generator', args=(generator_object.name,)),
+        'estimate': get_generator_estimate(generator_object) if request.GET.get('estimate') else None,
+        'estimate_url': '{0}?estimate=1'.format(reverse('campaign:edit_generator', args=(generator_object.name,)))
     }
 
     return render(request, 'campaign/edit_page.html', build_context(context))
@@ -0,0 +1,79 @@
+import logging
+import random
+
+from .models import WeightPreset, Weight
+
+
+logger = logging.getLogger(__name__)
+
+
+class AliasTable(object):
+    __slots__ = ['values', 'probabilities', 'aliases']
+
+    def __init__(self, weighted_values):
+        self.values = tuple(value for value, weight in weighted_values)
+        count = len(self.values)
+        total = float(sum(weight for value, weight in weighted_values))
+        scaled = [weight * count / total for value, weight in weighted_values]
+        probabilities = [1.0] * count
+        aliases = list(range(count))
+
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            probabilities[s] = scaled[s]
+            aliases[s] = l
+            scaled[l] += scaled[s] - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+
+        self.probabilities = tuple(probabilities)
+        self.aliases = tuple(aliases)
+
+    def sample(self):
+        i = random.randrange(len(self.values))
+        if random.random() < self.probabilities[i]:
+            return self.values[i]
+        return self.values[self.aliases[i]]
+
+
+NO_ACTIVE_PRESET = object()
+
+_alias_tables = {}
+
+
+def build_alias_table(campaign, attribute, options):
+    try:
+        weight_preset = WeightPreset.objects.get(campaign=campaign, attribute_name__iexact=attribute, is_active=True)
+    except WeightPreset.DoesNotExist:
+        return NO_ACTIVE_PRESET
+
+    weights = {}
+    for name_to_weight, weight in Weight.objects.filter(weight_preset=weight_preset).values_list('name_to_weight', 'weight'):
+        weights[name_to_weight.lower()] = weight
+
+    weighted_options = [(option, weights.get(option.lower(), 0)) for option in options]
+    weighted_options = [(option, weight) for option, weight in weighted_options if weight > 0]
+    logger.debug('Compiled {0} preset for {1}: {2} weighted options'.format(weight_preset.name, attribute, len(weighted_options)))
+    if weighted_options:
+        return AliasTable(weighted_options)
+    else:
+        return None
+
+
+def get_alias_table(campaign, compiled_attribute):
+    key = (campaign.pk if campaign else None, compiled_attribute.id)
+    try:
+        return _alias_tables[key]
+    except KeyError:
+        alias_table = build_alias_table(campaign, compiled_attribute.name, compiled_attribute.options)
+        _alias_tables[key] = alias_table
+        return alias_table
+
+
+def clear_alias_tables():
+    _alias_tables.clear()